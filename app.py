@@ -1,25 +1,33 @@
-from flask import Flask, request, jsonify, session, url_for, render_template, send_file, flash, redirect, abort
+from flask import Flask, request, jsonify, session, url_for, render_template, send_file, flash, redirect, abort, copy_current_request_context, Response, stream_with_context
 import os
+import math
 import uuid
 import cv2
 import numpy as np
 from PIL import Image
 import time
 import re
-import zipfile
 import shutil
 import secrets
 from datetime import datetime, timedelta
 import io
-from reportlab.pdfgen import canvas as rl_canvas
-from reportlab.lib.units import mm, cm
-from reportlab.lib.utils import ImageReader
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 from flask_wtf.csrf import CSRFProtect, CSRFError
 import logging
 from logging.handlers import RotatingFileHandler
 from flask_caching import Cache
 from session_manager import SessionManager
+from rect_packers import ENGINES as RECT_PACKING_ENGINES, pack_with_engine
+from layout_search import search_strategies, optimize_layout
+from asset_store import AssetStore
+from image_probe import probe_image
+from png_writer import render_png_sheet
+from render_cache import RenderCache
+from pdf_writer import write_pdf
+from svg_writer import write_svg, linked_images
+from zip_stream import stream_zip, output_set_key
+from worker_health import WorkerHealth
 import json
 
 # Load environment variables from .env file if it exists
@@ -45,6 +53,21 @@ app.config['PERMANENT_SESSION_LIFETIME'] = config.PERMANENT_SESSION_LIFETIME
 app.config['WTF_CSRF_TIME_LIMIT'] = config.WTF_CSRF_TIME_LIMIT
 app.config['SESSION_TIMEOUT'] = config.SESSION_TIMEOUT
 app.config['SESSION_CLEANUP_INTERVAL'] = config.SESSION_CLEANUP_INTERVAL
+app.config['PACKING_ENGINE'] = config.PACKING_ENGINE
+app.config['PACKING_PROCESSES'] = config.PACKING_PROCESSES
+app.config['SYNC_PACKING_TIME_BUDGET'] = config.SYNC_PACKING_TIME_BUDGET
+app.config['SYNC_RENDER_TIME_BUDGET'] = config.SYNC_RENDER_TIME_BUDGET
+app.config['SYNC_RENDER_MEGAPIXELS_PER_SECOND'] = config.SYNC_RENDER_MEGAPIXELS_PER_SECOND
+app.config['ASSET_STORE_FOLDER'] = config.ASSET_STORE_FOLDER
+app.config['ASSET_STORE_MAX_AGE'] = config.ASSET_STORE_MAX_AGE
+app.config['ASSET_STORE_MAX_MB'] = config.ASSET_STORE_MAX_MB
+app.config['PNG_STRIP_HEIGHT'] = config.PNG_STRIP_HEIGHT
+app.config['PNG_CANVAS_BACKEND'] = config.PNG_CANVAS_BACKEND
+app.config['RENDER_CACHE_MB'] = config.RENDER_CACHE_MB
+app.config['OUTPUT_WORKERS'] = config.OUTPUT_WORKERS
+app.config['IMAGE_ENCODE_WORKERS'] = config.IMAGE_ENCODE_WORKERS
+app.config['SVG_IMAGE_MODE'] = config.SVG_IMAGE_MODE
+app.config['TASK_EVENTS_MAX_SECONDS'] = config.TASK_EVENTS_MAX_SECONDS
 
 # Configure caching
 app.config.from_mapping(config.CACHE_CONFIG)
@@ -251,6 +274,12 @@ def handle_unhandled_exception(e):
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+# Decoded design data shared by every stage (and by repeat uploads of the same file)
+asset_store = AssetStore(app.config['ASSET_STORE_FOLDER'], proxy_size=config.ASSET_PROXY_SIZE)
+
+# Live Celery workers per queue, kept in memory from their Redis heartbeats
+worker_health = WorkerHealth(config.REDIS_URL, ttl=config.WORKER_HEARTBEAT_TTL)
+
 def allowed_file(filename):
     """Check if a file has an allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg'}
@@ -262,22 +291,24 @@ def validate_file(file):
         file: The uploaded file object
         
     Returns:
-        tuple: (is_valid, error_message)
+        tuple: (is_valid, error_message, image_info) where image_info holds
+        the width, height, bit depth and alpha presence read from the image
+        headers (None when the file is rejected)
     """
     # Check if file exists
     if not file or file.filename == '':
-        return False, "No file provided"
+        return False, "No file provided", None
     
     # Check filename
     filename = file.filename
     
     # Basic filename security check
     if not allowed_file(filename):
-        return False, f"File type not allowed. Only PNG and JPEG images are accepted."
+        return False, f"File type not allowed. Only PNG and JPEG images are accepted.", None
     
     # Check for suspicious filenames (e.g., path traversal attempts)
     if '..' in filename or '/' in filename or '\\' in filename:
-        return False, "Invalid filename"
+        return False, "Invalid filename", None
     
     # Check file size (max 20MB per file)
     file.seek(0, os.SEEK_END)
@@ -285,7 +316,7 @@ def validate_file(file):
     file.seek(0)  # Reset file pointer
     
     if file_size > 20 * 1024 * 1024:  # 20MB
-        return False, f"File too large. Maximum size is 20MB."
+        return False, f"File too large. Maximum size is 20MB.", None
     
     # Check file content (validate it's actually an image)
     try:
@@ -299,24 +330,31 @@ def validate_file(file):
         jpeg_signature = b'\xff\xd8\xff'
         
         if not (header.startswith(png_signature) or header.startswith(jpeg_signature)):
-            return False, "File content doesn't match expected image format"
+            return False, "File content doesn't match expected image format", None
+        
+        # Dimensions straight from the PNG IHDR / JPEG SOF headers (no pixel decode)
+        image_info = probe_image(file)
         
         # Optional: Try to open the image to verify it's valid
         # This is more thorough but more resource-intensive
         try:
             with Image.open(file) as img:
+                if image_info is None:
+                    # Unusual header layout; PIL has parsed it without decoding either
+                    image_info = {'width': img.width, 'height': img.height,
+                                  'has_alpha': 'A' in img.getbands() or 'transparency' in img.info}
                 img.verify()  # Verify it's an image
                 file.seek(0)  # Reset file pointer after verification
         except Exception:
-            return False, "Invalid image file"
+            return False, "Invalid image file", None
             
         # Reset file pointer again to be safe
         file.seek(0)
         
     except Exception as e:
-        return False, f"Error validating file: {str(e)}"
+        return False, f"Error validating file: {str(e)}", None
     
-    return True, ""
+    return True, "", image_info
 
 def extract_dimensions_cm(filename):
     """Extract width from filename with comprehensive pattern matching."""
@@ -396,12 +434,13 @@ def enhanced_get_image_data(filepath, spacing_mm, custom_width_cm=None):
         if not width_cm or width_cm <= 0:
             return None, {'error': 'No valid width found'}
         
-        # Load and process image
-        img_orig = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
-        if img_orig is None:
+        # Size and mask come from the asset store; the full pixels are only
+        # decoded again when outputs are rendered (see RenderCache)
+        asset = asset_store.get(filepath)
+        if asset is None:
             return None, {'error': 'Failed to load image'}
         
-        h, w = img_orig.shape[:2]
+        h, w = asset['height'], asset['width']
         
         # Calculate dimensions in mm
         width_mm = width_cm * 10.0
@@ -411,19 +450,7 @@ def enhanced_get_image_data(filepath, spacing_mm, custom_width_cm=None):
         width_mm_int = int(round(width_mm))
         height_mm_int = int(round(height_mm))
         
-        # Create mask and convert image to BGRA format (expected by generate_outputs)
-        if len(img_orig.shape) == 2:  # Grayscale
-            mask = (img_orig > 0).astype(np.uint8) * 255
-            img_bgra = cv2.cvtColor(img_orig, cv2.COLOR_GRAY2BGRA)
-        elif img_orig.shape[2] == 3:  # BGR
-            mask = np.ones((img_orig.shape[0], img_orig.shape[1]), dtype=np.uint8) * 255
-            img_bgra = cv2.cvtColor(img_orig, cv2.COLOR_BGR2BGRA)
-            img_bgra[:, :, 3] = 255
-        elif img_orig.shape[2] == 4:  # BGRA
-            mask = (img_orig[:, :, 3] > 0).astype(np.uint8) * 255
-            img_bgra = img_orig
-        else:
-            return None, {'error': f'Unsupported image format: {img_orig.shape}'}
+        mask = asset_store.mask(asset['key'])
         
         # Resize mask to match placement dimensions
         mask = cv2.resize(mask, (width_mm_int, height_mm_int), interpolation=cv2.INTER_NEAREST)
@@ -437,7 +464,8 @@ def enhanced_get_image_data(filepath, spacing_mm, custom_width_cm=None):
         return {
             'path': filepath,
             'filename': os.path.basename(filepath),
-            'img_bgra': img_bgra,  # This is what generate_outputs expects
+            'asset_key': asset['key'],
+            'img_bgra': None,  # Decoded on demand by generate_outputs via RenderCache
             'mask': mask,
             'width_mm': width_mm_int,
             'height_mm': height_mm_int,
@@ -472,16 +500,30 @@ def get_image_data(filepath, spacing_mm):
     
     return image_data
 
-def simple_pack_images(image_data_list, canvas_width_mm, spacing_mm=2):
-    """Smart global packing algorithm that optimizes overall layout like manual arrangement."""
+def simple_pack_images(image_data_list, canvas_width_mm, spacing_mm=2, engine=None, time_budget=None,
+                       allow_rotation=True):
+    """Smart global packing algorithm that optimizes overall layout like manual arrangement.
+
+    engine selects the packer: 'smart' (default search below) or one of the
+    incremental rectangle packers in rect_packers ('maxrects', 'maxrects_bl',
+    'skyline'), which are much faster for large rectangular orders.
+    allow_rotation=False keeps the rectangle packers from turning designs.
+
+    The smart search runs its strategies in a process pool (see layout_search).
+    time_budget (seconds) caps its wall-clock time: strategies still running
+    at the deadline are dropped, and if none finished the skyline engine is
+    used instead.
+    """
     # Ensure canvas width is integer
     canvas_width_mm = int(canvas_width_mm)
     spacing_mm = float(spacing_mm)
+    engine = engine or app.config['PACKING_ENGINE']
     
     log_info(f"Starting image packing algorithm", 
              image_count=len(image_data_list), 
              canvas_width_mm=canvas_width_mm, 
-             spacing_mm=spacing_mm)
+             spacing_mm=spacing_mm,
+             engine=engine)
     
     # Prepare image data with required fields
     images = []
@@ -497,264 +539,72 @@ def simple_pack_images(image_data_list, canvas_width_mm, spacing_mm=2):
             'mask': img_data['mask']
         })
     
-    def is_position_valid(x, y, w, h, placements, exclude_id=None):
-        """Check if position is valid, optionally excluding a specific placement."""
-        for p in placements:
-            if exclude_id and p['id'] == exclude_id:
-                continue
-            if not (x >= p['x_mm'] + p['width_mm'] + spacing_mm or 
-                   p['x_mm'] >= x + w + spacing_mm or
-                   y >= p['y_mm'] + p['height_mm'] + spacing_mm or 
-                   p['y_mm'] >= y + h + spacing_mm):
-                return False
-        return True
-    
-    def calculate_layout_score(placements):
-        """Score the entire layout - lower is better."""
-        if not placements:
-            return float('inf')
-            
-        # Calculate bounding box
-        max_x = max(p['x_mm'] + p['width_mm'] for p in placements)
-        max_y = max(p['y_mm'] + p['height_mm'] for p in placements)
-        
-        # Total area used by images
-        total_image_area = sum(p['width_mm'] * p['height_mm'] for p in placements)
-        
-        # Canvas area
-        canvas_area = canvas_width_mm * max_y
-        
-        # Efficiency score (higher efficiency = lower score)
-        if canvas_area > 0:
-            efficiency = total_image_area / canvas_area
-            efficiency_score = (1.0 - efficiency) * 1000  # Penalty for low efficiency
-        else:
-            efficiency_score = 1000
-        
-        # Height penalty (prefer shorter layouts)
-        height_score = max_y * 0.1
-        
-        # Width utilization bonus (reward using full width)
-        width_utilization = max_x / canvas_width_mm
-        width_score = (1.0 - width_utilization) * 100
-        
-        # Compactness score (penalize scattered layouts)
-        compactness_score = 0
-        for p in placements:
-            # Distance from origin
-            distance_score = (p['x_mm'] + p['y_mm']) * 0.01
-            compactness_score += distance_score
-        
-        total_score = efficiency_score + height_score + width_score + compactness_score
-        return total_score
+    paths = {img['id']: img['path'] for img in images}
     
-    def find_all_positions(w, h, placements, max_positions=100):
-        """Find all valid positions for an image, sorted by preference."""
-        positions = []
-        
-        # Determine search bounds
-        if placements:
-            max_y = max(p['y_mm'] + p['height_mm'] for p in placements)
-            search_height = max_y + h + 100
-        else:
-            search_height = h + 50
-        
-        # Use fine step size for thorough search
-        step = max(1, min(3, min(w, h) // 20))
+    def with_path(placement):
+        """Placement dict in the usual key order, with the image path added."""
+        return {
+            'id': placement['id'],
+            'path': paths[placement['id']],
+            'x_mm': placement['x_mm'],
+            'y_mm': placement['y_mm'],
+            'width_mm': placement['width_mm'],
+            'height_mm': placement['height_mm'],
+            'rotated': placement['rotated']
+        }
+    
+    def pack_with_rect_engine(engine_name):
+        items = [(img['id'], img['width_mm'], img['height_mm']) for img in images]
+        engine_placements, _, strategy_name = pack_with_engine(items, canvas_width_mm, spacing_mm, engine_name,
+                                                               allow_rotation)
+        log_info(f"Selected best packing strategy", strategy=strategy_name, engine=engine_name)
+        return [with_path(p) for p in engine_placements]
+    
+    # Main packing logic
+    if engine in RECT_PACKING_ENGINES:
+        log_info(f"Packing with {engine} engine")
+        placements = pack_with_rect_engine(engine)
+    else:
+        deadline = time.time() + time_budget if time_budget else None
+        items = [(img['id'], img['width_mm'], img['height_mm']) for img in images]
         
-        # Search all positions
-        tested = 0
-        for y in range(0, int(search_height), step):
-            if tested >= max_positions:
-                break
-            for x in range(0, canvas_width_mm - w + 1, step):
-                if tested >= max_positions:
-                    break
-                    
-                if is_position_valid(x, y, w, h, placements):
-                    # Calculate position score
-                    score = y * 2.0 + x * 0.1  # Prefer bottom-left but not too aggressively
-                    
-                    # Bonus for edge contact
-                    if x == 0:
-                        score -= 20
-                    if y == 0:
-                        score -= 30
-                        
-                    # Bonus for touching existing images
-                    for p in placements:
-                        # Check adjacency
-                        if (abs(x + w - p['x_mm']) <= spacing_mm + 1 or 
-                            abs(x - (p['x_mm'] + p['width_mm'])) <= spacing_mm + 1) and \
-                           not (y + h <= p['y_mm'] - spacing_mm or y >= p['y_mm'] + p['height_mm'] + spacing_mm):
-                            score -= 15
-                        if (abs(y + h - p['y_mm']) <= spacing_mm + 1 or 
-                            abs(y - (p['y_mm'] + p['height_mm'])) <= spacing_mm + 1) and \
-                           not (x + w <= p['x_mm'] - spacing_mm or x >= p['x_mm'] + p['width_mm'] + spacing_mm):
-                            score -= 20  # Prefer vertical stacking
-                    
-                    positions.append((x, y, score))
-                    tested += 1
-        
-        # Sort by score (best first)
-        positions.sort(key=lambda p: p[2])
-        return positions[:50]  # Return top 50 positions
-    
-    def try_placement_strategies(images):
-        """Try multiple placement strategies and return the best one."""
-        strategies = [
-            ("largest_first", lambda x: -x['area_mm2']),
-            ("tallest_first", lambda x: -x['height_mm']),
-            ("widest_first", lambda x: -x['width_mm']),
-            ("smallest_first", lambda x: x['area_mm2']),
-            ("balanced", lambda x: (-max(x['width_mm'], x['height_mm']), -x['area_mm2']))
-        ]
+        log_info("Phase 1: Starting placement strategies",
+                 processes=app.config['PACKING_PROCESSES'],
+                 time_budget=time_budget)
+        results = search_strategies(items, canvas_width_mm, spacing_mm,
+                                    processes=app.config['PACKING_PROCESSES'],
+                                    deadline=deadline)
         
         best_layout = None
         best_score = float('inf')
         best_strategy_name = None
-        
-        for strategy_name, sort_func in strategies:
-            log_debug(f"Trying packing strategy: {strategy_name}")
-            sorted_images = sorted(images, key=sort_func)
-            
+        for strategy_name, layout_score, strategy_placements in results:
+            if not strategy_placements:
+                continue
+            log_info(f"Strategy {strategy_name} result", 
+                     images_placed=len(strategy_placements), 
+                     score=layout_score)
+            if layout_score < best_score:
+                best_score = layout_score
+                best_layout = strategy_placements
+                best_strategy_name = strategy_name
+        
+        if best_layout is None and results:
             placements = []
+        elif best_layout is None:
+            # Nothing finished within the budget: fall back to the fast packer
+            log_warning("No packing strategy finished within the time budget, using skyline engine",
+                        time_budget=time_budget)
+            placements = pack_with_rect_engine('skyline')
+        else:
+            log_info(f"Selected best packing strategy", 
+                     strategy=best_strategy_name, 
+                     score=best_score)
+            placements = [with_path(p) for p in best_layout]
             
-            for img in sorted_images:
-                best_placement = None
-                best_placement_score = float('inf')
-                
-                # Try both orientations
-                orientations = [
-                    (img['width_mm'], img['height_mm'], False),
-                    (img['height_mm'], img['width_mm'], True)
-                ]
-                
-                for w, h, rotated in orientations:
-                    if w > canvas_width_mm:
-                        continue
-                    
-                    positions = find_all_positions(w, h, placements)
-                    
-                    # Try top 10 positions for this orientation
-                    for x, y, pos_score in positions[:10]:
-                        # Create temporary placement
-                        temp_placement = {
-                            'id': img['id'],
-                            'path': img['path'],
-                            'x_mm': x,
-                            'y_mm': y,
-                            'width_mm': w,
-                            'height_mm': h,
-                            'rotated': rotated
-                        }
-                        
-                        # Test the layout with this placement
-                        test_placements = placements + [temp_placement]
-                        layout_score = calculate_layout_score(test_placements)
-                        
-                        if layout_score < best_placement_score:
-                            best_placement_score = layout_score
-                            best_placement = temp_placement
-                
-                if best_placement:
-                    placements.append(best_placement)
-                    log_debug(f"Placed {img['filename']} at ({best_placement['x_mm']:.1f}, {best_placement['y_mm']:.1f}) "
-                             f"size {best_placement['width_mm']}x{best_placement['height_mm']} "
-                             f"{'rotated' if best_placement['rotated'] else ''}")
-            
-            # Score this complete layout
-            if placements:
-                layout_score = calculate_layout_score(placements)
-                log_info(f"Strategy {strategy_name} result", 
-                         images_placed=len(placements), 
-                         score=layout_score)
-                
-                if layout_score < best_score:
-                    best_score = layout_score
-                    best_layout = placements
-                    best_strategy_name = strategy_name
-        
-        log_info(f"Selected best packing strategy", 
-                 strategy=best_strategy_name, 
-                 score=best_score)
-        return best_layout if best_layout else []
-    
-    def optimize_layout(placements):
-        """Post-process to optimize the layout by trying to rearrange items."""
-        if len(placements) <= 1:
-            return placements
-            
-        log_info("Starting layout optimization")
-        improved = True
-        iterations = 0
-        max_iterations = 3
-        
-        while improved and iterations < max_iterations:
-            improved = False
-            iterations += 1
-            
-            # Try to move each image to a better position
-            for i, placement in enumerate(placements):
-                current_layout_score = calculate_layout_score(placements)
-                
-                # Remove this placement temporarily
-                temp_placements = [p for j, p in enumerate(placements) if j != i]
-                
-                # Find better positions for this image
-                w, h = placement['width_mm'], placement['height_mm']
-                positions = find_all_positions(w, h, temp_placements, max_positions=50)
-                
-                # Try different orientations too
-                orientations = [
-                    (placement['width_mm'], placement['height_mm'], placement['rotated']),
-                    (placement['height_mm'], placement['width_mm'], not placement['rotated'])
-                ]
-                
-                best_new_placement = placement
-                best_new_score = current_layout_score
-                
-                for test_w, test_h, test_rotated in orientations:
-                    if test_w > canvas_width_mm:
-                        continue
-                        
-                    test_positions = find_all_positions(test_w, test_h, temp_placements, max_positions=30)
-                    
-                    for x, y, _ in test_positions[:15]:  # Try top 15 positions
-                        new_placement = {
-                            'id': placement['id'],
-                            'path': placement['path'],
-                            'x_mm': x,
-                            'y_mm': y,
-                            'width_mm': test_w,
-                            'height_mm': test_h,
-                            'rotated': test_rotated
-                        }
-                        
-                        test_layout = temp_placements + [new_placement]
-                        test_score = calculate_layout_score(test_layout)
-                        
-                        if test_score < best_new_score:
-                            best_new_score = test_score
-                            best_new_placement = new_placement
-                            improved = True
-                
-                # Update placement if improvement found
-                if improved:
-                    placements[i] = best_new_placement
-                    log_debug(f"Moved {placement['id']} for better layout "
-                             f"(score improved by {current_layout_score - best_new_score:.1f})")
-        
-        log_info(f"Layout optimization completed", iterations=iterations)
-        return placements
-    
-    # Main packing logic
-    log_info("Phase 1: Starting placement strategies")
-    placements = try_placement_strategies(images)
-    
-    if placements:
-        log_info("Phase 2: Starting layout optimization")
-        placements = optimize_layout(placements)
+            log_info("Phase 2: Starting layout optimization")
+            placements = optimize_layout(placements, canvas_width_mm, spacing_mm, deadline)
+            log_info("Layout optimization completed")
     
     # Calculate final statistics
     if placements:
@@ -782,6 +632,13 @@ def simple_pack_images(image_data_list, canvas_width_mm, spacing_mm=2):
         'image_data_map': {img['id']: img for img in images}
     }
 
+def estimate_render_seconds(pack_result, png_dpi):
+    """Rough time generate_outputs takes for a packed sheet, from its size at the PNG DPI."""
+    pixels_per_mm = png_dpi / 25.4
+    megapixels = (pack_result['canvas_width_mm'] * pixels_per_mm *
+                  pack_result['final_canvas_height_mm'] * pixels_per_mm) / 1e6
+    return megapixels / app.config['SYNC_RENDER_MEGAPIXELS_PER_SECOND']
+
 def generate_outputs(pack_result, config, output_dir):
     import time
     
@@ -800,6 +657,11 @@ def generate_outputs(pack_result, config, output_dir):
     })
     
     outputs = {}
+    # Converted/rotated design pixels shared by the PNG, SVG and PDF writers; only
+    # kept when a PDF or SVG needs the full-resolution images
+    render_cache = RenderCache(app.config['RENDER_CACHE_MB'] * 1024 * 1024,
+                               keep_rgba=output_formats.get('generate_pdf', True)
+                               or output_formats.get('generate_svg', True))
     timing_info = {
         'total_start': time.time(),
         'png_time': 0,
@@ -807,6 +669,9 @@ def generate_outputs(pack_result, config, output_dir):
         'pdf_time': 0,
         'report_time': 0,
         'zip_time': 0,
+        'parallel_time': 0,
+        'critical_path': None,
+        'critical_path_time': 0,
         'total_time': 0
     }
     
@@ -815,49 +680,26 @@ def generate_outputs(pack_result, config, output_dir):
              canvas_size=f"{canvas_width_mm}x{final_canvas_height_mm}mm",
              formats=','.join([k for k, v in output_formats.items() if v]))
     
-    # Generate PNG
-    if output_formats.get('generate_png', True):
+    def generate_png():
+        """PNG sheet (streamed to disk)."""
         png_start = time.time()
         try:
             log_info("Generating PNG output")
             canvas_width_px = int(canvas_width_mm * pixels_per_mm_png)
             canvas_height_px = int(final_canvas_height_mm * pixels_per_mm_png)
             
-            final_png_canvas = Image.new('RGBA', (canvas_width_px, canvas_height_px), (0, 0, 0, 0))
-        
-            for i, p in enumerate(placements):
-                if i % 10 == 0:  # Progress indicator
-                    log_debug(f"Processing PNG image {i+1}/{len(placements)}")
-                    
-                img_data = image_data_map.get(p['id'])
-                if not img_data:
-                    continue
-        
-                try:
-                    img_bgra_orig = img_data['img_bgra']
-                    if img_bgra_orig is None:
-                        continue
-                         
-                    img_rgba_pil = Image.fromarray(cv2.cvtColor(img_bgra_orig, cv2.COLOR_BGRA2RGBA))
-        
-                    if p['rotated']:
-                        img_rgba_pil = img_rgba_pil.rotate(90, expand=True)
-        
-                    target_width_px = int(p['width_mm'] * pixels_per_mm_png)
-                    target_height_px = int(p['height_mm'] * pixels_per_mm_png)
-        
-                    img_resized = img_rgba_pil.resize((target_width_px, target_height_px), Image.Resampling.LANCZOS)
-        
-                    pos_x_px = int(p['x_mm'] * pixels_per_mm_png)
-                    pos_y_px = int(p['y_mm'] * pixels_per_mm_png)
-        
-                    final_png_canvas.paste(img_resized, (pos_x_px, pos_y_px), img_resized)
-        
-                except Exception as e:
-                    log_error(f"Error processing image for PNG", image_id=p['id'], error=str(e))
-        
             png_path = os.path.join(output_dir, 'packed_output.png')
-            final_png_canvas.save(png_path)
+            
+            # Streamed to disk band by band (or through a memory-mapped canvas);
+            # the full sheet is never held in memory
+            render_png_sheet(placements, image_data_map, png_path,
+                             canvas_width_px, canvas_height_px, pixels_per_mm_png,
+                             backend=app.config['PNG_CANVAS_BACKEND'],
+                             band_height=app.config['PNG_STRIP_HEIGHT'],
+                             dpi=config['png_dpi'],
+                             on_error=lambda p, e: log_error(f"Error processing image for PNG",
+                                                             image_id=p['id'], error=str(e)),
+                             render_cache=render_cache)
             outputs['png'] = png_path
             timing_info['png_time'] = time.time() - png_start
             log_info(f"PNG generation completed", 
@@ -867,80 +709,20 @@ def generate_outputs(pack_result, config, output_dir):
         except Exception as e:
             timing_info['png_time'] = time.time() - png_start
             log_error(f"Error generating PNG output", error=str(e))
-    else:
-        log_info("Skipping PNG generation (not selected)")
 
-    # Generate SVG for Illustrator
-    if output_formats.get('generate_svg', True):
+    def generate_svg():
+        """SVG for Illustrator."""
         svg_start = time.time()
         try:
             log_info("Generating SVG output")
-            import base64
-            
             svg_path = os.path.join(output_dir, 'packed_output.svg')
             
-            # Convert mm to SVG units (1mm = 3.779528 SVG units)
-            svg_scale = 3.779528
-            svg_width = canvas_width_mm * svg_scale
-            svg_height = final_canvas_height_mm * svg_scale
-            
-            svg_content = [
-                f'<?xml version="1.0" encoding="UTF-8"?>',
-                f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"',
-                f'     width="{svg_width:.2f}" height="{svg_height:.2f}"',
-                f'     viewBox="0 0 {svg_width:.2f} {svg_height:.2f}">',
-                f'  <!-- DTF Layout: {canvas_width_mm}mm x {final_canvas_height_mm}mm -->',
-                f'  <!-- Generated by DTF Packer - {len(placements)} images placed -->',
-                ''
-            ]
-            
-            # Add each image as embedded base64
-            for i, p in enumerate(placements):
-                if i % 10 == 0:  # Progress indicator
-                    log_debug(f"Processing SVG image {i+1}/{len(placements)}")
-                    
-                img_data = image_data_map.get(p['id'])
-                if not img_data:
-                    continue
-                    
-                try:
-                    img_bgra_orig = img_data['img_bgra']
-                    if img_bgra_orig is None:
-                        continue
-                        
-                    img_rgba_pil = Image.fromarray(cv2.cvtColor(img_bgra_orig, cv2.COLOR_BGRA2RGBA))
-                    
-                    if p['rotated']:
-                        img_rgba_pil = img_rgba_pil.rotate(90, expand=True)
-                    
-                    # Convert to base64 for embedding
-                    img_buffer = io.BytesIO()
-                    img_rgba_pil.save(img_buffer, format='PNG', optimize=True)
-                    img_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-                    img_buffer.close()
-                    
-                    # Calculate SVG positions and dimensions
-                    x_svg = p['x_mm'] * svg_scale
-                    y_svg = p['y_mm'] * svg_scale
-                    width_svg = p['width_mm'] * svg_scale
-                    height_svg = p['height_mm'] * svg_scale
-                    
-                    # Add image to SVG
-                    svg_content.extend([
-                        f'  <!-- {p["id"]} - {p["width_mm"]}x{p["height_mm"]}mm {"(rotated)" if p["rotated"] else ""} -->',
-                        f'  <image x="{x_svg:.2f}" y="{y_svg:.2f}" width="{width_svg:.2f}" height="{height_svg:.2f}"',
-                        f'         xlink:href="data:image/png;base64,{img_base64}"/>',
-                        ''
-                    ])
-                    
-                except Exception as e:
-                    log_error(f"Error processing image for SVG", image_id=p['id'], error=str(e))
-            
-            svg_content.append('</svg>')
-            
-            # Write SVG file
-            with open(svg_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(svg_content))
+            # One image per unique design, referenced by every placement
+            write_svg(placements, image_data_map, svg_path, canvas_width_mm, final_canvas_height_mm,
+                      render_cache=render_cache, workers=app.config['IMAGE_ENCODE_WORKERS'],
+                      on_error=lambda p, e: log_error(f"Error processing image for SVG",
+                                                      image_id=p['id'], error=str(e)),
+                      mode=app.config['SVG_IMAGE_MODE'])
                 
             outputs['svg'] = svg_path
             timing_info['svg_time'] = time.time() - svg_start
@@ -951,58 +733,19 @@ def generate_outputs(pack_result, config, output_dir):
         except Exception as e:
             timing_info['svg_time'] = time.time() - svg_start
             log_error(f"Error generating SVG output", error=str(e))
-    else:
-        log_info("Skipping SVG generation (not selected)")
 
-    # Generate PDF
-    if output_formats.get('generate_pdf', True):
+    def generate_pdf():
+        """Print-ready PDF."""
         pdf_start = time.time()
         try:
             log_info("Generating PDF output")
-            pdf_width_pt = (canvas_width_mm + 2 * pdf_margin_cm * 10) * mm
-            pdf_height_pt = (final_canvas_height_mm + 2 * pdf_margin_cm * 10) * mm
-            pdf_margin_pt = pdf_margin_cm * cm
-
             pdf_path = os.path.join(output_dir, 'packed_output.pdf')
-            c = rl_canvas.Canvas(pdf_path, pagesize=(pdf_width_pt, pdf_height_pt))
-
-            for i, p in enumerate(placements):
-                if i % 10 == 0:  # Progress indicator
-                    log_debug(f"Processing PDF image {i+1}/{len(placements)}")
-                    
-                img_data = image_data_map.get(p['id'])
-                if not img_data: 
-                    continue
-
-                try:
-                    img_bgra_orig = img_data['img_bgra']
-                    if img_bgra_orig is None:
-                        continue
-                        
-                    img_rgba_pil = Image.fromarray(cv2.cvtColor(img_bgra_orig, cv2.COLOR_BGRA2RGBA))
-
-                    if p['rotated']:
-                        img_rgba_pil = img_rgba_pil.rotate(90, expand=True)
-
-                    width_pt = p['width_mm'] * mm
-                    height_pt = p['height_mm'] * mm
-                    x_pt = p['x_mm'] * mm + pdf_margin_pt
-                    y_pt = pdf_height_pt - (p['y_mm'] * mm + pdf_margin_pt + height_pt) 
-
-                    img_buffer = io.BytesIO()
-                    try:
-                        img_rgba_pil.save(img_buffer, format='PNG', optimize=False)
-                        img_buffer.seek(0)
-                        img_reader = ImageReader(img_buffer)
-
-                        c.drawImage(img_reader, x_pt, y_pt, width=width_pt, height=height_pt, mask='auto')
-                    finally:
-                        img_buffer.close()
-
-                except Exception as e:
-                    log_error(f"Error processing image for PDF", image_id=p['id'], error=str(e))
-
-            c.save()
+            # Designs are encoded concurrently and embedded once per (asset, rotation)
+            write_pdf(placements, image_data_map, pdf_path, canvas_width_mm, final_canvas_height_mm,
+                      margin_mm=pdf_margin_cm * 10, render_cache=render_cache,
+                      workers=app.config['IMAGE_ENCODE_WORKERS'],
+                      on_error=lambda p, e: log_error(f"Error processing image for PDF",
+                                                      image_id=p['id'], error=str(e)))
             outputs['pdf'] = pdf_path
             timing_info['pdf_time'] = time.time() - pdf_start
             log_info(f"PDF generation completed", 
@@ -1012,11 +755,9 @@ def generate_outputs(pack_result, config, output_dir):
         except Exception as e:
             timing_info['pdf_time'] = time.time() - pdf_start
             log_error(f"Error generating PDF output", error=str(e))
-    else:
-        log_info("Skipping PDF generation (not selected)")
-    
-    # Generate placement report
-    if output_formats.get('generate_report', True):
+
+    def generate_report():
+        """Placement report."""
         report_start = time.time()
         try:
             log_info("Generating placement report")
@@ -1033,8 +774,36 @@ def generate_outputs(pack_result, config, output_dir):
         except Exception as e:
             timing_info['report_time'] = time.time() - report_start
             log_error(f"Error generating report", error=str(e))
-    else:
-        log_info("Skipping report generation (not selected)")
+    
+    # Formats are independent, so they run concurrently. Threads (not processes)
+    # let them share render_cache; the heavy parts (PIL resampling/compositing,
+    # zlib) release the GIL.
+    format_jobs = [
+        ('png', 'PNG', generate_png),
+        ('svg', 'SVG', generate_svg),
+        ('pdf', 'PDF', generate_pdf),
+        ('report', 'report', generate_report),
+    ]
+    selected = []
+    for name, label, job in format_jobs:
+        if output_formats.get(f'generate_{name}', True):
+            selected.append((name, job))
+        else:
+            log_info(f"Skipping {label} generation (not selected)")
+    
+    stage_start = time.time()
+    if selected:
+        with ThreadPoolExecutor(max_workers=min(app.config['OUTPUT_WORKERS'], len(selected))) as executor:
+            futures = [executor.submit(copy_current_request_context(job)) for _, job in selected]
+            for future in futures:
+                future.result()
+    timing_info['parallel_time'] = time.time() - stage_start
+    # The stage takes as long as its slowest format
+    format_times = {name: timing_info[f'{name}_time'] for name, _ in selected}
+    timing_info['critical_path'] = max(format_times, key=format_times.get) if format_times else None
+    timing_info['critical_path_time'] = max(format_times.values(), default=0)
+    
+    log_debug("Render cache usage", hits=render_cache.hits, misses=render_cache.misses)
     
     # Calculate total time and add timing info to outputs
     timing_info['total_time'] = time.time() - timing_info['total_start']
@@ -1046,7 +815,9 @@ def generate_outputs(pack_result, config, output_dir):
              png_time=f"{timing_info['png_time']:.2f}s" if 'png' in outputs else None,
              svg_time=f"{timing_info['svg_time']:.2f}s" if 'svg' in outputs else None,
              pdf_time=f"{timing_info['pdf_time']:.2f}s" if 'pdf' in outputs else None,
-             report_time=f"{timing_info['report_time']:.2f}s" if 'report' in outputs else None)
+             report_time=f"{timing_info['report_time']:.2f}s" if 'report' in outputs else None,
+             parallel_time=f"{timing_info['parallel_time']:.2f}s",
+             critical_path=timing_info['critical_path'])
     
     return outputs
 
@@ -1103,7 +874,7 @@ def upload_files():
     
     for file in files:
         # Comprehensive file validation
-        is_valid, error_message = validate_file(file)
+        is_valid, error_message, image_info = validate_file(file)
         
         if not is_valid:
             log_warning(f"Rejected file upload", 
@@ -1141,11 +912,10 @@ def upload_files():
                     'status': 'detected'
                 })
                 
-                # Get additional image info
+                # Get additional image info (probed from the headers during validation)
                 try:
-                    img = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
-                    if img is not None:
-                        h, w = img.shape[:2]
+                    if image_info:
+                        h, w = image_info['height'], image_info['width']
                         aspect_ratio = h / w
                         detection_info.update({
                             'pixel_dimensions': f"{w}x{h}",
@@ -1293,6 +1063,9 @@ def process_with_dimensions():
     spacing_mm = float(request.form.get('spacing_mm', 3))
     allow_rotation = request.form.get('allow_rotation') == 'on'
     png_dpi = int(request.form.get('png_dpi', 150))
+    packing_engine = request.form.get('packing_engine', app.config['PACKING_ENGINE'])
+    if packing_engine != 'smart' and packing_engine not in RECT_PACKING_ENGINES:
+        return jsonify({'error': f'Unknown packing engine: {packing_engine}'}), 400
     
     # Get output format selections
     output_formats = {
@@ -1316,18 +1089,18 @@ def process_with_dimensions():
             'allow_rotation': allow_rotation,
             'png_dpi': png_dpi,
             'pdf_margin_cm': 1.0,
+            'packing_engine': packing_engine,
             'output_formats': output_formats
         }
         
         # Import the Celery task
-        from celery_tasks import process_designs
+        from celery_tasks import process_designs, queues_for
         
         # Try asynchronous processing first
         try:
-            # Test if Celery is available by pinging it
-            from celery.task.control import inspect
-            insp = inspect()
-            if insp.ping():
+            # Workers for every queue this job uses must be alive (answered from memory)
+            design_count = sum(1 for item in file_info if item['detected_width'])
+            if worker_health.available(queues_for(design_count)):
                 # Celery is available, use async processing
                 app.logger.info("Using asynchronous processing with Celery")
                 task = process_designs.delay(upload_id, config, file_info)
@@ -1351,6 +1124,7 @@ def process_with_dimensions():
             app.logger.warning(f"Falling back to synchronous processing: {str(e)}")
             
             # Process images with custom dimensions (synchronous fallback)
+            sync_started = time.time()
             upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], upload_id)
             image_data_list = []
             
@@ -1374,8 +1148,26 @@ def process_with_dimensions():
                 log_warning("No valid images to process after processing", session_id=upload_id)
                 return jsonify({'error': 'No valid images to process'}), 400
             
-            # Pack images
-            pack_result = simple_pack_images(image_data_list, int(canvas_width_cm * 10), spacing_mm)
+            # Pack images within what is left of the sync budget, so the
+            # request still finishes before the gunicorn worker timeout
+            time_budget = max(1.0, app.config['SYNC_PACKING_TIME_BUDGET'] - (time.time() - sync_started))
+            pack_result = simple_pack_images(image_data_list, int(canvas_width_cm * 10), spacing_mm,
+                                             engine=packing_engine, time_budget=time_budget,
+                                             allow_rotation=allow_rotation)
+            
+            # Outputs cannot be interrupted, so only start them if the sheet should
+            # render in what is left of the sync budget
+            render_time_left = (sync_started + app.config['SYNC_PACKING_TIME_BUDGET'] +
+                                app.config['SYNC_RENDER_TIME_BUDGET'] - time.time())
+            render_estimate = estimate_render_seconds(pack_result, config['png_dpi'])
+            if render_estimate > render_time_left:
+                log_warning("Sheet too large to render without Celery workers",
+                            session_id=upload_id,
+                            estimated_seconds=f"{render_estimate:.0f}",
+                            seconds_left=f"{render_time_left:.0f}")
+                return jsonify({'error': 'This sheet is too large to generate while the background workers '
+                                         'are unavailable. Please try again later, or use fewer or smaller '
+                                         'designs or a lower PNG DPI.'}), 503
             
             # Generate outputs
             outputs = generate_outputs(pack_result, config, upload_dir)
@@ -1461,16 +1253,57 @@ def api_task_status(task_id):
         # Add redirect to results page
         status_data['redirect'] = url_for('show_results')
     
-    pack_result = session['pack_result']
-    outputs = session['outputs']
-    summary = session.get('summary', {})
-    config = session.get('config', {})
+    # The result is kept in the session, not sent to the browser
+    status_data.pop('result', None)
+    return jsonify(status_data)
+
+@app.route('/api/task-events/<task_id>')
+def api_task_events(task_id):
+    """Server-Sent Events stream of a task's status, pushed whenever it changes."""
+    from celery_tasks import get_task_status, subscribe_task_status
     
-    return render_template('results.html', 
-                         pack_result=pack_result,
-                         outputs=outputs,
-                         summary=summary,
-                         config=config)
+    # Check if this is the current user's task
+    if 'task_id' not in session or session['task_id'] != task_id:
+        return jsonify({'error': 'Invalid task ID or session expired'}), 403
+    
+    # A stream would tie up a whole sync worker; those are kept for packing and
+    # rendering (streams go to gunicorn_events.conf.py), so the page polls instead
+    if not request.environ.get('wsgi.multithread'):
+        return jsonify({'error': 'Task events are not served by this worker'}), 503
+    
+    try:
+        pubsub = subscribe_task_status(task_id)
+    except Exception as e:
+        # The page falls back to polling /api/task-status
+        log_warning(f"Task event stream unavailable", task_id=task_id, error=str(e))
+        return jsonify({'error': 'Task events unavailable'}), 503
+    
+    max_seconds = app.config['TASK_EVENTS_MAX_SECONDS']
+    
+    def generate():
+        try:
+            # Subscribed before reading the current status, so no change is missed
+            status_data = get_task_status(task_id) or {'status': 'PENDING', 'message': 'Waiting for a worker'}
+            status_data.pop('result', None)
+            yield f'data: {json.dumps(status_data)}\n\n'
+            
+            deadline = time.time() + max_seconds
+            while status_data.get('status') not in ('SUCCESS', 'FAILURE') and time.time() < deadline:
+                # Never wait past the deadline, so the stream ends on time
+                wait = min(15, max(deadline - time.time(), 0))
+                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=wait)
+                if message is None:
+                    # Comment line every 15s keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                status_data = json.loads(message['data'])
+                yield f'data: {json.dumps(status_data)}\n\n'
+            # On timeout the browser's EventSource reconnects by itself
+        finally:
+            pubsub.close()
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/configure')
 def configure():
@@ -1484,7 +1317,7 @@ def configure():
     # Get list of filenames for display
     files = [f['filename'] for f in file_info]
     
-    return render_template('configure.html', files=files)
+    return render_template('configure.html', files=files, packing_engine=app.config['PACKING_ENGINE'])
 
 @app.route('/process', methods=['POST'])
 def process_images():
@@ -1569,37 +1402,13 @@ def get_preview_image(upload_id, filename):
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
         
-        # Load image
-        img = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
-        if img is None:
+        # The stored proxy is already an RGBA PNG of at most 800px on its longest side
+        asset = asset_store.get(filepath)
+        if asset is None:
             return jsonify({'error': 'Cannot read image'}), 400
         
-        # Convert to PIL for processing
-        if len(img.shape) == 2:  # Grayscale
-            img_pil = Image.fromarray(img, mode='L')
-            img_pil = img_pil.convert('RGBA')
-        elif img.shape[2] == 3:  # BGR
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_pil = Image.fromarray(img_rgb, mode='RGB')
-            img_pil = img_pil.convert('RGBA')
-        elif img.shape[2] == 4:  # BGRA
-            img_rgba = cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
-            img_pil = Image.fromarray(img_rgba, mode='RGBA')
-        else:
-            return jsonify({'error': 'Unsupported image format'}), 400
-        
-        # Resize for preview if too large (max 800px on longest side)
-        max_size = 800
-        if max(img_pil.width, img_pil.height) > max_size:
-            img_pil.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-        
-        # Convert to bytes
-        img_buffer = io.BytesIO()
-        img_pil.save(img_buffer, format='PNG', optimize=True)
-        img_buffer.seek(0)
-        
         return send_file(
-            img_buffer,
+            asset_store.proxy_path(asset['key']),
             mimetype='image/png',
             as_attachment=False,
             download_name=f'preview_{filename}'
@@ -1628,36 +1437,18 @@ def get_thumbnail(upload_id, filename):
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
         
-        # Load image
-        img = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
-        if img is None:
+        # Build the thumbnail from the stored proxy instead of the full image
+        asset = asset_store.get(filepath)
+        if asset is None:
             return jsonify({'error': 'Cannot read image'}), 400
         
-        # Convert to PIL for easier thumbnail generation
-        if len(img.shape) == 2:  # Grayscale
-            img_pil = Image.fromarray(img, mode='L')
-            # Convert to RGBA to add transparency
-            img_pil = img_pil.convert('RGBA')
-        elif img.shape[2] == 3:  # BGR
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_pil = Image.fromarray(img_rgb, mode='RGB')
-            # Convert to RGBA and make white background transparent
-            img_pil = img_pil.convert('RGBA')
-            # Make white/light colors transparent for better display
-            datas = img_pil.getdata()
-            newData = []
-            for item in datas:
-                # Make near-white pixels transparent
-                if item[0] > 240 and item[1] > 240 and item[2] > 240:
-                    newData.append((255, 255, 255, 0))  # Transparent
-                else:
-                    newData.append(item)
-            img_pil.putdata(newData)
-        elif img.shape[2] == 4:  # BGRA
-            img_rgba = cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
-            img_pil = Image.fromarray(img_rgba, mode='RGBA')
-        else:
-            return jsonify({'error': 'Unsupported image format'}), 400
+        img_pil = Image.open(asset_store.proxy_path(asset['key'])).convert('RGBA')
+        if asset['channels'] == 3:
+            # Make near-white pixels transparent for better display
+            pixels = np.array(img_pil)
+            near_white = (pixels[:, :, :3] > 240).all(axis=2)
+            pixels[near_white] = (255, 255, 255, 0)
+            img_pil = Image.fromarray(pixels, mode='RGBA')
         
         # Create thumbnail (80x80) while maintaining aspect ratio
         thumbnail_size = (80, 80)
@@ -1700,39 +1491,43 @@ def download_results():
     upload_id = session['upload_id']
     outputs = session['outputs']
     
-    zip_path = os.path.join(app.config['OUTPUT_FOLDER'], f'{upload_id}_results.zip')
-    
     try:
-        zip_start = time.time()
-        log_info("Generating ZIP file for download", session_id=upload_id)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as zipf:
-            for output_type, filepath in outputs.items():
-                if output_type == 'timing':  # Skip timing info
-                    continue
-                    
-                if os.path.exists(filepath):
-                    archive_name = os.path.basename(filepath)
-                    zipf.write(filepath, archive_name)
-                    log_debug(f"Added {archive_name} to ZIP file", file_size=os.path.getsize(filepath))
-        
-        zip_time = time.time() - zip_start
-        log_info(f"ZIP file created", 
-                 time_taken=f"{zip_time:.2f}s", 
-                 file_size=os.path.getsize(zip_path))
-        
-        # Update timing info in session if available
-        if 'timing' in outputs:
-            outputs['timing']['zip_time'] = zip_time
-            session['outputs'] = outputs
+        members = []
+        for output_type, filepath in outputs.items():
+            if output_type == 'timing':  # Skip timing info
+                continue
+                
+            if os.path.exists(filepath):
+                members.append((filepath, os.path.basename(filepath)))
+                
+                # A linked SVG needs its image folder next to it
+                if output_type == 'svg':
+                    members.extend(linked_images(filepath))
         
-        if not os.path.exists(zip_path):
+        if not members:
             flash('Error creating download file')
             return redirect(url_for('show_results'))
-            
+        
         filename = f'packing_results_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
-        log_info(f"Sending download file to client", filename=filename, file_size=os.path.getsize(zip_path))
-        return send_file(zip_path, as_attachment=True, download_name=filename)
+        
+        # Unchanged outputs are served from the archive built by an earlier download
+        zip_path = os.path.join(app.config['OUTPUT_FOLDER'],
+                                f'{upload_id}_results_{output_set_key(members)[:16]}.zip')
+        if os.path.exists(zip_path):
+            log_info(f"Sending cached ZIP file to client", filename=filename, file_size=os.path.getsize(zip_path))
+            return send_file(zip_path, as_attachment=True, download_name=filename)
+        
+        log_info("Streaming ZIP file to client", session_id=upload_id, file_count=len(members))
+        
+        def generate():
+            zip_start = time.time()
+            yield from stream_zip(members, cache_path=zip_path)
+            log_info(f"ZIP file streamed", 
+                     time_taken=f"{time.time() - zip_start:.2f}s", 
+                     file_size=os.path.getsize(zip_path))
+        
+        return Response(stream_with_context(generate()), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
         
     except Exception as e:
         log_error(f"Error creating ZIP file", error=str(e))
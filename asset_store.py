@@ -0,0 +1,256 @@
+"""
+Decode-once image asset store for DTF Design Packer
+
+Uploaded designs are keyed by the SHA-256 of their file bytes. The first time
+a file is seen it is decoded once, and everything later stages need from the
+pixels is written under <root>/<key[:2]>/<key>/:
+
+- meta.json   pixel size, channel count, alpha presence and the bounding box
+              of the opaque content
+- mask.npz    full-resolution alpha mask, bit-packed (only for designs with
+              transparency; opaque designs have an implicit all-ones mask)
+- proxy.png   RGBA copy downscaled to at most proxy_size px, for previews
+              and thumbnails
+
+Uploads of the same file (repeat customers re-send the same logo all the
+time) and later stages of the same job reuse these instead of decoding again.
+
+The store is a cache of the uploads: every lookup refreshes an asset's
+last-use time (the mtime of its meta.json) and prune() removes assets that
+have not been used for a while, or the least recently used ones beyond a
+size limit. A pruned asset is simply stored again from its upload the next
+time it is needed.
+"""
+import os
+import json
+import hashlib
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+META_FILENAME = 'meta.json'
+MASK_FILENAME = 'mask.npz'
+PROXY_FILENAME = 'proxy.png'
+
+# Temporary (dot-prefixed) directories older than this are removed by prune()
+STALE_TMP_SECONDS = 3600
+
+
+def file_sha256(filepath, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def to_bgra(img):
+    """Converts a cv2.IMREAD_UNCHANGED image to (BGRA image, 0/255 mask).
+
+    Same conventions as the packing code: grayscale pixels > 0 and BGRA
+    pixels with alpha > 0 are opaque, BGR images are fully opaque.
+    16-bit images are reduced to 8 bits. Returns (None, None) for
+    unsupported layouts.
+    """
+    if img.dtype == np.uint16:
+        # Everything downstream (proxies, PIL, the writers) works in 8 bits
+        img = (img >> 8).astype(np.uint8)
+    if len(img.shape) == 2:  # Grayscale
+        mask = (img > 0).astype(np.uint8) * 255
+        img_bgra = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    elif img.shape[2] == 3:  # BGR
+        mask = np.ones((img.shape[0], img.shape[1]), dtype=np.uint8) * 255
+        img_bgra = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+        img_bgra[:, :, 3] = 255
+    elif img.shape[2] == 4:  # BGRA
+        mask = (img[:, :, 3] > 0).astype(np.uint8) * 255
+        img_bgra = img
+    else:
+        return None, None
+    return img_bgra, mask
+
+
+def load_bgra(filepath):
+    """Decodes a design file to BGRA (the only place the full pixels are needed)."""
+    img = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    img_bgra, _ = to_bgra(img)
+    return img_bgra
+
+
+class AssetStore:
+    """Content-addressed store of decoded design data on disk."""
+
+    def __init__(self, root, proxy_size=800):
+        self.root = root
+        self.proxy_size = proxy_size
+        # (path, size, mtime) -> key, so repeated lookups skip re-hashing
+        self._keys = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def asset_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def key_for(self, filepath):
+        """Content key of a file (hashed once per path/size/mtime in this process)."""
+        stat = os.stat(filepath)
+        file_id = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            key = self._keys.get(file_id)
+        if key is None:
+            key = file_sha256(filepath)
+            with self._lock:
+                self._keys[file_id] = key
+        return key
+
+    def get(self, filepath):
+        """Metadata of a design file, decoding and storing it if it is new.
+
+        Returns:
+            dict: meta.json contents plus 'key', or None if the file cannot
+            be decoded.
+        """
+        key = self.key_for(filepath)
+        meta = self.metadata(key)
+        if meta is not None:
+            try:
+                os.utime(os.path.join(self.asset_dir(key), META_FILENAME))
+            except OSError:
+                pass  # Pruned in the meantime; the metadata read is still valid
+            return meta
+        return self._ingest(filepath, key)
+
+    def metadata(self, key):
+        try:
+            with open(os.path.join(self.asset_dir(key), META_FILENAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def mask(self, key):
+        """Full-resolution 0/255 mask of a stored design."""
+        meta = self.metadata(key)
+        if meta is None:
+            return None
+        if not meta['has_transparency']:
+            return np.full((meta['height'], meta['width']), 255, dtype=np.uint8)
+        with np.load(os.path.join(self.asset_dir(key), MASK_FILENAME)) as data:
+            bits = np.unpackbits(data['bits'], axis=1)[:, :meta['width']]
+        return bits * np.uint8(255)
+
+    def proxy_path(self, key):
+        """Path of the RGBA proxy PNG of a stored design."""
+        return os.path.join(self.asset_dir(key), PROXY_FILENAME)
+
+    def prune(self, max_age=None, max_bytes=None):
+        """Removes assets unused for max_age seconds, then the least recently
+        used ones until the store holds at most max_bytes.
+
+        Returns:
+            tuple: (assets removed, bytes freed)
+        """
+        now = time.time()
+        entries = []  # (last use, size, path)
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, name)
+                try:
+                    if name.startswith('.'):
+                        # Leftover of an interrupted ingest
+                        if now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                            shutil.rmtree(path, ignore_errors=True)
+                        continue
+                    last_use = os.path.getmtime(os.path.join(path, META_FILENAME))
+                    size = sum(entry.stat().st_size for entry in os.scandir(path))
+                except OSError:
+                    continue
+                entries.append((last_use, size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed, freed = 0, 0
+        for last_use, size, path in entries:
+            expired = max_age is not None and now - last_use > max_age
+            over_limit = max_bytes is not None and total > max_bytes
+            if not expired and not over_limit:
+                break
+            # Rename first, so readers never see a half-deleted asset
+            trash = os.path.join(os.path.dirname(path), f'.deleted-{os.path.basename(path)}')
+            try:
+                os.rename(path, trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+            removed += 1
+            freed += size
+        if removed:
+            logger.info(f"Pruned {removed} stored assets ({freed / (1024 * 1024):.1f} MB)")
+        return removed, freed
+
+    def _ingest(self, filepath, key):
+        img = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            return None
+        img_bgra, mask = to_bgra(img)
+        if img_bgra is None:
+            return None
+
+        h, w = img.shape[:2]
+        channels = 1 if len(img.shape) == 2 else img.shape[2]
+        opaque = mask > 0
+        has_transparency = not opaque.all()
+        if opaque.any():
+            ys = np.flatnonzero(opaque.any(axis=1))
+            xs = np.flatnonzero(opaque.any(axis=0))
+            bbox = [int(xs[0]), int(ys[0]), int(xs[-1] - xs[0] + 1), int(ys[-1] - ys[0] + 1)]
+        else:
+            bbox = [0, 0, 0, 0]
+        meta = {
+            'key': key,
+            'width': int(w),
+            'height': int(h),
+            'channels': int(channels),
+            'has_alpha': channels == 4,
+            'has_transparency': bool(has_transparency),
+            'bbox': bbox,  # x, y, width, height of the opaque content in pixels
+        }
+
+        # Write into a temporary directory and rename it into place, so
+        # concurrent workers never see a half-written asset.
+        final_dir = self.asset_dir(key)
+        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f'.{key[:8]}-', dir=os.path.dirname(final_dir))
+        try:
+            if has_transparency:
+                np.savez_compressed(os.path.join(tmp_dir, MASK_FILENAME), bits=np.packbits(opaque, axis=1))
+            proxy = Image.fromarray(cv2.cvtColor(img_bgra, cv2.COLOR_BGRA2RGBA))
+            if max(proxy.width, proxy.height) > self.proxy_size:
+                proxy.thumbnail((self.proxy_size, self.proxy_size), Image.Resampling.LANCZOS)
+            proxy.save(os.path.join(tmp_dir, PROXY_FILENAME), format='PNG', optimize=True)
+            with open(os.path.join(tmp_dir, META_FILENAME), 'w') as f:
+                json.dump(meta, f)
+            try:
+                os.rename(tmp_dir, final_dir)
+            except OSError:
+                # Another process stored the same content first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.debug(f"Stored asset {key} ({w}x{h}) for {os.path.basename(filepath)}")
+        return meta
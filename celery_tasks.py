@@ -1,6 +1,8 @@
 import os
 import time
-from celery import Celery, Task
+from celery import Celery, Task, chord
+from celery.signals import worker_ready, worker_shutdown
+from kombu import Queue
 import uuid
 import cv2
 import numpy as np
@@ -8,10 +10,28 @@ from PIL import Image
 import zipfile
 import io
 import json
-from reportlab.pdfgen import canvas as rl_canvas
-from reportlab.lib.units import mm
-from reportlab.lib.utils import ImageReader
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import config  # Import the centralized config module
+from rect_packers import ENGINES as RECT_PACKING_ENGINES, pack_with_engine
+from asset_store import AssetStore
+from png_writer import render_png_sheet
+from render_cache import RenderCache
+from pdf_writer import write_pdf
+from svg_writer import write_svg
+from worker_health import WorkerHeartbeat
+
+# Decoded design data, shared with the web app
+asset_store = AssetStore(config.ASSET_STORE_FOLDER, proxy_size=config.ASSET_PROXY_SIZE)
+
+# Output helpers take a per-job 'config' dict, so read render settings here
+PNG_STRIP_HEIGHT = config.PNG_STRIP_HEIGHT
+PNG_CANVAS_BACKEND = config.PNG_CANVAS_BACKEND
+RENDER_CACHE_BYTES = config.RENDER_CACHE_MB * 1024 * 1024
+OUTPUT_WORKERS = config.OUTPUT_WORKERS
+IMAGE_ENCODE_WORKERS = config.IMAGE_ENCODE_WORKERS
+SVG_IMAGE_MODE = config.SVG_IMAGE_MODE
+PROGRESS_FLUSH_INTERVAL = config.PROGRESS_FLUSH_MS / 1000.0
+FAST_LANE_MAX_DESIGNS = config.FAST_LANE_MAX_DESIGNS
 
 # Set up Celery with Redis as the broker
 celery = Celery('dtf_packer', broker=config.REDIS_URL, backend=config.REDIS_URL)
@@ -29,6 +49,67 @@ celery.conf.update(
     task_acks_late=True,  # Only acknowledge tasks after they are complete
 )
 
+# Queues: "fast" for the dispatching task and small jobs' preparation and
+# packing, "pack" for image preparation and packing (CPU-bound), "render" for
+# output generation of every job (memory-heavy; canvas size does not follow
+# the number of designs). Each has its own worker settings, used by `run.py --worker --queue`.
+celery.conf.update(
+    # Own routing keys, or every queue would be bound to the default 'pack' key
+    task_queues=tuple(Queue(name, routing_key=name) for name in ('fast', 'pack', 'render')),
+    task_default_queue='pack',
+    task_routes={
+        'celery_tasks.process_designs': {'queue': 'fast'},
+        'celery_tasks.prepare_design': {'queue': 'pack'},
+        'celery_tasks.pack_designs': {'queue': 'pack'},
+        'celery_tasks.render_designs': {'queue': 'render'},
+    },
+    worker_queue_settings={
+        'fast': {'concurrency': config.FAST_WORKER_CONCURRENCY,
+                 'max_memory_per_child': config.FAST_WORKER_MAX_MEMORY_MB * 1024},
+        'pack': {'concurrency': config.PACK_WORKER_CONCURRENCY,
+                 'max_memory_per_child': config.PACK_WORKER_MAX_MEMORY_MB * 1024},
+        'render': {'concurrency': config.RENDER_WORKER_CONCURRENCY,
+                   'max_memory_per_child': config.RENDER_WORKER_MAX_MEMORY_MB * 1024},
+    },
+)
+
+def queues_for(design_count):
+    """Queues a job with this many designs runs on (see process_designs)."""
+    if design_count < FAST_LANE_MAX_DESIGNS:
+        return ('fast', 'render')
+    return ('fast', 'pack', 'render')
+
+# Heartbeat the web app's worker_health monitor reads instead of pinging workers
+_heartbeat = None
+
+@worker_ready.connect
+def start_worker_heartbeat(sender, **kwargs):
+    """Starts recording this worker and the queues it consumes as alive."""
+    global _heartbeat
+    _heartbeat = WorkerHeartbeat(config.REDIS_URL, sender.hostname, list(sender.app.amqp.queues.consume_from),
+                                 interval=config.WORKER_HEARTBEAT_INTERVAL)
+    _heartbeat.start()
+
+@worker_shutdown.connect
+def stop_worker_heartbeat(sender, **kwargs):
+    """Removes this worker from the heartbeats right away on a clean shutdown."""
+    if _heartbeat is not None:
+        _heartbeat.stop()
+
+# Task status lives in the Redis hash task_status:<task_id>, one JSON-encoded
+# value per field (status, progress, message, updated_at and, once done, result)
+TASK_STATUS_TTL = 24 * 3600  # Same as Celery's default result expiry
+
+def _write_task_status(task_id, fields, event):
+    """HSETs the given status fields and publishes event, in one round trip."""
+    key = f'task_status:{task_id}'
+    pipe = celery.backend.client.pipeline(transaction=False)
+    pipe.hset(key, mapping={name: json.dumps(value) for name, value in fields.items()})
+    pipe.expire(key, TASK_STATUS_TTL)
+    # Push the change to open /api/task-events streams (the result stays in the hash)
+    pipe.publish(task_events_channel(task_id), json.dumps(event))
+    pipe.execute()
+
 # Function to save task status
 def update_task_status(task_id, status, progress=None, message=None, result=None):
     """Update the status of a task in Redis for progress tracking."""
@@ -36,83 +117,263 @@ def update_task_status(task_id, status, progress=None, message=None, result=None
         'status': status,
         'progress': progress,
         'message': message,
-        'result': result,
         'updated_at': time.time()
     }
-    celery.backend.set(f'task_status:{task_id}', json.dumps(status_data))
+    fields = dict(status_data, result=result) if result is not None else status_data
+    _write_task_status(task_id, fields, status_data)
+
+class ProgressReporter:
+    """Coalesces a task's progress updates in the worker.
+    
+    progress() only records the latest progress and message; they are written
+    at most every interval seconds, and only the fields that changed.
+    phase() replaces them and writes straight away.
+    """
+    
+    def __init__(self, task_id, interval=None):
+        self.task_id = task_id
+        self.interval = PROGRESS_FLUSH_INTERVAL if interval is None else interval
+        self._state = {'status': None, 'progress': None, 'message': None}
+        self._written = {}
+        self._last_flush = 0.0
+    
+    def phase(self, status, progress=None, message=None):
+        """Starts a new phase of the task; always written immediately."""
+        self._state.update(status=status, progress=progress, message=message)
+        self.flush()
+    
+    def progress(self, progress, message=None):
+        """Progress within the current phase; written when the interval has passed."""
+        self._state['progress'] = progress
+        if message is not None:
+            self._state['message'] = message
+        if time.time() - self._last_flush >= self.interval:
+            self.flush()
+    
+    def flush(self):
+        """Writes whatever changed since the last write."""
+        changed = {name: value for name, value in self._state.items()
+                   if name not in self._written or self._written[name] != value}
+        if not changed:
+            return
+        self._last_flush = time.time()
+        status_data = dict(self._state, updated_at=self._last_flush)
+        _write_task_status(self.task_id, dict(changed, updated_at=self._last_flush), status_data)
+        self._written.update(changed)
+
+def task_events_channel(task_id):
+    """Redis pub/sub channel carrying a task's status changes."""
+    return f'task_events:{task_id}'
+
+def subscribe_task_status(task_id):
+    """Redis pub/sub subscription to a task's status changes (close it when done)."""
+    pubsub = celery.backend.client.pubsub()
+    pubsub.subscribe(task_events_channel(task_id))
+    return pubsub
+
+def _report_prepared(task_id, total):
+    """Counts a finished image prep task and writes the loading progress (10% to 30%).
+    
+    Progress is only written every ~5% of the images, however many workers
+    are preparing them.
+    """
+    counter = f'task_status:{task_id}:prepared'
+    pipe = celery.backend.client.pipeline(transaction=False)
+    pipe.incr(counter)
+    pipe.expire(counter, TASK_STATUS_TTL)
+    done = pipe.execute()[0]
+    
+    if done % max(1, total // 20) == 0 or done == total:
+        fields = {
+            'progress': 10 + int(done / total * 20),
+            'message': f'Loaded image {done}/{total}',
+            'updated_at': time.time()
+        }
+        _write_task_status(task_id, fields, dict(fields, status='PROCESSING'))
 
 class ProcessingTask(Task):
-    """Base class for processing tasks with progress tracking."""
+    """Base class for processing tasks with progress tracking.
+    
+    Status is reported under the status_task_id keyword argument when given
+    (the id the client is watching), otherwise under the task's own id.
+    Stages that hand over to another task set reports_success = False.
+    """
+    reports_success = True
     
     def on_success(self, retval, task_id, args, kwargs):
         """Called when a task succeeds."""
-        update_task_status(task_id, 'SUCCESS', 100, 'Task completed successfully', retval)
+        # Tasks report handled failures themselves and return {'error': ...}
+        if not self.reports_success or (isinstance(retval, dict) and 'error' in retval):
+            return super().on_success(retval, task_id, args, kwargs)
+        update_task_status(kwargs.get('status_task_id', task_id), 'SUCCESS', 100,
+                           'Task completed successfully', retval)
         return super().on_success(retval, task_id, args, kwargs)
     
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         """Called when a task fails."""
-        update_task_status(task_id, 'FAILURE', None, str(exc))
+        update_task_status(kwargs.get('status_task_id', task_id), 'FAILURE', None, str(exc))
         return super().on_failure(exc, task_id, args, kwargs, einfo)
     
     def on_retry(self, exc, task_id, args, kwargs, einfo):
         """Called when a task is retried."""
-        update_task_status(task_id, 'RETRY', None, f'Retrying: {str(exc)}')
+        update_task_status(kwargs.get('status_task_id', task_id), 'RETRY', None, f'Retrying: {str(exc)}')
         return super().on_retry(exc, task_id, args, kwargs, einfo)
 
-@celery.task(bind=True, base=ProcessingTask)
+@celery.task(bind=True)
 def process_designs(self, upload_id, config, file_info_list):
     """
     Asynchronously process designs: load images, pack them, and generate outputs.
     
+    Image preparation is fanned out as a chord: one prepare_design task per
+    file, on whichever workers are free, then pack_designs packs once they
+    are all done and render_designs generates the outputs. Preparation and
+    packing run on the "pack" queue, or on the "fast" queue for jobs with
+    fewer than FAST_LANE_MAX_DESIGNS designs so they are not held up behind
+    large ones. Rendering always runs on the "render" queue: a few designs
+    can still make a long sheet, too big for the fast workers. Progress
+    and the final result are reported under this task's id.
+    
     Args:
         upload_id: The ID of the upload session
         config: Configuration dictionary with settings
         file_info_list: List of file info dictionaries with paths and dimensions
         
     Returns:
-        Dictionary with result information
+        Dictionary with the id of the pack_designs task
     """
     try:
         task_id = self.request.id
-        upload_dir = os.path.join('uploads', upload_id)
-        output_dir = os.path.join('outputs', upload_id)
-        os.makedirs(output_dir, exist_ok=True)
         
         # 1. Update status - Started
         update_task_status(task_id, 'STARTED', 5, 'Processing started')
         
-        # 2. Load and process images
+        # 2. Load and process images, in parallel across workers
+        filepaths = [item['filepath'] for item in file_info_list if item['detected_width']]
+        if not filepaths:
+            update_task_status(task_id, 'FAILURE', None, 'No valid images to process')
+            return {'error': 'No valid images to process'}
+        
+        # Small jobs skip the pack queue (None keeps the task_routes queue)
+        queue = 'fast' if len(filepaths) < FAST_LANE_MAX_DESIGNS else None
+        options = {'queue': queue} if queue else {}
+        
         update_task_status(task_id, 'PROCESSING', 10, 'Loading images')
+        pack = chord(
+            prepare_design.s(filepath, status_task_id=task_id, total=len(filepaths)).set(**options)
+            for filepath in filepaths
+        )(pack_designs.s(upload_id, config, file_info_list, status_task_id=task_id).set(**options))
+        return {'pack_task_id': pack.id}
+        
+    except Exception as e:
+        update_task_status(task_id, 'FAILURE', None, f'Processing failed: {str(e)}')
+        return {'error': f'Processing failed: {str(e)}'}
+
+@celery.task
+def prepare_design(filepath, status_task_id=None, total=0):
+    """Decodes one design into the shared asset store (size, mask and proxy).
+    
+    Returns the asset key, or None if the file cannot be decoded. Never
+    raises, so one bad file does not fail the whole chord.
+    """
+    try:
+        asset = asset_store.get(filepath)
+    except Exception:
+        asset = None
+    if status_task_id:
+        try:
+            _report_prepared(status_task_id, total)
+        except Exception:
+            pass  # Progress is best effort; the chord must still complete
+    return asset['key'] if asset else None
+
+@celery.task(bind=True, base=ProcessingTask, reports_success=False)
+def pack_designs(self, asset_keys, upload_id, config, file_info_list, status_task_id):
+    """
+    Chord callback of process_designs: pack the prepared designs, then hand
+    the layout to render_designs.
+    
+    Args:
+        asset_keys: prepare_design results, one per file with a width (None if it failed)
+        upload_id: The ID of the upload session
+        config: Configuration dictionary with settings
+        file_info_list: List of file info dictionaries with paths and dimensions
+        status_task_id: Id of the process_designs task the client is watching
+        
+    Returns:
+        Dictionary with the id of the render_designs task
+    """
+    try:
+        task_id = status_task_id
+        reporter = ProgressReporter(task_id)
         
+        # Image data from the asset store (already decoded by prepare_design)
         image_data_list = []
         spacing_mm = float(config.get('spacing_mm', 3))
         
-        for i, file_info_item in enumerate(file_info_list):
-            filepath = file_info_item['filepath']
-            custom_width = file_info_item['detected_width']
-            
-            if custom_width:
-                # Process image dimensions and create image_data
-                image_data = process_image(filepath, spacing_mm, custom_width)
-                if image_data:
-                    image_data_list.append(image_data)
-            
-            # Update progress for image loading phase (10% to 30%)
-            progress = 10 + int((i / len(file_info_list)) * 20)
-            update_task_status(task_id, 'PROCESSING', progress, f'Loading image {i+1}/{len(file_info_list)}')
+        prepared = [item for item in file_info_list if item['detected_width']]
+        for file_info_item, asset_key in zip(prepared, asset_keys):
+            if asset_key is None:
+                continue
+            image_data = process_image(file_info_item['filepath'], spacing_mm, file_info_item['detected_width'])
+            if image_data:
+                image_data_list.append(image_data)
         
         if not image_data_list:
             update_task_status(task_id, 'FAILURE', None, 'No valid images to process')
             return {'error': 'No valid images to process'}
         
         # 3. Pack images
-        update_task_status(task_id, 'PROCESSING', 30, 'Running packing algorithm')
+        reporter.phase('PROCESSING', 30, 'Running packing algorithm')
         
         canvas_width_mm = int(float(config.get('canvas_width_cm', 60)) * 10)
-        pack_result = pack_images(image_data_list, canvas_width_mm, spacing_mm)
+        pack_result = pack_images(image_data_list, canvas_width_mm, spacing_mm,
+                                  engine=config.get('packing_engine'),
+                                  allow_rotation=config.get('allow_rotation', True))
+        
+        # The layout and design references, without the packing masks
+        render_pack_result = {
+            'placements': pack_result['placements'],
+            'unplaced_images': [{'filename': img['filename'], 'width_mm': img['width_mm'], 'height_mm': img['height_mm']} 
+                              for img in pack_result['unplaced_images']],
+            'final_canvas_height_mm': pack_result['final_canvas_height_mm'],
+            'canvas_width_mm': pack_result['canvas_width_mm'],
+            'image_data_map': {image_id: {key: value for key, value in img.items() if key != 'mask'}
+                               for image_id, img in pack_result['image_data_map'].items()}
+        }
+        render = render_designs.apply_async(
+            args=(render_pack_result, upload_id, config, len(image_data_list)),
+            kwargs={'status_task_id': task_id})
+        return {'render_task_id': render.id}
+        
+    except Exception as e:
+        update_task_status(task_id, 'FAILURE', None, f'Processing failed: {str(e)}')
+        return {'error': f'Processing failed: {str(e)}'}
+
+@celery.task(bind=True, base=ProcessingTask)
+def render_designs(self, pack_result, upload_id, config, total_images, status_task_id):
+    """
+    Last stage of process_designs: generate the output files of a packed layout.
+    
+    Args:
+        pack_result: Layout from pack_designs (image_data_map without masks)
+        upload_id: The ID of the upload session
+        config: Configuration dictionary with settings
+        total_images: Number of designs that were packed
+        status_task_id: Id of the process_designs task the client is watching
+        
+    Returns:
+        Dictionary with result information
+    """
+    try:
+        task_id = status_task_id
+        output_dir = os.path.join('outputs', upload_id)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # Per-format progress is coalesced; phase changes are written at once
+        reporter = ProgressReporter(task_id)
         
         # 4. Generate outputs
-        update_task_status(task_id, 'PROCESSING', 50, 'Generating output files')
+        reporter.phase('PROCESSING', 50, 'Generating output files')
         
         output_formats = config.get('output_formats', {
             'generate_png': True,
@@ -122,36 +383,52 @@ def process_designs(self, upload_id, config, file_info_list):
         })
         
         outputs = {}
-        
-        # 4.1 Generate PNG if selected
-        if output_formats.get('generate_png', True):
-            update_task_status(task_id, 'PROCESSING', 60, 'Generating PNG file')
-            png_path = generate_png_output(pack_result, config, output_dir)
-            outputs['png'] = png_path
-        
-        # 4.2 Generate PDF if selected
-        if output_formats.get('generate_pdf', True):
-            update_task_status(task_id, 'PROCESSING', 70, 'Generating PDF file')
-            pdf_path = generate_pdf_output(pack_result, config, output_dir)
-            outputs['pdf'] = pdf_path
-        
-        # 4.3 Generate SVG if selected
-        if output_formats.get('generate_svg', True):
-            update_task_status(task_id, 'PROCESSING', 80, 'Generating SVG file')
-            svg_path = generate_svg_output(pack_result, config, output_dir)
-            outputs['svg'] = svg_path
-        
-        # 4.4 Generate report if selected
-        if output_formats.get('generate_report', True):
-            update_task_status(task_id, 'PROCESSING', 90, 'Generating report file')
-            report_path = generate_report_output(pack_result, output_dir)
-            outputs['report'] = report_path
+        # Converted/rotated design pixels shared by every output format; only
+        # kept when a PDF or SVG needs the full-resolution images
+        render_cache = RenderCache(RENDER_CACHE_BYTES,
+                                   keep_rgba=output_formats.get('generate_pdf', True)
+                                   or output_formats.get('generate_svg', True))
+        
+        # 4.1 Run the selected formats concurrently. Threads (not processes) let
+        # them share render_cache; PIL resampling/compositing and zlib release the GIL.
+        format_jobs = [
+            ('png', lambda: generate_png_output(pack_result, config, output_dir, render_cache)),
+            ('pdf', lambda: generate_pdf_output(pack_result, config, output_dir, render_cache)),
+            ('svg', lambda: generate_svg_output(pack_result, config, output_dir, render_cache)),
+            ('report', lambda: generate_report_output(pack_result, output_dir)),
+        ]
+        selected = [(name, job) for name, job in format_jobs
+                    if output_formats.get(f'generate_{name}', True)]
+        
+        def timed(job):
+            started = time.time()
+            return job(), time.time() - started
+        
+        timing_info = {f'{name}_time': 0 for name, _ in format_jobs}
+        stage_start = time.time()
+        if selected:
+            reporter.phase('PROCESSING', 60,
+                           f"Generating {', '.join(name.upper() for name, _ in selected)} files")
+            with ThreadPoolExecutor(max_workers=min(OUTPUT_WORKERS, len(selected))) as executor:
+                futures = {executor.submit(timed, job): name for name, job in selected}
+                for done_count, future in enumerate(as_completed(futures), 1):
+                    name = futures[future]
+                    outputs[name], timing_info[f'{name}_time'] = future.result()
+                    # Output stage spans 60% to 90%
+                    reporter.progress(60 + int(done_count / len(selected) * 30),
+                                      f'Generated {name.upper()} file')
+        timing_info['parallel_time'] = time.time() - stage_start
+        # The stage takes as long as its slowest format
+        format_times = {name: timing_info[f'{name}_time'] for name, _ in selected}
+        timing_info['critical_path'] = max(format_times, key=format_times.get) if format_times else None
+        timing_info['critical_path_time'] = max(format_times.values(), default=0)
+        outputs['timing'] = timing_info
         
         # 5. Create summary
-        update_task_status(task_id, 'PROCESSING', 95, 'Creating summary')
+        reporter.phase('PROCESSING', 95, 'Creating summary')
         
         summary = {
-            'total_images': len(image_data_list),
+            'total_images': total_images,
             'placed_images': len(pack_result['placements']),
             'unplaced_images': len(pack_result['unplaced_images']),
             'canvas_width_mm': pack_result['canvas_width_mm'],
@@ -164,14 +441,8 @@ def process_designs(self, upload_id, config, file_info_list):
             canvas_area = summary['canvas_width_mm'] * summary['canvas_height_mm']
             summary['efficiency'] = (total_area / canvas_area) * 100 if canvas_area > 0 else 0
         
-        # Create session-safe version of pack_result (without numpy arrays)
-        session_pack_result = {
-            'placements': pack_result['placements'],
-            'unplaced_images': [{'filename': img['filename'], 'width_mm': img['width_mm'], 'height_mm': img['height_mm']} 
-                              for img in pack_result['unplaced_images']],
-            'final_canvas_height_mm': pack_result['final_canvas_height_mm'],
-            'canvas_width_mm': pack_result['canvas_width_mm']
-        }
+        # Create session-safe version of pack_result
+        session_pack_result = {key: value for key, value in pack_result.items() if key != 'image_data_map'}
         
         # 6. Return result
         result = {
@@ -182,7 +453,7 @@ def process_designs(self, upload_id, config, file_info_list):
             'config': config
         }
         
-        update_task_status(task_id, 'SUCCESS', 100, 'Processing completed successfully', result)
+        # on_success stores the result with the SUCCESS status
         return result
         
     except Exception as e:
@@ -196,12 +467,12 @@ def process_image(filepath, spacing_mm, custom_width_cm):
         # Get width from custom input
         width_cm = float(custom_width_cm)
         
-        # Load and process image
-        img_orig = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
-        if img_orig is None:
+        # Size and mask come from the asset store (decoded once per file content)
+        asset = asset_store.get(filepath)
+        if asset is None:
             return None
         
-        h, w = img_orig.shape[:2]
+        h, w = asset['height'], asset['width']
         
         # Calculate dimensions in mm
         width_mm = width_cm * 10.0
@@ -211,19 +482,7 @@ def process_image(filepath, spacing_mm, custom_width_cm):
         width_mm_int = int(round(width_mm))
         height_mm_int = int(round(height_mm))
         
-        # Create mask and convert image to BGRA format
-        if len(img_orig.shape) == 2:  # Grayscale
-            mask = (img_orig > 0).astype(np.uint8) * 255
-            img_bgra = cv2.cvtColor(img_orig, cv2.COLOR_GRAY2BGRA)
-        elif img_orig.shape[2] == 3:  # BGR
-            mask = np.ones((img_orig.shape[0], img_orig.shape[1]), dtype=np.uint8) * 255
-            img_bgra = cv2.cvtColor(img_orig, cv2.COLOR_BGR2BGRA)
-            img_bgra[:, :, 3] = 255
-        elif img_orig.shape[2] == 4:  # BGRA
-            mask = (img_orig[:, :, 3] > 0).astype(np.uint8) * 255
-            img_bgra = img_orig
-        else:
-            return None
+        mask = asset_store.mask(asset['key'])
         
         # Resize mask to match placement dimensions
         mask = cv2.resize(mask, (width_mm_int, height_mm_int), interpolation=cv2.INTER_NEAREST)
@@ -231,7 +490,8 @@ def process_image(filepath, spacing_mm, custom_width_cm):
         return {
             'path': filepath,
             'filename': os.path.basename(filepath),
-            'img_bgra': img_bgra,
+            'asset_key': asset['key'],
+            'img_bgra': None,  # Decoded on demand by the output helpers (see RenderCache)
             'mask': mask,
             'width_mm': width_mm_int,
             'height_mm': height_mm_int,
@@ -244,8 +504,25 @@ def process_image(filepath, spacing_mm, custom_width_cm):
     except Exception:
         return None
 
-def pack_images(image_data_list, canvas_width_mm, spacing_mm):
+def pack_images(image_data_list, canvas_width_mm, spacing_mm, engine=None, allow_rotation=True):
     """Pack images on the canvas."""
+    if engine in RECT_PACKING_ENGINES:
+        items = [(img['id'], img['width_mm'], img['height_mm']) for img in image_data_list]
+        engine_placements, unplaced_ids, _ = pack_with_engine(items, canvas_width_mm, spacing_mm, engine,
+                                                              allow_rotation)
+        paths = {img['id']: img['path'] for img in image_data_list}
+        placements = [dict(p, path=paths[p['id']]) for p in engine_placements]
+        unplaced_ids = set(unplaced_ids)
+        final_height = (max(p['y_mm'] + p['height_mm'] for p in placements) + spacing_mm
+                        if placements else spacing_mm)
+        return {
+            'placements': placements,
+            'unplaced_images': [img for img in image_data_list if img['id'] in unplaced_ids],
+            'final_canvas_height_mm': final_height,
+            'canvas_width_mm': canvas_width_mm,
+            'image_data_map': {img['id']: img for img in image_data_list}
+        }
+
     # You would import your actual packing algorithm here
     # For example: from smart_fast_packer import simple_pack_images
     
@@ -259,7 +536,7 @@ def pack_images(image_data_list, canvas_width_mm, spacing_mm):
         
         # Try both orientations if width > height
         rotated = False
-        if w > h and w > canvas_width_mm / 2:
+        if allow_rotation and w > h and w > canvas_width_mm / 2:
             w, h = h, w
             rotated = True
         
@@ -294,7 +571,7 @@ def pack_images(image_data_list, canvas_width_mm, spacing_mm):
         'image_data_map': {img['id']: img for img in image_data_list}
     }
 
-def generate_png_output(pack_result, config, output_dir):
+def generate_png_output(pack_result, config, output_dir, render_cache=None):
     """Generate PNG output file."""
     placements = pack_result['placements']
     canvas_width_mm = pack_result['canvas_width_mm']
@@ -306,161 +583,43 @@ def generate_png_output(pack_result, config, output_dir):
     canvas_width_px = int(canvas_width_mm * pixels_per_mm_png)
     canvas_height_px = int(final_canvas_height_mm * pixels_per_mm_png)
     
-    final_png_canvas = Image.new('RGBA', (canvas_width_px, canvas_height_px), (0, 0, 0, 0))
-
-    for p in placements:
-        img_data = image_data_map.get(p['id'])
-        if not img_data:
-            continue
-
-        try:
-            img_bgra_orig = img_data['img_bgra']
-            if img_bgra_orig is None:
-                continue
-                
-            img_rgba_pil = Image.fromarray(cv2.cvtColor(img_bgra_orig, cv2.COLOR_BGRA2RGBA))
-
-            if p['rotated']:
-                img_rgba_pil = img_rgba_pil.rotate(90, expand=True)
-
-            target_width_px = int(p['width_mm'] * pixels_per_mm_png)
-            target_height_px = int(p['height_mm'] * pixels_per_mm_png)
-
-            img_resized = img_rgba_pil.resize((target_width_px, target_height_px), Image.Resampling.LANCZOS)
-
-            pos_x_px = int(p['x_mm'] * pixels_per_mm_png)
-            pos_y_px = int(p['y_mm'] * pixels_per_mm_png)
-
-            final_png_canvas.paste(img_resized, (pos_x_px, pos_y_px), img_resized)
-
-        except Exception:
-            continue
-
+    # Streamed to disk band by band (or through a memory-mapped canvas);
+    # the full sheet is never held in memory
     png_path = os.path.join(output_dir, 'packed_output.png')
-    final_png_canvas.save(png_path)
+    render_png_sheet(placements, image_data_map, png_path,
+                     canvas_width_px, canvas_height_px, pixels_per_mm_png,
+                     backend=PNG_CANVAS_BACKEND, band_height=PNG_STRIP_HEIGHT,
+                     dpi=config['png_dpi'], render_cache=render_cache)
     return png_path
 
-def generate_pdf_output(pack_result, config, output_dir):
+def generate_pdf_output(pack_result, config, output_dir, render_cache=None):
     """Generate PDF output file."""
     placements = pack_result['placements']
     canvas_width_mm = pack_result['canvas_width_mm']
     final_canvas_height_mm = pack_result['final_canvas_height_mm']
     image_data_map = pack_result['image_data_map']
+    render_cache = render_cache or RenderCache(RENDER_CACHE_BYTES)
     
     pdf_margin_cm = config.get('pdf_margin_cm', 1.0)
-    pdf_width_pt = (canvas_width_mm + 2 * pdf_margin_cm * 10) * mm
-    pdf_height_pt = (final_canvas_height_mm + 2 * pdf_margin_cm * 10) * mm
-    pdf_margin_pt = pdf_margin_cm * mm
 
+    # Designs are encoded concurrently and embedded once per (asset, rotation)
     pdf_path = os.path.join(output_dir, 'packed_output.pdf')
-    c = rl_canvas.Canvas(pdf_path, pagesize=(pdf_width_pt, pdf_height_pt))
-
-    for p in placements:
-        img_data = image_data_map.get(p['id'])
-        if not img_data: 
-            continue
-
-        try:
-            img_bgra_orig = img_data['img_bgra']
-            if img_bgra_orig is None:
-                continue
-                
-            img_rgba_pil = Image.fromarray(cv2.cvtColor(img_bgra_orig, cv2.COLOR_BGRA2RGBA))
-
-            if p['rotated']:
-                img_rgba_pil = img_rgba_pil.rotate(90, expand=True)
-
-            width_pt = p['width_mm'] * mm
-            height_pt = p['height_mm'] * mm
-            x_pt = p['x_mm'] * mm + pdf_margin_pt
-            y_pt = pdf_height_pt - (p['y_mm'] * mm + pdf_margin_pt + height_pt) 
-
-            img_buffer = io.BytesIO()
-            try:
-                img_rgba_pil.save(img_buffer, format='PNG', optimize=False)
-                img_buffer.seek(0)
-                img_reader = ImageReader(img_buffer)
-
-                c.drawImage(img_reader, x_pt, y_pt, width=width_pt, height=height_pt, mask='auto')
-            finally:
-                img_buffer.close()
-
-        except Exception:
-            continue
-
-    c.save()
+    write_pdf(placements, image_data_map, pdf_path, canvas_width_mm, final_canvas_height_mm,
+              margin_mm=pdf_margin_cm * 10, render_cache=render_cache, workers=IMAGE_ENCODE_WORKERS)
     return pdf_path
 
-def generate_svg_output(pack_result, config, output_dir):
+def generate_svg_output(pack_result, config, output_dir, render_cache=None):
     """Generate SVG output file."""
-    import base64
     placements = pack_result['placements']
     canvas_width_mm = pack_result['canvas_width_mm']
     final_canvas_height_mm = pack_result['final_canvas_height_mm']
     image_data_map = pack_result['image_data_map']
+    render_cache = render_cache or RenderCache(RENDER_CACHE_BYTES)
     
+    # One image per unique design, referenced by every placement
     svg_path = os.path.join(output_dir, 'packed_output.svg')
-    
-    # Convert mm to SVG units (1mm = 3.779528 SVG units)
-    svg_scale = 3.779528
-    svg_width = canvas_width_mm * svg_scale
-    svg_height = final_canvas_height_mm * svg_scale
-    
-    svg_content = [
-        f'<?xml version="1.0" encoding="UTF-8"?>',
-        f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"',
-        f'     width="{svg_width:.2f}" height="{svg_height:.2f}"',
-        f'     viewBox="0 0 {svg_width:.2f} {svg_height:.2f}">',
-        f'  <!-- DTF Layout: {canvas_width_mm}mm x {final_canvas_height_mm}mm -->',
-        f'  <!-- Generated by DTF Packer - {len(placements)} images placed -->',
-        ''
-    ]
-    
-    # Add each image as embedded base64
-    for p in placements:
-        img_data = image_data_map.get(p['id'])
-        if not img_data:
-            continue
-            
-        try:
-            img_bgra_orig = img_data['img_bgra']
-            if img_bgra_orig is None:
-                continue
-                
-            img_rgba_pil = Image.fromarray(cv2.cvtColor(img_bgra_orig, cv2.COLOR_BGRA2RGBA))
-            
-            if p['rotated']:
-                img_rgba_pil = img_rgba_pil.rotate(90, expand=True)
-            
-            # Convert to base64 for embedding
-            img_buffer = io.BytesIO()
-            img_rgba_pil.save(img_buffer, format='PNG', optimize=True)
-            img_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-            img_buffer.close()
-            
-            # Calculate SVG positions and dimensions
-            x_svg = p['x_mm'] * svg_scale
-            y_svg = p['y_mm'] * svg_scale
-            width_svg = p['width_mm'] * svg_scale
-            height_svg = p['height_mm'] * svg_scale
-            
-            # Add image to SVG
-            svg_content.extend([
-                f'  <!-- {p["id"]} - {p["width_mm"]}x{p["height_mm"]}mm {"(rotated)" if p["rotated"] else ""} -->',
-                f'  <image x="{x_svg:.2f}" y="{y_svg:.2f}" width="{width_svg:.2f}" height="{height_svg:.2f}"',
-                f'         xlink:href="data:image/png;base64,{img_base64}"/>',
-                ''
-            ])
-            
-        except Exception:
-            continue
-    
-    svg_content.append('</svg>')
-    
-    # Write SVG file
-    with open(svg_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(svg_content))
-        
+    write_svg(placements, image_data_map, svg_path, canvas_width_mm, final_canvas_height_mm,
+              render_cache=render_cache, workers=IMAGE_ENCODE_WORKERS, mode=SVG_IMAGE_MODE)
     return svg_path
 
 def generate_report_output(pack_result, output_dir):
@@ -476,10 +635,12 @@ def generate_report_output(pack_result, output_dir):
 # Function to get task status
 def get_task_status(task_id):
     """Get the current status of a task."""
-    status_data = celery.backend.get(f'task_status:{task_id}')
-    if status_data:
+    fields = celery.backend.client.hgetall(f'task_status:{task_id}')
+    if fields:
         try:
-            return json.loads(status_data)
-        except:
+            status_data = {'status': None, 'progress': None, 'message': None, 'result': None}
+            status_data.update((name.decode('utf-8'), json.loads(value)) for name, value in fields.items())
+            return status_data
+        except ValueError:
             pass
     return None 
\ No newline at end of file
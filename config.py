@@ -37,6 +37,10 @@ SESSION_CLEANUP_INTERVAL = int(os.environ.get('SESSION_CLEANUP_INTERVAL', 3600))
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
 OUTPUT_FOLDER = os.environ.get('OUTPUT_FOLDER', 'outputs')
 LOGS_FOLDER = os.environ.get('LOGS_FOLDER', 'logs')
+ASSET_STORE_FOLDER = os.environ.get('ASSET_STORE_FOLDER', 'assets')  # Decoded design data, keyed by file hash
+ASSET_PROXY_SIZE = int(os.environ.get('ASSET_PROXY_SIZE', 800))  # Longest side of stored preview proxies in px
+ASSET_STORE_MAX_AGE = int(os.environ.get('ASSET_STORE_MAX_AGE', SESSION_TIMEOUT))  # Seconds an unused asset is kept
+ASSET_STORE_MAX_MB = int(os.environ.get('ASSET_STORE_MAX_MB', 2048))  # Size limit; least recently used assets go first
 MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 100 * 1024 * 1024))  # 100MB default
 
 # Static files
@@ -65,4 +69,55 @@ WTF_CSRF_TIME_LIMIT = int(os.environ.get('WTF_CSRF_TIME_LIMIT', 3600))  # 1 hour
 DEFAULT_CANVAS_WIDTH_CM = float(os.environ.get('DEFAULT_CANVAS_WIDTH_CM', 60.0))
 DEFAULT_SPACING_MM = float(os.environ.get('DEFAULT_SPACING_MM', 3.0))
 DEFAULT_PNG_DPI = int(os.environ.get('DEFAULT_PNG_DPI', 150))
-DEFAULT_PDF_MARGIN_CM = float(os.environ.get('DEFAULT_PDF_MARGIN_CM', 1.0)) 
\ No newline at end of file
+DEFAULT_PDF_MARGIN_CM = float(os.environ.get('DEFAULT_PDF_MARGIN_CM', 1.0)) 
+
+# Packing engine: 'smart' (exhaustive position search with layout scoring),
+# or one of the incremental rectangle packers 'maxrects', 'maxrects_bl', 'skyline'
+PACKING_ENGINE = os.environ.get('PACKING_ENGINE', 'smart')
+
+# Smart packing: worker processes for the placement strategies, shared by all
+# requests of a web worker process (1 = run them in the request thread)
+PACKING_PROCESSES = int(os.environ.get('PACKING_PROCESSES', min(5, os.cpu_count() or 1)))
+# Synchronous (non-Celery) path: seconds for loading and packing, seconds kept
+# for generating the outputs, and the sheet megapixels (at the PNG DPI) assumed
+# to render per second. Sheets estimated not to render in the time left are
+# refused, so the request ends within gunicorn's 120s timeout.
+SYNC_PACKING_TIME_BUDGET = float(os.environ.get('SYNC_PACKING_TIME_BUDGET', 60))
+SYNC_RENDER_TIME_BUDGET = float(os.environ.get('SYNC_RENDER_TIME_BUDGET', 40))
+SYNC_RENDER_MEGAPIXELS_PER_SECOND = float(os.environ.get('SYNC_RENDER_MEGAPIXELS_PER_SECOND', 5))
+
+# Output rendering: the PNG sheet is rendered and compressed in horizontal
+# bands of this many pixel rows, so memory does not grow with the sheet length
+PNG_STRIP_HEIGHT = int(os.environ.get('PNG_STRIP_HEIGHT', 512))
+# PNG canvas backend: 'strips' (render band by band) or 'memmap' (whole sheet in
+# a memory-mapped scratch file in the job's output directory)
+PNG_CANVAS_BACKEND = os.environ.get('PNG_CANVAS_BACKEND', 'strips')
+# Memory for converted/rotated designs shared by the PDF and SVG (and PNG) writers of a job
+RENDER_CACHE_MB = int(os.environ.get('RENDER_CACHE_MB', 512))
+# Output formats (PNG, SVG, PDF, report) generated concurrently per job
+OUTPUT_WORKERS = int(os.environ.get('OUTPUT_WORKERS', 4))
+# Threads encoding design images for the PDF and SVG writers
+IMAGE_ENCODE_WORKERS = int(os.environ.get('IMAGE_ENCODE_WORKERS', min(4, os.cpu_count() or 1)))
+# SVG images: 'embedded' (base64 inside the SVG) or 'linked' (files in svg_images/ next to it)
+SVG_IMAGE_MODE = os.environ.get('SVG_IMAGE_MODE', 'embedded')
+# Longest a task progress stream stays open before the browser reconnects, capped
+# at half the gunicorn worker timeout so a stream is never cut off mid-way
+TASK_EVENTS_MAX_SECONDS = min(int(os.environ.get('TASK_EVENTS_MAX_SECONDS', 60)),
+                              int(os.environ.get('GUNICORN_TIMEOUT', 120)) // 2)
+# Minimum interval between task progress writes to Redis (phase changes are written at once)
+PROGRESS_FLUSH_MS = int(os.environ.get('PROGRESS_FLUSH_MS', 500))
+
+# Celery queues: jobs with fewer designs than this are prepared and packed on the
+# "fast" queue; every job is rendered on the "render" queue
+FAST_LANE_MAX_DESIGNS = int(os.environ.get('FAST_LANE_MAX_DESIGNS', 20))
+# Worker processes and memory per worker process (MB, recycled above it) for each queue
+FAST_WORKER_CONCURRENCY = int(os.environ.get('FAST_WORKER_CONCURRENCY', 2))
+FAST_WORKER_MAX_MEMORY_MB = int(os.environ.get('FAST_WORKER_MAX_MEMORY_MB', 1024))
+PACK_WORKER_CONCURRENCY = int(os.environ.get('PACK_WORKER_CONCURRENCY', os.cpu_count() or 1))
+PACK_WORKER_MAX_MEMORY_MB = int(os.environ.get('PACK_WORKER_MAX_MEMORY_MB', 1024))
+RENDER_WORKER_CONCURRENCY = int(os.environ.get('RENDER_WORKER_CONCURRENCY', 2))
+RENDER_WORKER_MAX_MEMORY_MB = int(os.environ.get('RENDER_WORKER_MAX_MEMORY_MB', 4096))
+# Workers refresh a Redis heartbeat this often (seconds); the web app treats a
+# worker as gone once its last heartbeat is older than the TTL
+WORKER_HEARTBEAT_INTERVAL = int(os.environ.get('WORKER_HEARTBEAT_INTERVAL', 10))
+WORKER_HEARTBEAT_TTL = int(os.environ.get('WORKER_HEARTBEAT_TTL', 30))
@@ -11,9 +11,12 @@ backlog = 2048
 
 # Worker processes
 workers = os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1)
-worker_class = 'sync'  # Use 'gevent' or 'eventlet' for async workers if needed
+# Sync workers for the CPU-heavy routes (packing and rendering without Celery).
+# Task progress streams (/api/task-events) are served by gunicorn_events.conf.py;
+# sync workers refuse them and the page polls instead.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
 worker_connections = 1000
-timeout = 120  # Increased timeout for long-running image processing
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))  # Increased timeout for long-running image processing
 keepalive = 2
 max_requests = 1000
 max_requests_jitter = 50
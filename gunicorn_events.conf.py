@@ -0,0 +1,33 @@
+"""
+Gunicorn configuration for the DTF Design Packer task progress streams
+
+Serves the same app, but the reverse proxy only sends /api/task-events/ here.
+Each open stream mostly waits on Redis, so threaded workers hold many of them
+without tying up the sync workers of gunicorn.conf.py.
+"""
+import os
+
+# Server socket settings
+bind = os.environ.get('GUNICORN_EVENTS_BIND', '0.0.0.0:5001')
+
+# Worker processes
+workers = int(os.environ.get('GUNICORN_EVENTS_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_EVENTS_THREADS', 32))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+keepalive = 2
+
+# Process naming
+proc_name = 'dtf_packer_events'
+pythonpath = '.'
+
+# Logging
+errorlog = os.environ.get('GUNICORN_ERROR_LOG', '-')
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+# Server mechanics
+preload_app = True
+user = os.environ.get('GUNICORN_USER', None)
+group = os.environ.get('GUNICORN_GROUP', None)
+umask = 0o027
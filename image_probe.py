@@ -0,0 +1,110 @@
+"""
+Header-only image probing for DTF Design Packer
+
+Reads width, height, bit depth and alpha presence straight from the PNG IHDR
+chunk (plus a tRNS chunk, if any, before the image data) or the JPEG SOF
+segment, without decoding any pixels. Uploads use this instead of a full
+cv2.imread, which needs ~250 MB for a single 8000x8000 RGBA design.
+"""
+import struct
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+
+# PNG colour type -> channels after decoding
+PNG_COLOR_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+# JPEG start-of-frame markers (every SOFn except DHT, JPG and DAC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def probe_image(stream):
+    """Reads the basic properties of a PNG or JPEG from its headers.
+
+    The stream position is restored afterwards, so this can run on an
+    uploaded file before it is saved.
+
+    Returns:
+        dict: format, width, height, bit_depth, channels and has_alpha,
+        or None if the headers cannot be parsed.
+    """
+    start = stream.tell()
+    try:
+        signature = stream.read(8)
+        if signature.startswith(PNG_SIGNATURE):
+            return _probe_png(stream)
+        if signature.startswith(JPEG_SIGNATURE):
+            stream.seek(start + 2)
+            return _probe_jpeg(stream)
+        return None
+    except (struct.error, ValueError, OSError):
+        return None
+    finally:
+        stream.seek(start)
+
+
+def _probe_png(stream):
+    length, chunk_type = struct.unpack('>I4s', stream.read(8))
+    if chunk_type != b'IHDR' or length != 13:
+        return None
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', stream.read(10))
+    if color_type not in PNG_COLOR_CHANNELS or width == 0 or height == 0:
+        return None
+    has_alpha = color_type in (4, 6)
+
+    # Skip the rest of IHDR (3 bytes + CRC), then look for tRNS until IDAT
+    stream.seek(7, 1)
+    while not has_alpha:
+        header = stream.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type in (b'IDAT', b'IEND'):
+            break
+        if chunk_type == b'tRNS':
+            has_alpha = True
+            break
+        stream.seek(length + 4, 1)
+
+    return {
+        'format': 'png',
+        'width': width,
+        'height': height,
+        'bit_depth': bit_depth,
+        'channels': PNG_COLOR_CHANNELS[color_type],
+        'has_alpha': has_alpha,
+    }
+
+
+def _probe_jpeg(stream):
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            return None
+        if byte != b'\xff':
+            continue
+        marker = stream.read(1)
+        while marker == b'\xff':  # Fill bytes
+            marker = stream.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue  # Markers without a length field
+        if marker in (0xD9, 0xDA):
+            return None  # End of image / start of scan before any frame header
+        (length,) = struct.unpack('>H', stream.read(2))
+        if marker in JPEG_SOF_MARKERS:
+            bit_depth, height, width, components = struct.unpack('>BHHB', stream.read(6))
+            if width == 0 or height == 0:
+                return None  # Height defined later by a DNL marker
+            return {
+                'format': 'jpeg',
+                'width': width,
+                'height': height,
+                'bit_depth': bit_depth,
+                'channels': components,
+                'has_alpha': False,
+            }
+        stream.seek(length - 2, 1)
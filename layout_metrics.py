@@ -0,0 +1,140 @@
+"""
+Incremental layout scoring for DTF Design Packer
+
+LayoutMetrics keeps the aggregates the layout score of simple_pack_images is
+built from (extents, total image area, sum of x + y) so the score of
+"current layout + one candidate" or "current layout with one item moved" is
+available without a pass over every placement.
+
+The extents are kept as scalars next to a count per edge value and a
+lazy-deletion heap, so scoring a candidate is O(1), adding or removing a
+placement is O(log n), and the extent without one item is O(1) unless that
+item alone defines it (then O(log n), amortized).
+"""
+import heapq
+from collections import Counter
+
+
+class _EdgeMax:
+    """Maximum of a multiset of edge positions under insertion and removal."""
+
+    def __init__(self):
+        self.max = None
+        self._counts = Counter()
+        self._heap = []  # Negated edges; entries whose count dropped to 0 are stale
+
+    def add(self, value):
+        self._counts[value] += 1
+        if self._counts[value] == 1:
+            heapq.heappush(self._heap, -value)
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def remove(self, value):
+        if not self._counts[value]:
+            return
+        self._counts[value] -= 1
+        if not self._counts[value]:
+            del self._counts[value]
+            if value == self.max:
+                self.max = self._top()
+
+    def max_without(self, value):
+        """The maximum once one occurrence of value is removed (None if nothing is left)."""
+        if value != self.max or self._counts[value] > 1:
+            return self.max
+        # value alone defines the maximum: look one entry further down the heap
+        top = heapq.heappop(self._heap)
+        second = self._top()
+        heapq.heappush(self._heap, top)
+        return second
+
+    def _top(self):
+        """Largest live value, dropping stale heap entries on the way."""
+        while self._heap and -self._heap[0] not in self._counts:
+            heapq.heappop(self._heap)
+        return -self._heap[0] if self._heap else None
+
+
+class LayoutMetrics:
+    """Running aggregates of a set of placements on a fixed-width canvas."""
+
+    def __init__(self, canvas_width_mm, placements=()):
+        self.canvas_width_mm = canvas_width_mm
+        self.count = 0
+        self.total_area = 0
+        self.sum_xy = 0
+        self.right_edges = _EdgeMax()
+        self.bottom_edges = _EdgeMax()
+        for p in placements:
+            self.add(p)
+
+    def add(self, p):
+        self.count += 1
+        self.total_area += p['width_mm'] * p['height_mm']
+        self.sum_xy += p['x_mm'] + p['y_mm']
+        self.right_edges.add(p['x_mm'] + p['width_mm'])
+        self.bottom_edges.add(p['y_mm'] + p['height_mm'])
+
+    def remove(self, p):
+        self.count -= 1
+        self.total_area -= p['width_mm'] * p['height_mm']
+        self.sum_xy -= p['x_mm'] + p['y_mm']
+        self.right_edges.remove(p['x_mm'] + p['width_mm'])
+        self.bottom_edges.remove(p['y_mm'] + p['height_mm'])
+
+    def max_bottom(self, without=None):
+        """Bottom edge of the layout (optionally ignoring placement without), or None if empty."""
+        if without is not None:
+            return self.bottom_edges.max_without(without['y_mm'] + without['height_mm'])
+        return self.bottom_edges.max
+
+    def _score(self, count, max_x, max_y, total_area, sum_xy):
+        """Same formula as the original full-recompute layout score (lower is better)."""
+        if count == 0:
+            return float('inf')
+
+        # Efficiency score (higher efficiency = lower score)
+        canvas_area = self.canvas_width_mm * max_y
+        if canvas_area > 0:
+            efficiency = total_area / canvas_area
+            efficiency_score = (1.0 - efficiency) * 1000
+        else:
+            efficiency_score = 1000
+
+        # Height penalty (prefer shorter layouts)
+        height_score = max_y * 0.1
+
+        # Width utilization bonus (reward using full width)
+        width_score = (1.0 - max_x / self.canvas_width_mm) * 100
+
+        # Compactness score (penalize scattered layouts): distance from origin
+        compactness_score = sum_xy * 0.01
+
+        return efficiency_score + height_score + width_score + compactness_score
+
+    def score(self):
+        """Score of the current layout."""
+        if self.count == 0:
+            return float('inf')
+        return self._score(self.count, self.right_edges.max, self.bottom_edges.max,
+                           self.total_area, self.sum_xy)
+
+    def score_with(self, x, y, w, h):
+        """Score of the current layout plus a candidate rectangle."""
+        max_x = max(self.right_edges.max, x + w) if self.count else x + w
+        max_y = max(self.bottom_edges.max, y + h) if self.count else y + h
+        return self._score(self.count + 1, max_x, max_y,
+                           self.total_area + w * h, self.sum_xy + x + y)
+
+    def score_moved(self, p, x, y, w, h):
+        """Score of the current layout with placement p moved/resized to (x, y, w, h)."""
+        others_max_x = self.right_edges.max_without(p['x_mm'] + p['width_mm'])
+        others_max_y = self.bottom_edges.max_without(p['y_mm'] + p['height_mm'])
+        max_x = x + w if others_max_x is None else max(others_max_x, x + w)
+        max_y = y + h if others_max_y is None else max(others_max_y, y + h)
+        return self._score(self.count,
+                           max_x, max_y,
+                           self.total_area - p['width_mm'] * p['height_mm'] + w * h,
+                           self.sum_xy - (p['x_mm'] + p['y_mm']) + x + y)
+
@@ -0,0 +1,305 @@
+"""
+Smart layout search for DTF Design Packer
+
+The placement strategies of simple_pack_images are independent of each other,
+so they run concurrently in a process pool. Workers only receive lightweight
+(id, width_mm, height_mm) tuples - never the decoded image arrays - and return
+plain placement dicts. Every function accepts an optional deadline (a
+time.time() value) so a search can be cut short to fit a request timeout.
+
+Each process keeps one pool, shared by all its request threads, so
+concurrent requests queue for the same workers instead of each starting
+their own. Pool workers are started by the forkserver (spawn where it is not
+available), never forked from a multi-threaded web worker that may be
+holding logging or Redis locks.
+"""
+import math
+import multiprocessing
+import os
+import threading
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from spatial_index import SpatialGrid
+from layout_metrics import LayoutMetrics
+
+logger = logging.getLogger(__name__)
+
+# Sort orders tried by search_strategies, on (id, width_mm, height_mm) tuples
+STRATEGIES = [
+    ("largest_first", lambda r: -(r[1] * r[2])),
+    ("tallest_first", lambda r: -r[2]),
+    ("widest_first", lambda r: -r[1]),
+    ("smallest_first", lambda r: r[1] * r[2]),
+    ("balanced", lambda r: (-max(r[1], r[2]), -(r[1] * r[2]))),
+]
+STRATEGY_KEYS = dict(STRATEGIES)
+
+# Below this many images the pool start-up costs more than it saves
+MIN_PARALLEL_ITEMS = 10
+
+# Strategy pool of this process: (pid, executor)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _past(deadline):
+    return deadline is not None and time.time() >= deadline
+
+
+def _strategy_pool(processes):
+    """The process-wide strategy pool, started on first use (again after a fork)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool[0] != os.getpid():
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                # The server only needs this module, not the web app in __main__
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            _pool = (os.getpid(), ProcessPoolExecutor(max_workers=processes, mp_context=context))
+        return _pool[1]
+
+
+def _discard_pool(executor):
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[1] is executor:
+            _pool = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def find_all_positions(w, h, index, max_y, canvas_width_mm, spacing_mm, max_positions=100):
+    """Find all valid positions for an image, sorted by preference.
+
+    index is the SpatialGrid of the current placements and max_y their
+    bottom edge (None when nothing is placed yet).
+    """
+    positions = []
+
+    # Determine search bounds
+    if max_y is not None:
+        search_height = max_y + h + 100
+    else:
+        search_height = h + 50
+
+    # Use fine step size for thorough search
+    step = max(1, min(3, min(w, h) // 20))
+
+    # Search all positions
+    tested = 0
+    x_limit = canvas_width_mm - w + 1
+    for y in range(0, int(search_height), step):
+        if tested >= max_positions:
+            break
+        x = 0
+        while x < x_limit:
+            if tested >= max_positions:
+                break
+
+            blocker = index.first_conflict(x, y, w, h)
+            if blocker is not None:
+                # Every grid x left of the blocker's spacing edge overlaps it too
+                x = max(x + step, int(math.ceil((blocker['x_mm'] + blocker['width_mm'] + spacing_mm) / step)) * step)
+                continue
+
+            # Calculate position score
+            score = y * 2.0 + x * 0.1  # Prefer bottom-left but not too aggressively
+
+            # Bonus for edge contact
+            if x == 0:
+                score -= 20
+            if y == 0:
+                score -= 30
+
+            # Bonus for touching existing images
+            for p in index.neighbours(x, y, w, h):
+                # Check adjacency
+                if (abs(x + w - p['x_mm']) <= spacing_mm + 1 or
+                    abs(x - (p['x_mm'] + p['width_mm'])) <= spacing_mm + 1) and \
+                   not (y + h <= p['y_mm'] - spacing_mm or y >= p['y_mm'] + p['height_mm'] + spacing_mm):
+                    score -= 15
+                if (abs(y + h - p['y_mm']) <= spacing_mm + 1 or
+                    abs(y - (p['y_mm'] + p['height_mm'])) <= spacing_mm + 1) and \
+                   not (x + w <= p['x_mm'] - spacing_mm or x >= p['x_mm'] + p['width_mm'] + spacing_mm):
+                    score -= 20  # Prefer vertical stacking
+
+            positions.append((x, y, score))
+            tested += 1
+            x += step
+
+    # Sort by score (best first)
+    positions.sort(key=lambda p: p[2])
+    return positions[:50]  # Return top 50 positions
+
+
+def run_strategy(strategy_name, items, canvas_width_mm, spacing_mm, deadline=None):
+    """Places items in the order of one strategy.
+
+    Returns:
+        tuple: (strategy_name, layout_score, placements), or None when the
+        deadline passed before the layout was complete.
+    """
+    sorted_items = sorted(items, key=STRATEGY_KEYS[strategy_name])
+
+    placements = []
+    index = SpatialGrid(spacing_mm)
+    metrics = LayoutMetrics(canvas_width_mm)
+
+    for item_id, width_mm, height_mm in sorted_items:
+        if _past(deadline):
+            logger.debug(f"Strategy {strategy_name} stopped at deadline")
+            return None
+
+        best_placement = None
+        best_placement_score = float('inf')
+
+        # Try both orientations
+        orientations = [
+            (width_mm, height_mm, False),
+            (height_mm, width_mm, True)
+        ]
+
+        for w, h, rotated in orientations:
+            if w > canvas_width_mm:
+                continue
+
+            positions = find_all_positions(w, h, index, metrics.max_bottom(),
+                                           canvas_width_mm, spacing_mm)
+
+            # Try top 10 positions for this orientation
+            for x, y, pos_score in positions[:10]:
+                # Test the layout with this placement
+                layout_score = metrics.score_with(x, y, w, h)
+
+                if layout_score < best_placement_score:
+                    best_placement_score = layout_score
+                    best_placement = {
+                        'id': item_id,
+                        'x_mm': x,
+                        'y_mm': y,
+                        'width_mm': w,
+                        'height_mm': h,
+                        'rotated': rotated
+                    }
+
+        if best_placement:
+            placements.append(best_placement)
+            index.insert(best_placement)
+            metrics.add(best_placement)
+
+    return strategy_name, metrics.score(), placements
+
+
+def search_strategies(items, canvas_width_mm, spacing_mm, processes=1, deadline=None):
+    """Runs every strategy (in the process's shared pool when processes > 1).
+
+    processes is the size of that pool, so it bounds the packing processes of
+    the whole web worker, not of one request.
+
+    Returns:
+        list: (strategy_name, layout_score, placements) of every strategy that
+        finished before the deadline, in STRATEGIES order.
+    """
+    names = [name for name, _ in STRATEGIES]
+    if processes <= 1 or len(items) < MIN_PARALLEL_ITEMS:
+        results = []
+        for name in names:
+            result = run_strategy(name, items, canvas_width_mm, spacing_mm, deadline)
+            if result is None:
+                break
+            results.append(result)
+        return results
+
+    executor = _strategy_pool(processes)
+    try:
+        futures = [executor.submit(run_strategy, name, items, canvas_width_mm, spacing_mm, deadline)
+                   for name in names]
+    except BrokenProcessPool:
+        # A pool worker died; the next search starts a new pool
+        _discard_pool(executor)
+        logger.warning("Packing process pool was broken, running strategies in this thread")
+        return search_strategies(items, canvas_width_mm, spacing_mm, processes=1, deadline=deadline)
+
+    timeout = None if deadline is None else max(0, deadline - time.time())
+    done, not_done = wait(futures, timeout=timeout)
+    if not_done:
+        logger.warning(f"{len(not_done)} packing strategies did not finish within the time budget")
+        # Queued ones are dropped; running ones check the deadline themselves,
+        # so never block on stragglers
+        for future in not_done:
+            future.cancel()
+    results = []
+    for future in futures:
+        if future in done and future.exception() is None and future.result() is not None:
+            results.append(future.result())
+    if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+        _discard_pool(executor)
+    return results
+
+
+def optimize_layout(placements, canvas_width_mm, spacing_mm, deadline=None):
+    """Post-process to optimize the layout by trying to rearrange items."""
+    if len(placements) <= 1:
+        return placements
+
+    improved = True
+    iterations = 0
+    max_iterations = 3
+    index = SpatialGrid.from_placements(placements, spacing_mm)
+    metrics = LayoutMetrics(canvas_width_mm, placements)
+
+    while improved and iterations < max_iterations:
+        improved = False
+        iterations += 1
+
+        # Try to move each image to a better position
+        for i, placement in enumerate(placements):
+            if _past(deadline):
+                logger.debug("Layout optimization stopped at deadline")
+                return placements
+
+            current_layout_score = metrics.score()
+
+            # Remove this placement temporarily
+            index.remove(placement['id'])
+            others_max_y = metrics.max_bottom(without=placement)
+
+            # Try different orientations too
+            orientations = [
+                (placement['width_mm'], placement['height_mm'], placement['rotated']),
+                (placement['height_mm'], placement['width_mm'], not placement['rotated'])
+            ]
+
+            best_new_placement = placement
+            best_new_score = current_layout_score
+
+            for test_w, test_h, test_rotated in orientations:
+                if test_w > canvas_width_mm:
+                    continue
+
+                test_positions = find_all_positions(test_w, test_h, index, others_max_y,
+                                                    canvas_width_mm, spacing_mm, max_positions=30)
+
+                for x, y, _ in test_positions[:15]:  # Try top 15 positions
+                    test_score = metrics.score_moved(placement, x, y, test_w, test_h)
+
+                    if test_score < best_new_score:
+                        best_new_score = test_score
+                        best_new_placement = dict(placement, x_mm=x, y_mm=y, width_mm=test_w,
+                                                  height_mm=test_h, rotated=test_rotated)
+                        improved = True
+
+            # Update placement if improvement found
+            if improved:
+                placements[i] = best_new_placement
+                logger.debug(f"Moved {placement['id']} for better layout "
+                             f"(score improved by {current_layout_score - best_new_score:.1f})")
+                metrics.remove(placement)
+                metrics.add(best_new_placement)
+            index.insert(placements[i])
+
+    return placements
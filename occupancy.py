@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""
+Occupancy engines for the mask-based packer (smart_fast_packer.py).
+
+The brute-force search in try_placement_for_image slices canvas_mask for
+every candidate position. The engines in this module keep derived views of
+the canvas so that a whole grid of candidates can be judged with a handful
+of vectorized NumPy operations instead.
+"""
+import cv2
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def build_integral(occupied):
+    """Builds a summed-area table with a zero row/column of padding.
+
+    sat[i, j] holds the number of occupied pixels in occupied[:i, :j].
+    """
+    h, w = occupied.shape
+    sat = np.zeros((h + 1, w + 1), dtype=np.int32)
+    np.cumsum(occupied, axis=0, dtype=np.int32, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def integral_sum(sat, y0, x0, y1, x1):
+    """Sum of the occupied pixels in [y0:y1, x0:x1] (scalars or arrays)."""
+    return sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+
+
+def collision_map(occupied, mask_to_place):
+    """Correlates a design mask against canvas occupancy for every position at once.
+
+    Returns a float32 map where entry [y, x] is the number of opaque design
+    pixels that would land on occupied pixels with the design's top-left
+    corner at (x, y). Only positions where the design fits are included, so
+    the map has shape (H - h + 1, W - w + 1); valid positions are its zeros.
+    cv2.filter2D switches to a DFT-based implementation for large kernels,
+    which keeps this affordable for full-size design masks.
+    """
+    canvas_h, canvas_w = occupied.shape
+    mask_h, mask_w = mask_to_place.shape
+    if mask_h > canvas_h or mask_w > canvas_w:
+        return np.zeros((0, 0), dtype=np.float32)
+    kernel = (mask_to_place > 0).astype(np.float32)
+    source = (occupied > 0).astype(np.float32)
+    # anchor=(0, 0) turns filter2D's correlation into "kernel top-left at (x, y)"
+    counts = cv2.filter2D(source, cv2.CV_32F, kernel, anchor=(0, 0),
+                          borderType=cv2.BORDER_CONSTANT)
+    return counts[:canvas_h - mask_h + 1, :canvas_w - mask_w + 1]
+
+
+class IntegralOccupancy:
+    """Summed-area tables over a canvas mask and its spacing-dilated copy.
+
+    The plain table answers "how many occupied pixels in this rectangle"
+    in O(1); the dilated table answers "is this rectangle free *and* at
+    least spacing_mm away from everything" with a single lookup. Both are
+    kept up to date incrementally via mark_region() after each placement.
+    """
+
+    def __init__(self, canvas_mask, spacing_mm):
+        self.canvas_mask = canvas_mask
+        self.spacing_mm = max(0, int(spacing_mm))
+        self.canvas_h, self.canvas_w = canvas_mask.shape
+        self.refresh()
+
+    def _dilate(self, occupied):
+        if self.spacing_mm <= 0:
+            return occupied
+        size = 2 * self.spacing_mm + 1
+        kernel = np.ones((size, size), dtype=np.uint8)
+        return cv2.dilate(occupied, kernel)
+
+    def refresh(self):
+        """Rebuilds both tables from scratch (e.g. after a canvas resize)."""
+        occupied = (self.canvas_mask > 0).astype(np.uint8)
+        self.dilated = self._dilate(occupied)
+        self.sat = build_integral(occupied)
+        self.dilated_sat = build_integral(self.dilated)
+
+    def mark_region(self, x, y, width, height):
+        """Updates the tables after canvas_mask[y:y+h, x:x+w] was written.
+
+        Only rows from the changed area downwards are recomputed, which is
+        what makes the tables cheap to keep "running" during packing.
+        """
+        s = self.spacing_mm
+        # Refresh the dilated copy locally: only pixels within spacing of
+        # the changed rectangle can be affected.
+        dy0, dy1 = max(0, y - s), min(self.canvas_h, y + height + s)
+        dx0, dx1 = max(0, x - s), min(self.canvas_w, x + width + s)
+        sy0, sy1 = max(0, dy0 - s), min(self.canvas_h, dy1 + s)
+        sx0, sx1 = max(0, dx0 - s), min(self.canvas_w, dx1 + s)
+        source = (self.canvas_mask[sy0:sy1, sx0:sx1] > 0).astype(np.uint8)
+        local = self._dilate(source)
+        self.dilated[dy0:dy1, dx0:dx1] = local[dy0 - sy0:dy1 - sy0, dx0 - sx0:dx1 - sx0]
+
+        self._update_integral(self.sat, self.canvas_mask[y:, x:] > 0, y, x)
+        self._update_integral(self.dilated_sat, self.dilated[dy0:, dx0:], dy0, dx0)
+
+    @staticmethod
+    def _update_integral(sat, block_source, y, x):
+        """Recomputes sat[y+1:, x+1:] from the changed block occupied[y:, x:]."""
+        block = block_source.astype(np.int32)
+        np.cumsum(block, axis=0, out=block)
+        np.cumsum(block, axis=1, out=block)
+        # sum(:r, :c) = sum(:r, :x) + sum(:y, x:c) + sum(y:r, x:c)
+        block += sat[y + 1:, x:x + 1]
+        block += sat[y:y + 1, x + 1:] - sat[y, x]
+        sat[y + 1:, x + 1:] = block
+
+    def count(self, y0, x0, y1, x1):
+        """Occupied pixel count in canvas_mask[y0:y1, x0:x1]."""
+        return integral_sum(self.sat, y0, x0, y1, x1)
+
+    def count_dilated(self, y0, x0, y1, x1):
+        """Pixel count within spacing of an occupied pixel in [y0:y1, x0:x1]."""
+        return integral_sum(self.dilated_sat, y0, x0, y1, x1)
+
+    def collision_counts(self, mask_to_place, bounds=None):
+        """Shape-aware collision map of a design against the dilated canvas.
+
+        Correlating against the spacing-dilated copy means a zero entry is a
+        position where no opaque design pixel comes within spacing_mm of
+        anything already placed, so die-cut shapes may interlock while the
+        print spacing is still respected pixel by pixel.
+
+        bounds=(y0, x0, y1, x1) limits the map to top-left positions in
+        [y0:y1, x0:x1]; the result is then indexed relative to (y0, x0).
+        """
+        if bounds is None:
+            return collision_map(self.dilated, mask_to_place)
+        y0, x0, y1, x1 = bounds
+        mask_h, mask_w = mask_to_place.shape
+        return collision_map(self.dilated[y0:y1 + mask_h - 1, x0:x1 + mask_w - 1], mask_to_place)
+
+    def candidate_grid(self, width_mm, height_mm, step_mm, bounds=None):
+        """Returns (ys, xs) arrays of every top-left candidate on the step grid.
+
+        bounds=(y0, x0, y1, x1) keeps only the candidates in [y0:y1, x0:x1].
+        """
+        y_stop = self.canvas_h - height_mm + 1
+        x_stop = self.canvas_w - width_mm + 1
+        y_start = x_start = 0
+        if bounds is not None:
+            y0, x0, y1, x1 = bounds
+            # Stay on the global step grid
+            y_start = max(0, -(-y0 // step_mm) * step_mm)
+            x_start = max(0, -(-x0 // step_mm) * step_mm)
+            y_stop = min(y_stop, y1)
+            x_stop = min(x_stop, x1)
+        ys = np.arange(y_start, y_stop, step_mm)
+        xs = np.arange(x_start, x_stop, step_mm)
+        yy, xx = np.meshgrid(ys, xs, indexing='ij')
+        return yy.ravel(), xx.ravel()
+
+    def feasible_blocks(self, width_mm, height_mm, block_mm):
+        """Coarse level of a coarse-to-fine search.
+
+        Splits the top-left positions into block_mm x block_mm blocks and
+        returns the (ys, xs) anchors of the blocks that may still contain a
+        free position: every rectangle with its top-left in a block covers
+        the block's "core" area, so any pixel near an occupied one in there
+        rules out the whole block in a single lookup.
+        """
+        ys, xs = self.candidate_grid(width_mm, height_mm, block_mm)
+        last_y = np.minimum(ys + block_mm - 1, self.canvas_h - height_mm)
+        last_x = np.minimum(xs + block_mm - 1, self.canvas_w - width_mm)
+        core_y1, core_x1 = ys + height_mm, xs + width_mm
+        free = self.count_dilated(np.minimum(last_y, core_y1), np.minimum(last_x, core_x1),
+                                  core_y1, core_x1) == 0
+        return ys[free], xs[free]
+
+    def evaluate(self, ys, xs, width_mm, height_mm, mask_to_place=None):
+        """Judges a batch of candidate positions in one vectorized pass.
+
+        Mirrors the per-position checks of try_placement_for_image:
+        bounding-box overlap (with a precise mask test when the design has
+        transparency), check_distance and calculate_placement_score.
+
+        Returns:
+            tuple: (valid, scores) arrays aligned with ys/xs; invalid
+            positions score +inf.
+        """
+        s = self.spacing_mm
+        H, W = self.canvas_h, self.canvas_w
+        y1 = ys + height_mm
+        x1 = xs + width_mm
+
+        inner = self.count(ys, xs, y1, x1)
+
+        # Fast accept: nothing occupied within spacing of the rectangle.
+        valid = self.count_dilated(ys, xs, y1, x1) == 0
+        undecided = np.flatnonzero(~valid)
+        if undecided.size:
+            uy, ux = ys[undecided], xs[undecided]
+            uy1, ux1 = y1[undecided], x1[undecided]
+            ok = np.ones(undecided.size, dtype=bool)
+            if s > 0:
+                # Spacing: no occupied pixel in the expanded window outside
+                # the rectangle itself (same as check_distance).
+                ey0, ey1 = np.maximum(0, uy - s), np.minimum(H, uy1 + s)
+                ex0, ex1 = np.maximum(0, ux - s), np.minimum(W, ux1 + s)
+                ring = self.count(ey0, ex0, ey1, ex1) - inner[undecided]
+                ok &= ring == 0
+            overlapping = ok & (inner[undecided] > 0)
+            if np.any(overlapping):
+                if mask_to_place is None or mask_to_place.all():
+                    ok &= ~overlapping
+                else:
+                    # Precise test only for the few boxes that intersect
+                    # occupied pixels and survived the spacing test.
+                    design = mask_to_place > 0
+                    for k in np.flatnonzero(overlapping):
+                        roi = self.canvas_mask[uy[k]:uy1[k], ux[k]:ux1[k]]
+                        if np.any(np.logical_and(roi, design)):
+                            ok[k] = False
+            valid[undecided] = ok
+
+        scores = np.full(ys.shape, np.inf)
+        keep = np.flatnonzero(valid)
+        if keep.size:
+            scores[keep] = self.score(ys[keep], xs[keep], width_mm, height_mm)
+        return valid, scores
+
+    def score(self, ys, xs, width_mm, height_mm):
+        """Vectorized calculate_placement_score (lower is better)."""
+        return placement_scores(self.count, self.canvas_h, self.canvas_w, self.spacing_mm,
+                                ys, xs, width_mm, height_mm)
+
+
+def placement_scores(count, canvas_h, canvas_w, spacing_mm, ys, xs, width_mm, height_mm, px_per_mm=1):
+    """calculate_placement_score for arrays of positions.
+
+    count(y0, x0, y1, x1) returns occupied pixel counts for arrays of
+    rectangles (e.g. IntegralOccupancy.count). All sizes are in pixels;
+    with px_per_mm > 1 the positional term is converted back to mm so the
+    weights keep their meaning on finer grids.
+    """
+    s = spacing_mm
+    H, W = canvas_h, canvas_w
+    ys = ys.astype(np.int64)
+    xs = xs.astype(np.int64)
+    y1 = ys + height_mm
+    x1 = xs + width_mm
+    x1c = np.minimum(W, x1)
+    y1c = np.minimum(H, y1)
+
+    score = ys * 1.5 + xs * 1.0
+    if px_per_mm != 1:
+        score = score / px_per_mm
+
+    # Contact with neighbours (within spacing) or canvas edges
+    top = np.where(ys > 0, count(np.maximum(0, ys - s), xs, ys, x1c), width_mm)
+    bottom = np.where(y1 < H, count(y1c, xs, np.minimum(H, y1 + s), x1c), 0)
+    left = np.where(xs > 0, count(ys, np.maximum(0, xs - s), y1c, xs), height_mm)
+    right = np.where(x1 < W, count(ys, x1c, y1c, np.minimum(W, x1 + s)), height_mm)
+    contact_pixels = top + bottom + left + right
+    perimeter = 2 * (width_mm + height_mm) + 1
+    score -= (contact_pixels / perimeter) * 50
+
+    # Density of the surrounding area (gap filling)
+    margin = s + 1
+    gy0, gy1 = np.maximum(0, ys - margin), np.minimum(H, y1 + margin)
+    gx0, gx1 = np.maximum(0, xs - margin), np.minimum(W, x1 + margin)
+    area = (gy1 - gy0) * (gx1 - gx0)
+    occupied = count(gy0, gx0, gy1, gx1)
+    score -= np.where(area > 0, occupied / np.maximum(area, 1), 0) * 25
+
+    return score
+
+
+def best_candidate(ys, xs, scores):
+    """Returns (score, y, x) of the lowest score, or None if every score is inf.
+
+    Ties go to the first candidate in row-major order, so comparing these
+    tuples directly gives the same winner as a single argmin over the grid.
+    """
+    if scores.size == 0:
+        return None
+    index = int(np.argmin(scores))
+    if not np.isfinite(scores[index]):
+        return None
+    return float(scores[index]), int(ys[index]), int(xs[index])
+
+
+class CandidateCache:
+    """Best candidates per (image, orientation), kept across packer iterations.
+
+    Validity and score of a candidate only depend on canvas pixels within
+    spacing_mm + 1 of its rectangle, so after a placement only candidates
+    whose window reaches the placed rectangle can change. Each entry keeps
+    the best candidate of every tile x tile block of the step grid; a
+    placement only rescans the blocks touching its affected band, and the
+    overall best is the best block winner. Unaffected blocks keep their
+    cached winner, and the result is the same as a full rescan.
+    """
+
+    def __init__(self, spacing_mm, tile=8):
+        self.margin = max(0, int(spacing_mm)) + 1
+        self.tile = tile
+        self.placed = [] # (x, y, width, height) of every placement so far
+        self.entries = {} # key -> [winners (scores, rows, cols), grid shape, placements seen]
+
+    def mark_placed(self, x, y, width, height):
+        self.placed.append((x, y, width, height))
+
+    def forget(self, image_id):
+        """Drops the entries of an image that has been placed."""
+        for key in [key for key in self.entries if key[0] == image_id]:
+            del self.entries[key]
+
+    def affected_bounds(self, rect, width_mm, height_mm):
+        """Top-left (y0, x0, y1, x1) range of candidates whose window reaches rect."""
+        x, y, w, h = rect
+        m = self.margin
+        return (y - height_mm - m + 1, x - width_mm - m + 1, y + h + m, x + w + m)
+
+    def best(self, key, width_mm, height_mm, step_mm, search):
+        """Best (score, y, x) for key, or None if no candidate is valid.
+
+        search(bounds) evaluates the step grid (bounds=None) or the part of it
+        inside bounds=(y0, x0, y1, x1) and returns (ys, xs, scores) in
+        row-major order with inf for invalid candidates.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            ys, xs, scores = search(None)
+            if ys.size == 0:
+                shape = (0, 0)
+                winners = (np.full((0, 0), np.inf), np.zeros((0, 0), int), np.zeros((0, 0), int))
+            else:
+                shape = (int(ys[-1]) // step_mm + 1, int(xs[-1]) // step_mm + 1)
+                winners = self._block_winners(scores, shape, 0, 0)
+            entry = [winners, shape, len(self.placed)]
+            self.entries[key] = entry
+        else:
+            winners, shape, seen = entry
+            # Placements only ever invalidate or improve candidates near
+            # them; once nothing is valid, nothing will be again.
+            if np.isfinite(winners[0]).any():
+                for rect in self.placed[seen:]:
+                    self._rescan(winners, shape, rect, width_mm, height_mm, step_mm, search)
+            entry[2] = len(self.placed)
+
+        tile_scores, rows, cols = entry[0]
+        if tile_scores.size == 0:
+            return None
+        best_score = tile_scores.min()
+        if not np.isfinite(best_score):
+            return None
+        # Ties go to the top-most, then left-most candidate (row-major argmin)
+        tied = np.flatnonzero(tile_scores == best_score)
+        order = rows.ravel()[tied] * entry[1][1] + cols.ravel()[tied]
+        winner = tied[int(np.argmin(order))]
+        return float(best_score), int(rows.ravel()[winner]) * step_mm, int(cols.ravel()[winner]) * step_mm
+
+    def _rescan(self, winners, shape, rect, width_mm, height_mm, step_mm, search):
+        """Recomputes the block winners touching the band affected by rect."""
+        t = self.tile
+        ny, nx = shape
+        y0, x0, y1, x1 = self.affected_bounds(rect, width_mm, height_mm)
+        # Grid index range of the band, widened to whole blocks
+        gy0, gy1 = max(0, -(-y0 // step_mm)), min(ny, -(-y1 // step_mm))
+        gx0, gx1 = max(0, -(-x0 // step_mm)), min(nx, -(-x1 // step_mm))
+        if gy0 >= gy1 or gx0 >= gx1:
+            return
+        ty0, ty1 = gy0 // t, -(-gy1 // t)
+        tx0, tx1 = gx0 // t, -(-gx1 // t)
+        row0, row1 = ty0 * t, min(ny, ty1 * t)
+        col0, col1 = tx0 * t, min(nx, tx1 * t)
+        _, _, scores = search((row0 * step_mm, col0 * step_mm, row1 * step_mm, col1 * step_mm))
+        block = self._block_winners(scores, (row1 - row0, col1 - col0), row0, col0)
+        for target, source in zip(winners, block):
+            target[ty0:ty1, tx0:tx1] = source
+
+    def _block_winners(self, scores, shape, row0, col0):
+        """Per tile x tile block: (best score, grid row, grid col) of a row-major score grid."""
+        t = self.tile
+        rows, cols = shape
+        grid = np.pad(scores.reshape(rows, cols), ((0, -rows % t), (0, -cols % t)),
+                      constant_values=np.inf)
+        nr, nc = grid.shape[0] // t, grid.shape[1] // t
+        blocks = grid.reshape(nr, t, nc, t).transpose(0, 2, 1, 3).reshape(nr, nc, t * t)
+        local = np.argmin(blocks, axis=2)
+        best_scores = np.take_along_axis(blocks, local[..., None], axis=2)[..., 0]
+        best_rows = row0 + np.arange(nr)[:, None] * t + local // t
+        best_cols = col0 + np.arange(nc)[None, :] * t + local % t
+        return best_scores, best_rows, best_cols
+
+
+class PackedMask:
+    """A binary mask packed 8 pixels per byte (np.packbits rows, MSB first)."""
+
+    def __init__(self, mask):
+        bits = np.asarray(mask) > 0
+        self.height, self.width = bits.shape
+        self.packed = np.packbits(bits, axis=1)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def shifted(self, k):
+        """The packed rows moved right by k (0-7) bits, one byte wider.
+
+        Placing the mask at canvas column x is then a byte-aligned AND/OR of
+        shifted(x % 8) at byte x // 8.
+        """
+        words = self.packed.astype(np.uint16)
+        out = np.zeros((self.height, self.packed.shape[1] + 1), dtype=np.uint8)
+        out[:, :-1] = words >> k
+        out[:, 1:] |= ((words << (8 - k)) & 0xFF).astype(np.uint8)
+        return out
+
+
+class BitpackedOccupancy:
+    """Canvas occupancy packed 8 pixels per byte.
+
+    Eight times smaller than a uint8 canvas mask, which makes finer grids
+    (0.5 or 0.25 mm per pixel) affordable. Overlap tests are bitwise ANDs of
+    packed design rows against packed canvas rows. The canvas is surrounded
+    by pad empty pixels, so masks dilated by up to pad pixels can be tested
+    at the canvas edges without clipping.
+    """
+
+    def __init__(self, height, width, pad=0):
+        self.height = height
+        self.width = width
+        self.pad = pad
+        # One spare byte per row for the extra byte of shifted masks
+        row_bytes = -(-(width + 2 * pad) // 8) + 1
+        self.rows = np.zeros((height + 2 * pad, row_bytes), dtype=np.uint8)
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    def place(self, mask, x, y):
+        """ORs a PackedMask (or plain mask) into the canvas with its top-left at (x, y)."""
+        if not isinstance(mask, PackedMask):
+            mask = PackedMask(mask)
+        col, row = x + self.pad, y + self.pad
+        block = mask.shifted(col % 8)
+        self.rows[row:row + mask.height, col // 8:col // 8 + block.shape[1]] |= block
+
+    def collisions(self, shifts, ys, xs):
+        """For a mask given as its 8 shifted() variants, tests every top-left (xs[j], ys[i]).
+
+        Positions may lie up to pad pixels outside the canvas. Returns a
+        (len(ys), len(xs)) bool array, True where the mask overlaps an
+        occupied pixel.
+        """
+        rows = ys + self.pad
+        cols = xs + self.pad
+        hits = np.zeros((ys.size, xs.size), dtype=bool)
+        offsets = cols % 8
+        for k in np.unique(offsets):
+            selected = np.flatnonzero(offsets == k)
+            block = shifts[k]
+            starts = cols[selected] // 8
+            # Cheap first pass on every 8th mask row: most blocked positions
+            # are already caught there
+            sample = np.arange(0, block.shape[0], 8)
+            sampled_rows = self.rows[rows[:, None] + sample[None, :]]
+            windows = sliding_window_view(sampled_rows, block.shape[1], axis=2)[:, :, starts, :]
+            blocked = np.any(windows & block[sample][None, :, None, :], axis=(1, 3))
+            # Full test for the rest
+            row_index, col_index = np.nonzero(~blocked)
+            if row_index.size:
+                windows = sliding_window_view(self.rows, block.shape)[rows[row_index], starts[col_index]]
+                blocked[row_index, col_index] = np.any(windows & block, axis=(1, 2))
+            hits[:, selected] = blocked
+        return hits
+
+    def unpack(self, y0, y1):
+        """Canvas rows [y0:y1] as a 0/1 uint8 array."""
+        bits = np.unpackbits(self.rows[y0 + self.pad:y1 + self.pad], axis=1)
+        return bits[:, self.pad:self.pad + self.width]
+
+    def search(self, dilated, width, height, step, spacing, px_per_mm=1, rows_per_band=32):
+        """Best (score, y, x) on the step grid for a width x height design, or None.
+
+        dilated is the design mask grown by spacing pixels on every side
+        (a PackedMask of (height + 2 * spacing, width + 2 * spacing)), so a
+        position is free when it does not touch any occupied pixel. Scores
+        use the same formula as IntegralOccupancy.score, computed on an
+        integral table of only the rows a band of candidates can see.
+        """
+        shifts = [dilated.shifted(k) for k in range(8)]
+        xs_row = np.arange(0, self.width - width + 1, step)
+        ys_all = np.arange(0, self.height - height + 1, step)
+        margin = spacing + 1
+        # Rows without any occupied pixel need no AND at all
+        busy_rows = np.concatenate(([0], np.cumsum(self.rows.any(axis=1))))
+        best = None
+        for start in range(0, ys_all.size, rows_per_band):
+            band_ys = ys_all[start:start + rows_per_band]
+            top = band_ys - spacing + self.pad
+            busy = busy_rows[top + dilated.height] > busy_rows[top]
+            free = np.ones((band_ys.size, xs_row.size), dtype=bool)
+            if busy.any():
+                free[busy] = ~self.collisions(shifts, band_ys[busy] - spacing, xs_row - spacing)
+            row_index, col_index = np.nonzero(free)
+            ys, xs = band_ys[row_index], xs_row[col_index]
+            if ys.size == 0:
+                continue
+
+            row0 = max(0, int(band_ys[0]) - margin)
+            row1 = min(self.height, int(band_ys[-1]) + height + margin)
+            sat = build_integral(self.unpack(row0, row1))
+
+            def count(y0, x0, y1, x1):
+                return integral_sum(sat, y0 - row0, x0, y1 - row0, x1)
+
+            scores = placement_scores(count, self.height, self.width, spacing, ys, xs, width, height, px_per_mm)
+            candidate = best_candidate(ys, xs, scores)
+            # Earlier bands win ties, like the row-major scan
+            if candidate is not None and (best is None or candidate < best):
+                best = candidate
+        return best
@@ -0,0 +1,175 @@
+"""
+PDF output for DTF Design Packer
+
+Each distinct (asset, rotation) becomes one image XObject that every
+placement of it references, instead of ReportLab receiving a freshly
+PNG-encoded copy per placement (which it decodes and Flate-compresses again).
+Image streams are prepared up front in a thread pool, since zlib releases
+the GIL:
+
+- JPEG designs (grey or RGB) are embedded as their original bytes with
+  DCTDecode; rotation is applied by the placement matrix
+- everything else is written as Flate-compressed RGB, with a Flate
+  compressed soft mask when the design has transparency
+"""
+import hashlib
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfgen import canvas as rl_canvas
+
+from image_probe import probe_image
+from render_cache import RenderCache
+
+# JPEG component count -> PDF colour space usable with the original bytes
+JPEG_COLOR_SPACES = {1: 'DeviceGray', 3: 'DeviceRGB'}
+
+
+def _jpeg_stream(path):
+    """Original JPEG bytes as a DCTDecode stream, or None if not directly embeddable."""
+    with open(path, 'rb') as f:
+        info = probe_image(f)
+        if (info is None or info['format'] != 'jpeg' or info['bit_depth'] != 8
+                or info['channels'] not in JPEG_COLOR_SPACES):
+            return None
+        data = f.read()
+    return {
+        'width': info['width'],
+        'height': info['height'],
+        'color_space': JPEG_COLOR_SPACES[info['channels']],
+        'filter': 'DCTDecode',
+        'data': data,
+        'alpha': None,
+        'rotated': False,  # Rotation is left to the placement matrix
+    }
+
+
+def _flate_stream(image, rotated, compress_level):
+    """Flate-compressed RGB (+ alpha soft mask) stream of an RGBA PIL image."""
+    pixels = np.asarray(image)
+    alpha = pixels[:, :, 3]
+    return {
+        'width': image.width,
+        'height': image.height,
+        'color_space': 'DeviceRGB',
+        'filter': 'FlateDecode',
+        'data': zlib.compress(np.ascontiguousarray(pixels[:, :, :3]).tobytes(), compress_level),
+        'alpha': (zlib.compress(np.ascontiguousarray(alpha).tobytes(), compress_level)
+                  if alpha.min() < 255 else None),
+        'rotated': rotated,
+    }
+
+
+def prepare_image_stream(img_data, rotated, render_cache, compress_level=6):
+    """Encoded image stream of a design as drawn for one orientation, or None."""
+    path = img_data.get('path')
+    if path and img_data.get('img_bgra') is None:
+        stream = _jpeg_stream(path)
+        if stream is not None:
+            return stream
+    image = render_cache.rgba(img_data, rotated)
+    if image is None:
+        return None
+    return _flate_stream(image, rotated, compress_level)
+
+
+def _register_image(c, name, stream):
+    """Adds an image XObject (and its soft mask) to the document once; returns its name."""
+    doc = c._doc
+    reg_name = doc.getXObjectName(name)
+    if doc.idToObject.get(reg_name) is not None:
+        return name
+
+    img_obj = pdfdoc.PDFImageXObject(name)
+    img_obj.width = stream['width']
+    img_obj.height = stream['height']
+    img_obj.bitsPerComponent = 8
+    img_obj.colorSpace = stream['color_space']
+    img_obj._filters = (stream['filter'],)
+    img_obj.streamContent = stream['data']
+    img_obj.mask = None
+    c._setXObjects(img_obj)
+
+    if stream['alpha'] is not None:
+        smask = pdfdoc.PDFImageXObject(name + 'A')
+        smask.width = stream['width']
+        smask.height = stream['height']
+        smask.bitsPerComponent = 8
+        smask.colorSpace = 'DeviceGray'
+        smask._filters = ('FlateDecode',)
+        smask.streamContent = stream['alpha']
+        smask.mask = None
+        smask._decode = [0, 1]
+        c._setXObjects(smask)
+        img_obj.smask = doc.Reference(smask, doc.getXObjectName(smask.name))
+
+    doc.Reference(img_obj, reg_name)
+    doc.addForm(name, img_obj)
+    return name
+
+
+def write_pdf(placements, image_data_map, pdf_path, canvas_width_mm, canvas_height_mm,
+              margin_mm=10, render_cache=None, workers=4, on_error=None):
+    """Writes the packed sheet as a single-page PDF with margin_mm around it.
+
+    on_error(placement, exception) is called for designs that fail to
+    encode; they are left out.
+    """
+    render_cache = render_cache or RenderCache()
+    page_width_pt = (canvas_width_mm + 2 * margin_mm) * mm
+    page_height_pt = (canvas_height_mm + 2 * margin_mm) * mm
+    margin_pt = margin_mm * mm
+
+    # One stream per distinct (asset, rotation), encoded concurrently
+    keys = {}
+    for p in placements:
+        img_data = image_data_map.get(p['id'])
+        if img_data:
+            key = (RenderCache.asset_id(img_data), bool(p['rotated']))
+            keys.setdefault(key, (img_data, p))
+
+    def encode(item):
+        img_data, p = item
+        try:
+            return prepare_image_stream(img_data, bool(p['rotated']), render_cache)
+        except Exception as e:
+            if on_error:
+                on_error(p, e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        streams = dict(zip(keys, executor.map(encode, keys.values())))
+
+    c = rl_canvas.Canvas(pdf_path, pagesize=(page_width_pt, page_height_pt))
+    for p in placements:
+        img_data = image_data_map.get(p['id'])
+        if not img_data:
+            continue
+        key = (RenderCache.asset_id(img_data), bool(p['rotated']))
+        stream = streams.get(key)
+        if stream is None:
+            continue
+
+        # Passthrough JPEGs are stored unrotated, so both orientations share one XObject
+        name_key = (key[0], stream['rotated'])
+        name = _register_image(c, 'img' + hashlib.md5(repr(name_key).encode('utf-8')).hexdigest(), stream)
+
+        width_pt = p['width_mm'] * mm
+        height_pt = p['height_mm'] * mm
+        x_pt = p['x_mm'] * mm + margin_pt
+        y_pt = page_height_pt - (p['y_mm'] * mm + margin_pt + height_pt)
+
+        c.saveState()
+        if p['rotated'] and not stream['rotated']:
+            # Unrotated image turned 90 degrees counter-clockwise into the box
+            c.transform(0, height_pt, -width_pt, 0, x_pt + width_pt, y_pt)
+        else:
+            c.transform(width_pt, 0, 0, height_pt, x_pt, y_pt)
+        c.doForm(name)
+        c.restoreState()
+    c._currentPageHasImages = 1
+    c.save()
+    return pdf_path
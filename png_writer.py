@@ -0,0 +1,275 @@
+"""
+Streaming strip-based PNG output for DTF Design Packer
+
+A full-sheet RGBA canvas does not fit in memory for long rolls (60 cm x 20 m
+at 300 DPI is ~6.7 GB), so the sheet is rendered in horizontal bands: each
+band only composites the placements that intersect it, and its rows are
+filtered and fed straight into a zlib stream that is written out as IDAT
+chunks. Peak memory is one band plus the resized designs crossing it,
+independent of the sheet length: a resized design is shared by the
+placements in flight that use it and released after the last band it
+crosses, never cached for the whole job. Both backends composite with the same
+alpha_over, so they produce identical pixels.
+
+PNG_CANVAS_BACKEND = 'memmap' instead composites the whole sheet into a
+numpy.memmap scratch file in the job's output directory (vectorized
+alpha-over, in place) and streams the encoder from the mapping, so the
+operating system pages the canvas in and out instead of holding it in RAM.
+"""
+import os
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+
+from render_cache import RenderCache
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Compressed bytes collected before an IDAT chunk is written
+IDAT_CHUNK_SIZE = 256 * 1024
+
+# PNG filter type "Up": each byte minus the byte above it
+FILTER_UP = 2
+
+# Canvas backends accepted by render_png_sheet
+CANVAS_BACKENDS = ('strips', 'memmap')
+
+# Source rows blended per step by alpha_over (bounds its float temporaries)
+BLEND_ROWS = 256
+
+
+class StripPNGWriter:
+    """Writes an 8-bit RGBA PNG row band by row band."""
+
+    def __init__(self, path, width, height, dpi=None, compress_level=6):
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_size = 0
+        self._previous_row = np.zeros((1, width * 4), dtype=np.uint8)
+
+        self._file.write(PNG_SIGNATURE)
+        # 8 bits per channel, colour type 6 (RGBA), no interlacing
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        if dpi:
+            pixels_per_metre = int(round(dpi / 0.0254))
+            self._chunk(b'pHYs', struct.pack('>IIB', pixels_per_metre, pixels_per_metre, 1))
+
+    def _chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+    def _emit(self, data, flush=False):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= IDAT_CHUNK_SIZE or (flush and self._pending):
+            self._chunk(b'IDAT', b''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def write_rows(self, rows):
+        """Appends a (n, width, 4) uint8 RGBA array of rows."""
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), self.width * 4)
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError("More rows written than the PNG height")
+
+        # Up filter, vectorized over the band (uint8 arithmetic wraps mod 256)
+        above = np.concatenate([self._previous_row, rows[:-1]])
+        filtered = np.empty((len(rows), self.width * 4 + 1), dtype=np.uint8)
+        filtered[:, 0] = FILTER_UP
+        np.subtract(rows, above, out=filtered[:, 1:])
+        self._previous_row = rows[-1:].copy()
+
+        self._emit(self._compressor.compress(filtered.tobytes()))
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Pads missing rows with transparency and finishes the file."""
+        try:
+            while self.rows_written < self.height:
+                count = min(256, self.height - self.rows_written)
+                self.write_rows(np.zeros((count, self.width, 4), dtype=np.uint8))
+            self._emit(self._compressor.flush(), flush=True)
+            self._chunk(b'IEND', b'')
+        finally:
+            self._file.close()
+
+
+def render_png_strips(placements, image_data_map, png_path, canvas_width_px, canvas_height_px,
+                      pixels_per_mm, band_height=512, dpi=None, on_error=None, render_cache=None):
+    """Renders the packed sheet to png_path one horizontal band at a time.
+
+    Each design is resized when the first band it intersects is rendered
+    and dropped after the last one; placements of the same design in flight
+    at the same time share one resized image. on_error(placement, exception) is called for designs that fail to
+    render; they are skipped.
+    """
+    render_cache = render_cache or RenderCache()
+    pending = []
+    for order, p in enumerate(placements):
+        if p['id'] in image_data_map:
+            top = int(p['y_mm'] * pixels_per_mm)
+            pending.append((top, top + int(p['height_mm'] * pixels_per_mm), order, p))
+    pending.sort(key=lambda entry: entry[0])
+    pending.reverse()  # Pop from the end in top-to-bottom order
+
+    active = []  # (placement order, top, bottom, x, resized image, placement key)
+    resized = {}  # placement key -> [resized image, active placements using it]
+    writer = StripPNGWriter(png_path, canvas_width_px, canvas_height_px, dpi=dpi)
+    try:
+        for band_top in range(0, canvas_height_px, band_height):
+            band_bottom = min(band_top + band_height, canvas_height_px)
+
+            while pending and pending[-1][0] < band_bottom:
+                top, bottom, order, p = pending.pop()
+                img_data = image_data_map[p['id']]
+                key = RenderCache.placement_key(img_data, p, pixels_per_mm)
+                if key not in resized:
+                    try:
+                        img_resized = render_cache.placement_image(img_data, p, pixels_per_mm)
+                    except Exception as e:
+                        if on_error:
+                            on_error(p, e)
+                        continue
+                    if img_resized is None:
+                        continue
+                    resized[key] = [np.asarray(img_resized), 0]
+                resized[key][1] += 1
+                active.append((order, top, bottom, int(p['x_mm'] * pixels_per_mm), resized[key][0], key))
+            # Overlaps stack in placement order, as in the memmap backend
+            active.sort(key=lambda entry: entry[0])
+
+            band = np.zeros((band_bottom - band_top, canvas_width_px, 4), dtype=np.uint8)
+            for _, top, bottom, x, src, _ in active:
+                # Same compositing as the memmap backend; alpha_over clips to the band
+                alpha_over(band, src, x, top - band_top)
+            writer.write_rows(band)
+
+            # Release the designs whose last band this was
+            for _, _, bottom, _, _, key in active:
+                if bottom <= band_bottom:
+                    resized[key][1] -= 1
+                    if not resized[key][1]:
+                        del resized[key]
+            active = [entry for entry in active if entry[2] > band_bottom]
+    finally:
+        writer.close()
+    return png_path
+
+
+def alpha_over(canvas, src, x, y):
+    """Composites an RGBA uint8 array onto an RGBA canvas array at (x, y), in place.
+
+    Straight (non-premultiplied) Porter-Duff "over", clipped to the canvas and
+    processed BLEND_ROWS rows at a time so temporaries stay small.
+    """
+    canvas_h, canvas_w = canvas.shape[:2]
+    src_h, src_w = src.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + src_w, canvas_w), min(y + src_h, canvas_h)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    for row in range(y0, y1, BLEND_ROWS):
+        row_end = min(row + BLEND_ROWS, y1)
+        s = src[row - y:row_end - y, x0 - x:x1 - x].astype(np.float32)
+        region = canvas[row:row_end, x0:x1]
+        d = region.astype(np.float32)
+
+        src_alpha = s[:, :, 3:4] / 255.0
+        dst_alpha = d[:, :, 3:4] / 255.0 * (1.0 - src_alpha)
+        out_alpha = src_alpha + dst_alpha
+        safe_alpha = np.where(out_alpha > 0, out_alpha, 1.0)
+        rgb = (s[:, :, :3] * src_alpha + d[:, :, :3] * dst_alpha) / safe_alpha
+
+        region[:, :, :3] = np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+        region[:, :, 3:4] = np.clip(np.rint(out_alpha * 255.0), 0, 255).astype(np.uint8)
+
+
+def _canvas_rows(canvas_path, canvas_width_px, top, bottom):
+    """Maps rows [top, bottom) of the canvas file; only these pages are ever resident."""
+    return np.memmap(canvas_path, dtype=np.uint8, mode='r+', offset=top * canvas_width_px * 4,
+                     shape=(bottom - top, canvas_width_px, 4))
+
+
+def render_png_memmap(placements, image_data_map, png_path, canvas_width_px, canvas_height_px,
+                      pixels_per_mm, scratch_dir, band_height=512, dpi=None, on_error=None,
+                      render_cache=None):
+    """Renders the packed sheet through a memory-mapped canvas file in scratch_dir.
+
+    Each placement (and each encoder band) maps just the canvas rows it
+    covers and unmaps them when done. Only the last resized design is kept,
+    for consecutive placements of the same design. The scratch file is
+    removed once the PNG is written.
+    """
+    render_cache = render_cache or RenderCache()
+    last_key, src = None, None
+    fd, canvas_path = tempfile.mkstemp(prefix='canvas_', suffix='.rgba', dir=scratch_dir)
+    try:
+        # Sparse, zero-filled (fully transparent) canvas
+        os.ftruncate(fd, canvas_height_px * canvas_width_px * 4)
+        os.close(fd)
+        fd = None
+
+        for p in placements:
+            img_data = image_data_map.get(p['id'])
+            if not img_data:
+                continue
+            try:
+                key = RenderCache.placement_key(img_data, p, pixels_per_mm)
+                if key != last_key:
+                    last_key, src = None, None
+                    img_resized = render_cache.placement_image(img_data, p, pixels_per_mm)
+                    if img_resized is None:
+                        continue
+                    last_key, src = key, np.asarray(img_resized)
+                top = min(max(int(p['y_mm'] * pixels_per_mm), 0), canvas_height_px)
+                bottom = min(top + src.shape[0], canvas_height_px)
+                if bottom <= top:
+                    continue
+                rows = _canvas_rows(canvas_path, canvas_width_px, top, bottom)
+                alpha_over(rows, src, int(p['x_mm'] * pixels_per_mm), int(p['y_mm'] * pixels_per_mm) - top)
+                rows.flush()
+                del rows
+            except Exception as e:
+                if on_error:
+                    on_error(p, e)
+
+        writer = StripPNGWriter(png_path, canvas_width_px, canvas_height_px, dpi=dpi)
+        try:
+            for band_top in range(0, canvas_height_px, band_height):
+                band_bottom = min(band_top + band_height, canvas_height_px)
+                rows = _canvas_rows(canvas_path, canvas_width_px, band_top, band_bottom)
+                writer.write_rows(rows)
+                del rows
+        finally:
+            writer.close()
+    finally:
+        if fd is not None:
+            os.close(fd)
+        os.remove(canvas_path)
+    return png_path
+
+
+def render_png_sheet(placements, image_data_map, png_path, canvas_width_px, canvas_height_px,
+                     pixels_per_mm, backend='strips', band_height=512, dpi=None, on_error=None,
+                     render_cache=None):
+    """Renders the packed sheet with the configured canvas backend (see CANVAS_BACKENDS)."""
+    if backend == 'memmap':
+        return render_png_memmap(placements, image_data_map, png_path, canvas_width_px,
+                                 canvas_height_px, pixels_per_mm, os.path.dirname(png_path) or '.',
+                                 band_height=band_height, dpi=dpi, on_error=on_error,
+                                 render_cache=render_cache)
+    if backend != 'strips':
+        raise ValueError(f"Unknown PNG canvas backend: {backend}")
+    return render_png_strips(placements, image_data_map, png_path, canvas_width_px,
+                             canvas_height_px, pixels_per_mm, band_height=band_height,
+                             dpi=dpi, on_error=on_error, render_cache=render_cache)
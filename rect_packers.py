@@ -0,0 +1,249 @@
+"""
+Rectangle packing engines for DTF Design Packer
+
+Fast alternatives to the exhaustive position search in app.simple_pack_images.
+Both engines keep their free-space structure up to date incrementally, so a
+placement costs time proportional to the free space bookkeeping instead of a
+scan over every canvas position:
+
+- "maxrects":    MaxRects with Best Short Side Fit (BSSF)
+- "maxrects_bl": MaxRects with the Bottom-Left rule
+- "skyline":     Skyline Bottom-Left
+
+Engines work on lightweight (id, width_mm, height_mm) tuples. Spacing is
+handled by inflating every rectangle (and the canvas width) by the spacing,
+so neighbouring designs always end up at least spacing_mm apart.
+"""
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Engine names accepted by pack_rectangles / pack_with_engine
+ENGINES = ('maxrects', 'maxrects_bl', 'skyline')
+
+# Sort orders tried by pack_with_engine (same strategies as simple_pack_images)
+SORT_STRATEGIES = [
+    ("largest_first", lambda r: -(r[1] * r[2])),
+    ("tallest_first", lambda r: -r[2]),
+    ("widest_first", lambda r: -r[1]),
+    ("smallest_first", lambda r: r[1] * r[2]),
+    ("balanced", lambda r: (-max(r[1], r[2]), -(r[1] * r[2]))),
+]
+
+
+class MaxRectsPacker:
+    """MaxRects strip packer (fixed width, open-ended height)."""
+
+    def __init__(self, bin_width, bin_height, heuristic='bssf'):
+        if heuristic not in ('bssf', 'bl'):
+            raise ValueError(f"Unknown MaxRects heuristic: {heuristic}")
+        self.bin_width = bin_width
+        self.heuristic = heuristic
+        # Free rectangles as (x, y, width, height)
+        self.free_rects = [(0, 0, bin_width, bin_height)]
+
+    def _score(self, fx, fy, fw, fh, w, h):
+        if self.heuristic == 'bssf':
+            leftover_w = fw - w
+            leftover_h = fh - h
+            return (min(leftover_w, leftover_h), max(leftover_w, leftover_h), fy + h)
+        return (fy + h, fx)
+
+    def find_position(self, w, h, allow_rotation=True):
+        """Returns (x, y, w, h, rotated) of the best free spot, or None."""
+        best = None
+        best_score = None
+        orientations = [(w, h, False)]
+        if allow_rotation and w != h:
+            orientations.append((h, w, True))
+        for fx, fy, fw, fh in self.free_rects:
+            for ow, oh, rotated in orientations:
+                if ow <= fw and oh <= fh:
+                    score = self._score(fx, fy, fw, fh, ow, oh)
+                    if best_score is None or score < best_score:
+                        best_score = score
+                        best = (fx, fy, ow, oh, rotated)
+        return best
+
+    def place(self, x, y, w, h):
+        """Commits a rectangle and splits the free rectangles it overlaps."""
+        kept = []
+        touching = []
+        created = []
+        for fx, fy, fw, fh in self.free_rects:
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                kept.append((fx, fy, fw, fh))
+                # Every new piece borders the placed rectangle, so only free
+                # rectangles touching it can contain one of them.
+                if not (x - 1 >= fx + fw or x + w + 1 <= fx or y - 1 >= fy + fh or y + h + 1 <= fy):
+                    touching.append((fx, fy, fw, fh))
+                continue
+            # Up to four maximal rectangles around the placed one
+            if x > fx:
+                created.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                created.append((x + w, fy, fx + fw - (x + w), fh))
+            if y > fy:
+                created.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                created.append((fx, y + h, fw, fy + fh - (y + h)))
+
+        # Existing free rectangles are already maximal among themselves, so
+        # only the newly created ones need pruning.
+        pruned = []
+        for i, r in enumerate(created):
+            if any(_contains(k, r) for k in touching):
+                continue
+            if any(j != i and _contains(o, r) and (o != r or j < i) for j, o in enumerate(created)):
+                continue
+            pruned.append(r)
+        self.free_rects = kept + pruned
+
+    def insert(self, w, h, allow_rotation=True):
+        position = self.find_position(w, h, allow_rotation)
+        if position is not None:
+            x, y, pw, ph, _ = position
+            self.place(x, y, pw, ph)
+        return position
+
+
+class SkylinePacker:
+    """Skyline Bottom-Left strip packer (fixed width, open-ended height)."""
+
+    def __init__(self, bin_width):
+        self.bin_width = bin_width
+        # Skyline segments as [x, y, width], left to right
+        self.skyline = [[0, 0, bin_width]]
+
+    def _fit(self, index, w):
+        """Returns the y at which a rect of width w fits at segment index, or None."""
+        x = self.skyline[index][0]
+        if x + w > self.bin_width:
+            return None
+        remaining = w
+        y = 0
+        i = index
+        while remaining > 0:
+            seg_x, seg_y, seg_w = self.skyline[i]
+            y = max(y, seg_y)
+            remaining -= seg_w
+            i += 1
+        return y
+
+    def find_position(self, w, h, allow_rotation=True):
+        best = None
+        best_score = None
+        orientations = [(w, h, False)]
+        if allow_rotation and w != h:
+            orientations.append((h, w, True))
+        for index in range(len(self.skyline)):
+            for ow, oh, rotated in orientations:
+                y = self._fit(index, ow)
+                if y is None:
+                    continue
+                score = (y + oh, self.skyline[index][0])
+                if best_score is None or score < best_score:
+                    best_score = score
+                    best = (self.skyline[index][0], y, ow, oh, rotated)
+        return best
+
+    def place(self, x, y, w, h):
+        new_skyline = [[x, y + h, w]]
+        for seg_x, seg_y, seg_w in self.skyline:
+            seg_end = seg_x + seg_w
+            if seg_end <= x or seg_x >= x + w:
+                new_skyline.append([seg_x, seg_y, seg_w])
+                continue
+            # Keep the parts of the segment left/right of the new rectangle
+            if seg_x < x:
+                new_skyline.append([seg_x, seg_y, x - seg_x])
+            if seg_end > x + w:
+                new_skyline.append([x + w, seg_y, seg_end - (x + w)])
+        # Merge neighbouring segments at the same height
+        merged = []
+        for seg in sorted(new_skyline):
+            if merged and merged[-1][1] == seg[1] and merged[-1][0] + merged[-1][2] == seg[0]:
+                merged[-1][2] += seg[2]
+            else:
+                merged.append(seg)
+        self.skyline = merged
+
+    def insert(self, w, h, allow_rotation=True):
+        position = self.find_position(w, h, allow_rotation)
+        if position is not None:
+            x, y, pw, ph, _ = position
+            self.place(x, y, pw, ph)
+        return position
+
+
+def _contains(outer, inner):
+    ox, oy, ow, oh = outer
+    ix, iy, iw, ih = inner
+    return ix >= ox and iy >= oy and ix + iw <= ox + ow and iy + ih <= oy + oh
+
+
+def _create_packer(engine, bin_width, bin_height):
+    if engine == 'maxrects':
+        return MaxRectsPacker(bin_width, bin_height, heuristic='bssf')
+    if engine == 'maxrects_bl':
+        return MaxRectsPacker(bin_width, bin_height, heuristic='bl')
+    if engine == 'skyline':
+        return SkylinePacker(bin_width)
+    raise ValueError(f"Unknown packing engine: {engine}")
+
+
+def pack_rectangles(items, canvas_width_mm, spacing_mm, engine='maxrects', allow_rotation=True):
+    """Packs (id, width_mm, height_mm) items in the given order.
+
+    Returns:
+        tuple: (placements, unplaced_ids) where placements is a list of
+        dicts with id, x_mm, y_mm, width_mm, height_mm and rotated.
+    """
+    gap = int(math.ceil(spacing_mm))
+    bin_width = int(canvas_width_mm) + gap
+    # Open-ended strip: stacking everything vertically is an upper bound
+    bin_height = sum(max(w, h) + gap for _, w, h in items) + 1
+
+    packer = _create_packer(engine, bin_width, bin_height)
+    placements = []
+    unplaced_ids = []
+    for item_id, w, h in items:
+        # Round sizes up so fractional millimetres never eat into the spacing
+        position = packer.insert(int(math.ceil(w)) + gap, int(math.ceil(h)) + gap, allow_rotation)
+        if position is None:
+            unplaced_ids.append(item_id)
+            continue
+        x, y, pw, ph, rotated = position
+        placements.append({
+            'id': item_id,
+            'x_mm': x,
+            'y_mm': y,
+            'width_mm': h if rotated else w,
+            'height_mm': w if rotated else h,
+            'rotated': rotated
+        })
+    return placements, unplaced_ids
+
+
+def pack_with_engine(items, canvas_width_mm, spacing_mm, engine='maxrects', allow_rotation=True):
+    """Runs pack_rectangles for every sort strategy and keeps the shortest layout.
+
+    Returns:
+        tuple: (placements, unplaced_ids, strategy_name)
+    """
+    best = None
+    for strategy_name, sort_key in SORT_STRATEGIES:
+        ordered = sorted(items, key=sort_key)
+        placements, unplaced_ids = pack_rectangles(ordered, canvas_width_mm, spacing_mm,
+                                                   engine, allow_rotation)
+        height = max((p['y_mm'] + p['height_mm'] for p in placements), default=0)
+        # Fewer unplaced items first, then the shortest sheet
+        key = (len(unplaced_ids), height)
+        logger.debug(f"Engine {engine} strategy {strategy_name}: height {height}mm, "
+                     f"{len(unplaced_ids)} unplaced")
+        if best is None or key < best[0]:
+            best = (key, placements, unplaced_ids, strategy_name)
+    if best is None:
+        return [], [], None
+    return best[1], best[2], best[3]
@@ -0,0 +1,126 @@
+"""
+Per-job render cache for DTF Design Packer outputs
+
+Every output format starts from the same per-design pixels: the decoded
+BGRA converted to RGBA and rotated for the placement. RenderCache does this
+once per (asset, rotation) and hands the same PIL image to the PNG, PDF and
+SVG writers, instead of every writer converting and rotating the full
+original again.
+
+Full-resolution images are only kept when a PDF or SVG is being written
+(keep_rgba); a PNG-only job converts each design as it reaches it and keeps
+nothing. PNG-sized (resampled) images are never cached: the PNG writers
+hold them only while the placements using them are being composited, so
+their memory stays bounded by the rows in flight.
+
+Entries are evicted least-recently-used once the cache holds more than
+max_bytes of pixels, so long sheets with many designs stay bounded. The
+writers may run in parallel threads; concurrent requests for the same entry
+wait for the first one instead of preparing it again.
+"""
+import threading
+from collections import OrderedDict
+
+import cv2
+from PIL import Image
+
+from asset_store import load_bgra
+
+
+class RenderCache:
+    """LRU cache of full-resolution RGBA PIL images per (asset, rotation)."""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, keep_rgba=True):
+        self.max_bytes = max_bytes
+        self.keep_rgba = keep_rgba
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._building = {}  # key -> lock held while that entry is prepared
+
+    @staticmethod
+    def asset_id(img_data):
+        """Content key of a design (falls back to its path when it has none)."""
+        return img_data.get('asset_key') or img_data['path']
+
+    def _get(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+            return image
+
+    def _get_or_build(self, key, build):
+        image = self._get(key)
+        if image is not None:
+            with self._lock:
+                self.hits += 1
+            return image
+        with self._lock:
+            key_lock = self._building.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # Another thread may have built it while we waited
+                image = self._get(key)
+                if image is not None:
+                    with self._lock:
+                        self.hits += 1
+                    return image
+                with self._lock:
+                    self.misses += 1
+                image = build()
+                return self._put(key, image) if image is not None else None
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+    def _put(self, key, image):
+        nbytes = image.width * image.height * 4
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            self._entries[key] = image
+            self.size_bytes += nbytes
+            # Never evict the entry just added, even when it alone exceeds the budget
+            while self.size_bytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self.size_bytes -= old.width * old.height * 4
+        return image
+
+    def rgba(self, img_data, rotated):
+        """Full-resolution RGBA image of a design, rotated 90 degrees if requested.
+
+        Returns None if the design cannot be decoded.
+        """
+        def build():
+            img_bgra = img_data.get('img_bgra')
+            if img_bgra is None:
+                img_bgra = load_bgra(img_data['path'])
+                if img_bgra is None:
+                    return None
+            image = Image.fromarray(cv2.cvtColor(img_bgra, cv2.COLOR_BGRA2RGBA))
+            if rotated:
+                image = image.rotate(90, expand=True)
+            return image
+
+        if not self.keep_rgba:
+            with self._lock:
+                self.misses += 1
+            return build()
+        return self._get_or_build((self.asset_id(img_data), bool(rotated)), build)
+
+    @staticmethod
+    def placement_key(img_data, p, pixels_per_mm):
+        """(asset, rotation, (w, h) px) of a design as placed on a sheet rendered at pixels_per_mm."""
+        size = (int(p['width_mm'] * pixels_per_mm), int(p['height_mm'] * pixels_per_mm))
+        return RenderCache.asset_id(img_data), bool(p['rotated']), size
+
+    def placement_image(self, img_data, p, pixels_per_mm):
+        """Image of a design as placed on a sheet rendered at pixels_per_mm (not cached)."""
+        _, rotated, size = self.placement_key(img_data, p, pixels_per_mm)
+        image = self.rgba(img_data, rotated)
+        if image is None:
+            return None
+        return image.resize(size, Image.Resampling.LANCZOS)
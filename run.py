@@ -19,22 +19,31 @@ def run_flask():
     print(f"Starting Flask app on {host}:{port} (debug={debug})")
     app.run(host=host, port=port, debug=debug)
 
-def run_celery_worker():
-    """Run a Celery worker"""
+def run_celery_worker(queue=None):
+    """Run a Celery worker, for one queue (with that queue's settings) or for all of them"""
     from celery_tasks import celery
-    argv = ['worker', '--loglevel=info', '-E', '--concurrency=4']
+    argv = ['worker', '--loglevel=info', '-E']
+    if queue:
+        settings = celery.conf.worker_queue_settings[queue]
+        argv += ['-Q', queue, f'--hostname={queue}@%h',
+                 f"--concurrency={settings['concurrency']}",
+                 f"--max-memory-per-child={settings['max_memory_per_child']}"]
+    else:
+        argv += ['-Q', ','.join(celery.conf.worker_queue_settings), '--concurrency=4']
     celery.worker_main(argv)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run DTF Design Packer application')
     parser.add_argument('--worker', action='store_true', help='Run as Celery worker')
+    parser.add_argument('--queue', choices=['fast', 'pack', 'render'],
+                        help='Queue for --worker (default: all queues)')
     parser.add_argument('--web', action='store_true', help='Run as Flask web server')
     parser.add_argument('--both', action='store_true', help='Run both Flask and Celery (development only)')
     
     args = parser.parse_args()
     
     if args.worker:
-        run_celery_worker()
+        run_celery_worker(args.queue)
     elif args.both:
         # Start celery worker in a separate process
         print("Starting Celery worker...")
@@ -3,6 +3,7 @@ Session management module for DTF Design Packer
 Handles session timeouts, cleanup of expired sessions, and resource management
 """
 import os
+import glob
 import time
 import shutil
 import logging
@@ -10,6 +11,8 @@ from datetime import datetime, timedelta
 import threading
 import json
 
+from asset_store import AssetStore
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -23,6 +26,10 @@ class SessionManager:
         self.output_folder = app.config['OUTPUT_FOLDER']
         self.session_timeout = app.config.get('SESSION_TIMEOUT', 3600)  # Default 1 hour
         self.cleanup_interval = app.config.get('SESSION_CLEANUP_INTERVAL', 3600)  # Default 1 hour
+        # Decoded designs outlive a session only until they go unused this long
+        self.asset_store = AssetStore(app.config['ASSET_STORE_FOLDER'])
+        self.asset_max_age = app.config.get('ASSET_STORE_MAX_AGE', self.session_timeout)
+        self.asset_max_bytes = app.config.get('ASSET_STORE_MAX_MB', 2048) * 1024 * 1024
         self.session_activity = {}  # Tracks last activity time for each session
         self.lock = threading.Lock()  # Thread safety for session activity tracking
         
@@ -156,6 +163,13 @@ class SessionManager:
         if expired_sessions:
             logger.info(f"Cleaned up {len(expired_sessions)} expired sessions")
         
+        # Prune the shared asset store (assets are shared between sessions,
+        # so they are removed by last use rather than with a session)
+        try:
+            self.asset_store.prune(max_age=self.asset_max_age, max_bytes=self.asset_max_bytes)
+        except Exception as e:
+            logger.error(f"Error pruning asset store: {e}")
+        
         return len(expired_sessions)
     
     def _cleanup_session_files(self, session_id):
@@ -171,9 +185,8 @@ class SessionManager:
             if os.path.exists(output_dir):
                 shutil.rmtree(output_dir, ignore_errors=True)
                 
-            # Clean up zip file
-            zip_path = os.path.join(self.output_folder, f'{session_id}_results.zip')
-            if os.path.exists(zip_path):
+            # Clean up zip files (one per cached output set)
+            for zip_path in glob.glob(os.path.join(self.output_folder, f'{session_id}_results*.zip')):
                 os.remove(zip_path)
                 
             logger.debug(f"Cleaned up files for session: {session_id}")
@@ -10,6 +10,7 @@ import time
 import math
 import io
 import multiprocessing
+from multiprocessing import shared_memory
 from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import cProfile
@@ -23,6 +24,8 @@ from reportlab.lib.units import cm, mm
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.pagesizes import A4
 
+from occupancy import IntegralOccupancy, CandidateCache, BitpackedOccupancy, PackedMask, best_candidate
+
 # --- Configuration --- 
 INPUT_DIR = r"C:\Users\Ali\Downloads\ORDERS TOD\New folder"  # Put your design images here
 OUTPUT_DIR = r"C:\Users\Ali\Downloads\ORDERS TOD\New folder"  # Output files will be saved here
@@ -45,6 +48,25 @@ MAX_PLACEMENT_ATTEMPTS = 10 # Max attempts to find a spot before increasing heig
 # Placement Algorithm Tuning
 PLACEMENT_STEP_MM = 5 # Search step size in mm (smaller = slower but potentially denser)
 SORT_IMAGES = True # Sort images before packing (e.g., by area descending)
+# "integral": summed-area-table engine, judges the whole candidate grid per image in one vectorized pass
+# "shape": like "integral", but transparent (die-cut) designs are nested by their actual
+#          outline using a correlation-based collision map (see occupancy.collision_map)
+# "scan": original per-position search (ROI slicing for every candidate, run in the process pool)
+# "shared": "scan" with the canvas and design masks in shared memory; pool workers attach once
+#           and only image ids cross the process boundary per iteration
+# "coarse": coarse-to-fine search on the "integral" tables: COARSE_STEP_MM blocks are screened first,
+#           then the REFINE_BLOCKS most promising ones are searched at FINE_STEP_MM
+# "bitpacked": canvas and design masks packed 8 pixels per byte, overlap tests by bitwise AND of
+#              packed rows; same placements as "shape" at BITPACKED_PX_PER_MM = 1, and small enough
+#              for finer grids (2 = 0.5 mm, 4 = 0.25 mm per pixel)
+PLACEMENT_ENGINE = "integral"
+BITPACKED_PX_PER_MM = 1
+COARSE_STEP_MM = 8
+FINE_STEP_MM = 1
+REFINE_BLOCKS = 12
+# Keep each image's best candidate between iterations and only rescan around new placements
+# ("integral" and "shape" engines)
+CANDIDATE_CACHE = True
 
 # Files to exclude from processing
 EXCLUDED_PATTERNS = [
@@ -232,6 +254,15 @@ def calculate_placement_score(x_mm, y_mm, width_mm, height_mm, canvas_mask, spac
 
     return score
 
+def placement_options(img_data, allow_rotation):
+    """Returns the (width_mm, height_mm, mask, rotated) orientations to try for an image."""
+    options = [(img_data['width_mm'], img_data['height_mm'], img_data['mask'], False)] # Original orientation
+    if allow_rotation and img_data['width_mm'] != img_data['height_mm']:
+        # Add 90-degree rotated option
+        rotated_mask = cv2.rotate(img_data['mask'], cv2.ROTATE_90_CLOCKWISE)
+        options.append((img_data['height_mm'], img_data['width_mm'], rotated_mask, True))
+    return options
+
 def try_placement_for_image(args):
     """Worker function to find the best placement for a single image on the current canvas."""
     img_data, canvas_mask, canvas_h, canvas_w, spacing_mm, step_mm, allow_rotation = args # Renamed for direct use with threads
@@ -242,11 +273,7 @@ def try_placement_for_image(args):
     # Access the shared canvas mask (direct access with threads)
     # canvas_mask = np.frombuffer(canvas_mask_shared.get_obj(), dtype=np.uint8).reshape((canvas_h, canvas_w)) # Removed for threading
 
-    options = [(img_data['width_mm'], img_data['height_mm'], img_data['mask'], False)] # Original orientation
-    if allow_rotation and img_data['width_mm'] != img_data['height_mm']:
-        # Add 90-degree rotated option
-        rotated_mask = cv2.rotate(img_data['mask'], cv2.ROTATE_90_CLOCKWISE)
-        options.append((img_data['height_mm'], img_data['width_mm'], rotated_mask, True))
+    options = placement_options(img_data, allow_rotation)
 
     for width_mm, height_mm, mask_to_place, rotated in options:
         if width_mm > canvas_w or height_mm > canvas_h:
@@ -292,6 +319,263 @@ def try_placement_for_image(args):
     # Return the best placement found for this image (or None)
     return best_placement
 
+def search_orientation(occupancy, width_mm, height_mm, mask_to_place, step_mm, shape_aware=False, bounds=None):
+    """Scores one orientation over the step grid.
+
+    bounds=(y0, x0, y1, x1) restricts the search to the candidates in that
+    top-left range (used by CandidateCache for local rescans).
+
+    Returns:
+        tuple: (ys, xs, scores) with +inf for invalid positions.
+    """
+    ys, xs = occupancy.candidate_grid(width_mm, height_mm, step_mm, bounds)
+    if ys.size == 0:
+        return ys, xs, np.zeros(0)
+    if shape_aware and not mask_to_place.all():
+        # Zeros of the collision map are the feasible positions
+        if bounds is None:
+            y0, x0 = 0, 0
+            counts = occupancy.collision_counts(mask_to_place)
+        else:
+            y0, x0 = int(ys[0]), int(xs[0])
+            counts = occupancy.collision_counts(mask_to_place, (y0, x0, int(ys[-1]) + 1, int(xs[-1]) + 1))
+        valid = counts[ys - y0, xs - x0] < 0.5
+        scores = np.full(ys.shape, np.inf)
+        keep = np.flatnonzero(valid)
+        if keep.size:
+            scores[keep] = occupancy.score(ys[keep], xs[keep], width_mm, height_mm)
+    else:
+        valid, scores = occupancy.evaluate(ys, xs, width_mm, height_mm, mask_to_place)
+    return ys, xs, scores
+
+def try_placement_for_image_integral(img_data, occupancy, step_mm, allow_rotation, shape_aware=False, cache=None):
+    """Same search as try_placement_for_image, using the summed-area-table engine.
+
+    Every candidate of the step grid is judged in one vectorized pass per
+    orientation, so the cost per image no longer depends on the design size.
+    With shape_aware=True, designs with transparency are judged against a
+    full collision map of their mask instead of their bounding box.
+    With a CandidateCache, only candidates near the placements made since
+    the previous call are re-evaluated.
+    """
+    best_placement = None
+    best_score = float('inf')
+
+    for width_mm, height_mm, mask_to_place, rotated in placement_options(img_data, allow_rotation):
+        if width_mm > occupancy.canvas_w or height_mm > occupancy.canvas_h:
+            continue # Skip if image is larger than canvas
+
+        def search(bounds):
+            return search_orientation(occupancy, width_mm, height_mm, mask_to_place, step_mm,
+                                      shape_aware, bounds)
+
+        if cache is not None:
+            best = cache.best((img_data['id'], rotated), width_mm, height_mm, step_mm, search)
+        else:
+            # argmin keeps the first (top-most, then left-most) of equal scores,
+            # matching the row-major scan order of the original loop
+            best = best_candidate(*search(None))
+        if best is None:
+            continue
+
+        score, y, x = best
+        if rotated:
+            score += 0.1
+
+        if score < best_score:
+            best_score = score
+            best_placement = {
+                'id': img_data['id'],
+                'path': img_data['path'],
+                'x_mm': x,
+                'y_mm': y,
+                'width_mm': width_mm, # Placed width (content only)
+                'height_mm': height_mm, # Placed height (content only)
+                'rotated': rotated,
+                'score': score
+            }
+
+    return best_placement
+
+def try_placement_for_image_coarse(img_data, occupancy, coarse_step_mm, fine_step_mm, allow_rotation,
+                                   refine_blocks=REFINE_BLOCKS):
+    """Coarse-to-fine variant of try_placement_for_image_integral.
+
+    Blocks of coarse_step_mm x coarse_step_mm top-left positions that cannot
+    contain a free position are dropped with one lookup each; the remaining
+    blocks are ranked by the score of their anchor, and only the best
+    refine_blocks of them are searched at fine_step_mm. This gives close to
+    fine-step density at about the cost of a coarse-step scan.
+    """
+    best_placement = None
+    best_score = float('inf')
+
+    for width_mm, height_mm, mask_to_place, rotated in placement_options(img_data, allow_rotation):
+        if width_mm > occupancy.canvas_w or height_mm > occupancy.canvas_h:
+            continue # Skip if image is larger than canvas
+
+        block_ys, block_xs = occupancy.feasible_blocks(width_mm, height_mm, coarse_step_mm)
+        if block_ys.size == 0:
+            continue
+        anchor_scores = occupancy.score(block_ys, block_xs, width_mm, height_mm)
+        order = np.argsort(anchor_scores, kind='stable')[:refine_blocks]
+
+        fine = [occupancy.candidate_grid(width_mm, height_mm, fine_step_mm,
+                                         (block_ys[i], block_xs[i],
+                                          block_ys[i] + coarse_step_mm, block_xs[i] + coarse_step_mm))
+                for i in order]
+        ys = np.concatenate([f[0] for f in fine])
+        xs = np.concatenate([f[1] for f in fine])
+        # Row-major order, so ties resolve like the full scan
+        row_major = np.lexsort((xs, ys))
+        ys, xs = ys[row_major], xs[row_major]
+        _, scores = occupancy.evaluate(ys, xs, width_mm, height_mm, mask_to_place)
+        best = best_candidate(ys, xs, scores)
+        if best is None:
+            continue
+
+        score, y, x = best
+        if rotated:
+            score += 0.1
+
+        if score < best_score:
+            best_score = score
+            best_placement = {
+                'id': img_data['id'],
+                'path': img_data['path'],
+                'x_mm': x,
+                'y_mm': y,
+                'width_mm': width_mm, # Placed width (content only)
+                'height_mm': height_mm, # Placed height (content only)
+                'rotated': rotated,
+                'score': score
+            }
+
+    return best_placement
+
+def packed_design_options(img_data, allow_rotation, px_per_mm, spacing_px):
+    """Packs an image's orientations for the "bitpacked" engine.
+
+    Returns (width_mm, height_mm, mask, dilated, rotated) tuples where mask
+    is the design at px_per_mm pixels per mm and dilated the same mask grown
+    by spacing_px on every side, both as PackedMask.
+    """
+    width_px = img_data['width_mm'] * px_per_mm
+    height_px = img_data['height_mm'] * px_per_mm
+    if px_per_mm == 1:
+        mask = img_data['mask']
+    else:
+        # Resample from the full-resolution alpha instead of the 1 mm mask
+        mask = cv2.resize(img_data['img_bgra'][:, :, 3], (width_px, height_px), interpolation=cv2.INTER_NEAREST)
+    mask = (mask > 0).astype(np.uint8)
+
+    options = []
+    for width_mm, height_mm, mask_to_place, rotated in placement_options(dict(img_data, mask=mask), allow_rotation):
+        dilated = np.pad(mask_to_place, spacing_px)
+        if spacing_px > 0:
+            size = 2 * spacing_px + 1
+            dilated = cv2.dilate(dilated, np.ones((size, size), dtype=np.uint8))
+        options.append((width_mm, height_mm, PackedMask(mask_to_place), PackedMask(dilated), rotated))
+    return options
+
+def try_placement_for_image_bitpacked(img_data, packed_canvas, step_px, spacing_px, px_per_mm):
+    """try_placement_for_image on a BitpackedOccupancy (positions returned in mm)."""
+    best_placement = None
+    best_score = float('inf')
+
+    for width_mm, height_mm, mask, dilated, rotated in img_data['packed_options']:
+        if mask.width > packed_canvas.width or mask.height > packed_canvas.height:
+            continue # Skip if image is larger than canvas
+
+        best = packed_canvas.search(dilated, mask.width, mask.height, step_px, spacing_px, px_per_mm)
+        if best is None:
+            continue
+
+        score, y, x = best
+        if rotated:
+            score += 0.1
+
+        if score < best_score:
+            best_score = score
+            best_placement = {
+                'id': img_data['id'],
+                'path': img_data['path'],
+                'x_mm': x / px_per_mm if px_per_mm != 1 else x,
+                'y_mm': y / px_per_mm if px_per_mm != 1 else y,
+                'width_mm': width_mm, # Placed width (content only)
+                'height_mm': height_mm, # Placed height (content only)
+                'rotated': rotated,
+                'score': score
+            }
+
+    return best_placement
+
+class SharedPackingState:
+    """Canvas mask and design masks in shared memory for the "shared" engine.
+
+    The parent writes placements straight into the shared canvas, so after
+    the one-time attach in _attach_shared_state a worker only needs the ids
+    of the images still to place.
+    """
+
+    def __init__(self, canvas_shape, image_data_list):
+        self.canvas_shape = canvas_shape
+        self.canvas_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(canvas_shape)))
+        self.canvas = np.ndarray(canvas_shape, dtype=np.uint8, buffer=self.canvas_shm.buf)
+        self.canvas.fill(0)
+
+        # Mask store: every design mask as 0/1 bytes, back to back
+        self.mask_index = {}
+        offset = 0
+        for img_data in image_data_list:
+            h, w = img_data['mask'].shape
+            self.mask_index[img_data['id']] = (offset, h, w, img_data['path'])
+            offset += h * w
+        self.store_shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+        store = np.ndarray((offset,), dtype=np.uint8, buffer=self.store_shm.buf)
+        for img_data in image_data_list:
+            start, h, w, _ = self.mask_index[img_data['id']]
+            store[start:start + h * w] = (img_data['mask'] > 0).ravel()
+
+    def initargs(self):
+        return (self.canvas_shm.name, self.canvas_shape, self.store_shm.name, self.mask_index)
+
+    def close(self):
+        self.canvas = None
+        for shm in (self.canvas_shm, self.store_shm):
+            shm.close()
+            shm.unlink()
+
+# Per-process view of the SharedPackingState (set by the pool initializer)
+_shared_worker_state = {}
+
+def _attach_shared_state(canvas_name, canvas_shape, store_name, mask_index):
+    """Pool initializer: attaches the worker to the shared canvas and mask store once."""
+    canvas_shm = shared_memory.SharedMemory(name=canvas_name)
+    store_shm = shared_memory.SharedMemory(name=store_name)
+    _shared_worker_state.update(
+        canvas_shm=canvas_shm, # Keep the handles alive for the worker's lifetime
+        store_shm=store_shm,
+        canvas=np.ndarray(canvas_shape, dtype=np.uint8, buffer=canvas_shm.buf),
+        store=np.ndarray((store_shm.size,), dtype=np.uint8, buffer=store_shm.buf),
+        mask_index=mask_index,
+    )
+
+def try_placement_for_image_shared(args):
+    """Worker function of the "shared" engine: try_placement_for_image on the shared canvas."""
+    image_id, spacing_mm, step_mm, allow_rotation = args
+    offset, h, w, path = _shared_worker_state['mask_index'][image_id]
+    img_data = {
+        'id': image_id,
+        'path': path,
+        'width_mm': w,
+        'height_mm': h,
+        'mask': _shared_worker_state['store'][offset:offset + h * w].reshape(h, w)
+    }
+    canvas_mask = _shared_worker_state['canvas']
+    canvas_h, canvas_w = canvas_mask.shape
+    return try_placement_for_image((img_data, canvas_mask, canvas_h, canvas_w, spacing_mm, step_mm, allow_rotation))
+
 # --- Main Execution --- 
 
 def main():
@@ -352,82 +636,139 @@ def main():
     # Create the initial canvas mask (using mm as units)
     # Use a shared memory array for the mask for parallel access
     canvas_mask_shape = (current_canvas_height_mm, canvas_width_mm)
-    shared_mask_arr = multiprocessing.Array('B', current_canvas_height_mm * canvas_width_mm, lock=False)
-    canvas_mask = np.frombuffer(shared_mask_arr, dtype=np.uint8).reshape(canvas_mask_shape)
-    canvas_mask.fill(0) # Initialize to empty
+    shared_state = None
+    packed_canvas = None
+    pool_options = {}
+    if PLACEMENT_ENGINE == "shared":
+        shared_state = SharedPackingState(canvas_mask_shape, image_data_list)
+        canvas_mask = shared_state.canvas
+        pool_options = {'initializer': _attach_shared_state, 'initargs': shared_state.initargs()}
+    elif PLACEMENT_ENGINE == "bitpacked":
+        # Occupancy only lives in packed form; no unpacked canvas mask is kept
+        canvas_mask = None
+        r = BITPACKED_PX_PER_MM
+        packed_canvas = BitpackedOccupancy(current_canvas_height_mm * r, canvas_width_mm * r, pad=SPACING_MM * r)
+        for img_data in image_data_list:
+            img_data['packed_options'] = packed_design_options(img_data, ALLOW_ROTATION, r, SPACING_MM * r)
+            img_data['mask'] = None # Superseded by the packed masks
+        print(f"Bit-packed canvas: {packed_canvas.nbytes / 1e6:.1f} MB at {r} px/mm")
+    else:
+        shared_mask_arr = multiprocessing.Array('B', current_canvas_height_mm * canvas_width_mm, lock=False)
+        canvas_mask = np.frombuffer(shared_mask_arr, dtype=np.uint8).reshape(canvas_mask_shape)
+        canvas_mask.fill(0) # Initialize to empty
+    occupancy = IntegralOccupancy(canvas_mask, SPACING_MM) if PLACEMENT_ENGINE in ("integral", "shape", "coarse") else None
+    candidate_cache = CandidateCache(SPACING_MM) if PLACEMENT_ENGINE in ("integral", "shape") and CANDIDATE_CACHE else None
 
     placement_attempts = 0
     last_successful_placement_index = -1
 
-    with ProcessPoolExecutor(max_workers=NUM_PROCESSES) as executor:
-        while unplaced_images:
-            print(f"Packing iteration: {len(unplaced_images)} images remaining. Canvas height: {current_canvas_height_mm}mm")
-            made_placement_in_iteration = False
-            
-            # Prepare arguments for parallel processing for all remaining images
-            args_list = [(img_data, canvas_mask, current_canvas_height_mm, canvas_width_mm, SPACING_MM, PLACEMENT_STEP_MM, ALLOW_ROTATION)
-                         for img_data in unplaced_images]
+    # The shared memory segments must be released however the loop ends
+    # (worker error, bad image, KeyboardInterrupt), or they stay in /dev/shm
+    try:
+        with ProcessPoolExecutor(max_workers=NUM_PROCESSES, **pool_options) as executor:
+            while unplaced_images:
+                print(f"Packing iteration: {len(unplaced_images)} images remaining. Canvas height: {current_canvas_height_mm}mm")
+                made_placement_in_iteration = False
             
-            results = list(executor.map(try_placement_for_image, args_list))
+                if packed_canvas is not None:
+                    results = [try_placement_for_image_bitpacked(img_data, packed_canvas, PLACEMENT_STEP_MM * BITPACKED_PX_PER_MM,
+                                                                 SPACING_MM * BITPACKED_PX_PER_MM, BITPACKED_PX_PER_MM)
+                               for img_data in unplaced_images]
+                elif PLACEMENT_ENGINE == "coarse":
+                    results = [try_placement_for_image_coarse(img_data, occupancy, COARSE_STEP_MM, FINE_STEP_MM, ALLOW_ROTATION)
+                               for img_data in unplaced_images]
+                elif occupancy is not None:
+                    # Vectorized search runs in-process: no canvas pickling per iteration
+                    results = [try_placement_for_image_integral(img_data, occupancy, PLACEMENT_STEP_MM, ALLOW_ROTATION,
+                                                                shape_aware=(PLACEMENT_ENGINE == "shape"),
+                                                                cache=candidate_cache)
+                               for img_data in unplaced_images]
+                elif shared_state is not None:
+                    # Workers read the canvas and masks from shared memory: only ids are sent
+                    args_list = [(img_data['id'], SPACING_MM, PLACEMENT_STEP_MM, ALLOW_ROTATION)
+                                 for img_data in unplaced_images]
+                    results = list(executor.map(try_placement_for_image_shared, args_list))
+                else:
+                    # Prepare arguments for parallel processing for all remaining images
+                    args_list = [(img_data, canvas_mask, current_canvas_height_mm, canvas_width_mm, SPACING_MM, PLACEMENT_STEP_MM, ALLOW_ROTATION)
+                                 for img_data in unplaced_images]
+
+                    results = list(executor.map(try_placement_for_image, args_list))
             
-            # Process results - find the best valid placement among all images
-            best_result_for_iteration = None
-            best_result_index = -1
-
-            for i, result in enumerate(results):
-                if result: # If a valid placement was found for this image
-                    if best_result_for_iteration is None or result['score'] < best_result_for_iteration['score']:
-                        best_result_for_iteration = result
-                        best_result_index = i
-
-
-            # --- Decision Point: Place the best image or handle failure ---
-            if best_result_for_iteration:
-                # Get the actual image data corresponding to the best result index
-                placed_img_data = unplaced_images.pop(best_result_index) # Remove from unplaced
-                placement = best_result_for_iteration
-                placements.append(placement) # Add to successful placements
-
-                print(f"  Placed: {placement['id']} at ({placement['x_mm']}, {placement['y_mm']}) Score: {placement['score']:.2f} Rotated: {placement['rotated']}")
-
-                # Update the master canvas mask
-                x, y = placement['x_mm'], placement['y_mm']
-                w, h = placement['width_mm'], placement['height_mm']
-                mask_to_apply = placed_img_data['mask']
-                if placement['rotated']:
-                    # Ensure mask is rotated *before* applying
-                    mask_to_apply = cv2.rotate(placed_img_data['mask'], cv2.ROTATE_90_CLOCKWISE)
-                
-                # Verify mask dimensions match placement dimensions
-                mask_h, mask_w = mask_to_apply.shape
-                if mask_h != h or mask_w != w:
-                     print(f"Warning: Mask dimension mismatch for {placement['id']}. Expected ({h},{w}), got ({mask_h},{mask_w}). Resizing mask.")
-                     # Resize using nearest neighbor to preserve binary nature if possible
-                     mask_to_apply = cv2.resize(mask_to_apply, (w, h), interpolation=cv2.INTER_NEAREST) 
-
-                # Apply the mask to the shared canvas_mask using logical OR
-                try:
-                    canvas_mask_roi = canvas_mask[y:y+h, x:x+w]
-                    # Ensure shapes match exactly before logical_or
-                    if canvas_mask_roi.shape == mask_to_apply.shape:
-                        canvas_mask[y:y+h, x:x+w] = np.logical_or(canvas_mask_roi, mask_to_apply)
+                # Process results - find the best valid placement among all images
+                best_result_for_iteration = None
+                best_result_index = -1
+
+                for i, result in enumerate(results):
+                    if result: # If a valid placement was found for this image
+                        if best_result_for_iteration is None or result['score'] < best_result_for_iteration['score']:
+                            best_result_for_iteration = result
+                            best_result_index = i
+
+
+                # --- Decision Point: Place the best image or handle failure ---
+                if best_result_for_iteration:
+                    # Get the actual image data corresponding to the best result index
+                    placed_img_data = unplaced_images.pop(best_result_index) # Remove from unplaced
+                    placement = best_result_for_iteration
+                    placements.append(placement) # Add to successful placements
+
+                    print(f"  Placed: {placement['id']} at ({placement['x_mm']}, {placement['y_mm']}) Score: {placement['score']:.2f} Rotated: {placement['rotated']}")
+
+                    if packed_canvas is not None:
+                        # Packed masks were prepared per orientation up front
+                        packed_mask = next(option[2] for option in placed_img_data['packed_options']
+                                           if option[4] == placement['rotated'])
+                        packed_canvas.place(packed_mask, int(round(placement['x_mm'] * BITPACKED_PX_PER_MM)),
+                                            int(round(placement['y_mm'] * BITPACKED_PX_PER_MM)))
                     else:
-                        print(f"Error: ROI shape {canvas_mask_roi.shape} does not match mask shape {mask_to_apply.shape} for {placement['id']}. Skipping mask update.")
-                except ValueError as ve:
-                     print(f"Error applying mask for {placement['id']} at ({x},{y}) size ({w},{h}) on canvas {canvas_mask.shape}: {ve}")
-                     # This might indicate placement outside bounds, though try_placement should prevent this
-
-                made_placement_in_iteration = True
-                placement_attempts = 0 # Reset attempts after successful placement
-                last_successful_placement_index = len(placements) - 1 
-
-            else: # No valid placement found for *any* remaining image in this iteration
-                placement_attempts += 1
-                print(f"  No suitable placement found in this iteration. Attempt {placement_attempts}/{MAX_PLACEMENT_ATTEMPTS}.")
-                if placement_attempts >= MAX_PLACEMENT_ATTEMPTS:
-                    print(f"Warning: Could not place remaining {len(unplaced_images)} images after {MAX_PLACEMENT_ATTEMPTS} attempts with current canvas size. Stopping packing loop.")
-                    break # Exit the while loop
-        # --- End of while unplaced_images loop ---
+                        # Update the master canvas mask
+                        x, y = placement['x_mm'], placement['y_mm']
+                        w, h = placement['width_mm'], placement['height_mm']
+                        mask_to_apply = placed_img_data['mask']
+                        if placement['rotated']:
+                            # Ensure mask is rotated *before* applying
+                            mask_to_apply = cv2.rotate(placed_img_data['mask'], cv2.ROTATE_90_CLOCKWISE)
+                
+                        # Verify mask dimensions match placement dimensions
+                        mask_h, mask_w = mask_to_apply.shape
+                        if mask_h != h or mask_w != w:
+                             print(f"Warning: Mask dimension mismatch for {placement['id']}. Expected ({h},{w}), got ({mask_h},{mask_w}). Resizing mask.")
+                             # Resize using nearest neighbor to preserve binary nature if possible
+                             mask_to_apply = cv2.resize(mask_to_apply, (w, h), interpolation=cv2.INTER_NEAREST) 
+
+                        # Apply the mask to the shared canvas_mask using logical OR
+                        try:
+                            canvas_mask_roi = canvas_mask[y:y+h, x:x+w]
+                            # Ensure shapes match exactly before logical_or
+                            if canvas_mask_roi.shape == mask_to_apply.shape:
+                                canvas_mask[y:y+h, x:x+w] = np.logical_or(canvas_mask_roi, mask_to_apply)
+                                if occupancy is not None:
+                                    occupancy.mark_region(x, y, w, h)
+                                if candidate_cache is not None:
+                                    candidate_cache.mark_placed(x, y, w, h)
+                                    candidate_cache.forget(placement['id'])
+                            else:
+                                print(f"Error: ROI shape {canvas_mask_roi.shape} does not match mask shape {mask_to_apply.shape} for {placement['id']}. Skipping mask update.")
+                        except ValueError as ve:
+                             print(f"Error applying mask for {placement['id']} at ({x},{y}) size ({w},{h}) on canvas {canvas_mask.shape}: {ve}")
+                             # This might indicate placement outside bounds, though try_placement should prevent this
+
+                    made_placement_in_iteration = True
+                    placement_attempts = 0 # Reset attempts after successful placement
+                    last_successful_placement_index = len(placements) - 1 
+
+                else: # No valid placement found for *any* remaining image in this iteration
+                    placement_attempts += 1
+                    print(f"  No suitable placement found in this iteration. Attempt {placement_attempts}/{MAX_PLACEMENT_ATTEMPTS}.")
+                    if placement_attempts >= MAX_PLACEMENT_ATTEMPTS:
+                        print(f"Warning: Could not place remaining {len(unplaced_images)} images after {MAX_PLACEMENT_ATTEMPTS} attempts with current canvas size. Stopping packing loop.")
+                        break # Exit the while loop
+            # --- End of while unplaced_images loop ---
+    finally:
+        if shared_state is not None:
+            canvas_mask = None # Release the last view of the shared block before closing it
+            shared_state.close()
 
     # --- Step 3: Generate Output Files ---
     print("\nStep 3: Generating output files...")
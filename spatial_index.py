@@ -0,0 +1,107 @@
+"""
+Spatial index for placed rectangles in DTF Design Packer
+
+A uniform grid over the canvas (in mm). Every placement is registered in the
+cells covered by its bounds inflated by the spacing (plus 1 mm, the tolerance
+used for adjacency), so overlap checks and neighbour lookups for a candidate
+rectangle only touch placements in the cells that rectangle covers instead of
+every placement on the sheet.
+"""
+
+
+class SpatialGrid:
+    """Uniform-grid index of placement dicts (x_mm, y_mm, width_mm, height_mm, id)."""
+
+    def __init__(self, spacing_mm, cell_size_mm=50):
+        self.spacing_mm = spacing_mm
+        self.reach = spacing_mm + 1
+        self.cell_size = cell_size_mm
+        self.cells = {}  # (cx, cy) -> set of placement ids
+        self.items = {}  # placement id -> (placement, covered cell keys)
+
+    @classmethod
+    def from_placements(cls, placements, spacing_mm, cell_size_mm=50):
+        grid = cls(spacing_mm, cell_size_mm)
+        for p in placements:
+            grid.insert(p)
+        return grid
+
+    def __len__(self):
+        return len(self.items)
+
+    def _cell_range(self, x0, y0, x1, y1):
+        size = self.cell_size
+        for cy in range(int(y0 // size), int(y1 // size) + 1):
+            for cx in range(int(x0 // size), int(x1 // size) + 1):
+                yield (cx, cy)
+
+    def insert(self, placement):
+        """Registers a placement (replacing any placement with the same id)."""
+        if placement['id'] in self.items:
+            self.remove(placement['id'])
+        r = self.reach
+        keys = list(self._cell_range(placement['x_mm'] - r, placement['y_mm'] - r,
+                                     placement['x_mm'] + placement['width_mm'] + r,
+                                     placement['y_mm'] + placement['height_mm'] + r))
+        for key in keys:
+            self.cells.setdefault(key, set()).add(placement['id'])
+        bounds = (placement['x_mm'], placement['y_mm'],
+                  placement['x_mm'] + placement['width_mm'],
+                  placement['y_mm'] + placement['height_mm'])
+        self.items[placement['id']] = (placement, keys, bounds)
+
+    def remove(self, placement_id):
+        """Unregisters a placement by id; returns the removed placement or None."""
+        entry = self.items.pop(placement_id, None)
+        if entry is None:
+            return None
+        placement, keys, _ = entry
+        for key in keys:
+            bucket = self.cells.get(key)
+            if bucket is not None:
+                bucket.discard(placement_id)
+                if not bucket:
+                    del self.cells[key]
+        return placement
+
+    def query(self, x, y, w, h):
+        """Yields placements whose inflated bounds may touch the rectangle."""
+        seen = set()
+        for key in self._cell_range(x, y, x + w, y + h):
+            for placement_id in self.cells.get(key, ()):
+                if placement_id not in seen:
+                    seen.add(placement_id)
+                    yield self.items[placement_id][0]
+
+    def first_conflict(self, x, y, w, h, exclude_id=None):
+        """Returns a placement closer than spacing to the rectangle, or None.
+
+        Uses the same test as simple_pack_images' is_position_valid, limited
+        to placements registered in the cells the rectangle covers.
+        """
+        s = self.spacing_mm
+        size = self.cell_size
+        cells = self.cells
+        items = self.items
+        x1, y1 = x + w, y + h
+        cx0, cx1 = int(x // size), int(x1 // size)
+        for cy in range(int(y // size), int(y1 // size) + 1):
+            for cx in range(cx0, cx1 + 1):
+                bucket = cells.get((cx, cy))
+                if not bucket:
+                    continue
+                for placement_id in bucket:
+                    if exclude_id and placement_id == exclude_id:
+                        continue
+                    px0, py0, px1, py1 = items[placement_id][2]
+                    if not (x >= px1 + s or px0 >= x1 + s or y >= py1 + s or py0 >= y1 + s):
+                        return items[placement_id][0]
+        return None
+
+    def is_free(self, x, y, w, h, exclude_id=None):
+        """True when no placement is closer than spacing to the rectangle."""
+        return self.first_conflict(x, y, w, h, exclude_id) is None
+
+    def neighbours(self, x, y, w, h):
+        """Placements within spacing + 1 mm of the rectangle (adjacency candidates)."""
+        return self.query(x, y, w, h)
@@ -0,0 +1,194 @@
+"""
+SVG output for DTF Design Packer
+
+Orders often repeat one design dozens of times, so every distinct design is
+defined once, as an <image> in <defs> at its pixel size, and each placement
+is a <use> of it scaled into the placement box. File size and encoding time
+follow the number of unique designs instead of the number of placements.
+The SVG is written to the file as it is generated, one design at a time.
+
+Two image modes:
+
+- embedded  each distinct (asset, rotation) is a base64 PNG inside the SVG;
+            PNGs are encoded concurrently in a thread pool (PNG encoding
+            releases the GIL)
+- linked    each distinct asset is a file in an images folder next to the
+            SVG, referenced by relative xlink:href. PNG and JPEG uploads
+            are copied as they are, so nothing is decoded or encoded;
+            rotation is done by the <use> transform. The folder has to be
+            kept with the SVG (the results ZIP includes it)
+"""
+import base64
+import io
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from image_probe import probe_image
+from render_cache import RenderCache
+
+# Convert mm to SVG units (1mm = 3.779528 SVG units)
+SVG_SCALE = 3.779528
+
+# Accepted values for the image mode
+SVG_IMAGE_MODES = ('embedded', 'linked')
+
+# Folder, next to the SVG, holding the images of a linked SVG
+SVG_IMAGE_DIR = 'svg_images'
+
+# Probed formats a linked SVG can reference without re-encoding
+LINKABLE_FORMATS = {'png': '.png', 'jpeg': '.jpg'}
+
+
+def _encode_png_base64(image):
+    img_buffer = io.BytesIO()
+    try:
+        image.save(img_buffer, format='PNG', optimize=True)
+        return base64.b64encode(img_buffer.getvalue()).decode('utf-8')
+    finally:
+        img_buffer.close()
+
+
+def _link_image(img_data, render_cache, image_dir, name):
+    """Puts a design's unrotated image in image_dir; returns (width, height, filename) or None."""
+    path = img_data.get('path')
+    if path and img_data.get('img_bgra') is None:
+        with open(path, 'rb') as f:
+            info = probe_image(f)
+        if info is not None and info['format'] in LINKABLE_FORMATS:
+            filename = name + LINKABLE_FORMATS[info['format']]
+            shutil.copyfile(path, os.path.join(image_dir, filename))
+            return info['width'], info['height'], filename
+
+    image = render_cache.rgba(img_data, False)
+    if image is None:
+        return None
+    filename = name + '.png'
+    image.save(os.path.join(image_dir, filename), format='PNG')
+    return image.width, image.height, filename
+
+
+def linked_images(svg_path):
+    """Files referenced by a linked SVG, as (path, path relative to the SVG's folder)."""
+    image_dir = os.path.join(os.path.dirname(svg_path), SVG_IMAGE_DIR)
+    if not os.path.isdir(image_dir):
+        return []
+    return [(os.path.join(image_dir, filename), f'{SVG_IMAGE_DIR}/{filename}')
+            for filename in sorted(os.listdir(image_dir))]
+
+
+def write_svg(placements, image_data_map, svg_path, canvas_width_mm, canvas_height_mm,
+              render_cache=None, workers=4, on_error=None, mode='embedded'):
+    """Writes the packed sheet as an SVG with one image per unique design.
+
+    mode is one of SVG_IMAGE_MODES. on_error(placement, exception) is called
+    for designs that fail to encode; they are left out.
+    """
+    if mode not in SVG_IMAGE_MODES:
+        raise ValueError(f"Unknown SVG image mode: {mode}")
+    linked = mode == 'linked'
+    render_cache = render_cache or RenderCache()
+    svg_width = canvas_width_mm * SVG_SCALE
+    svg_height = canvas_height_mm * SVG_SCALE
+
+    # One definition per distinct asset (linked) or (asset, rotation) (embedded)
+    def design_key(img_data, p):
+        return RenderCache.asset_id(img_data), (False if linked else bool(p['rotated']))
+
+    designs = {}
+    for p in placements:
+        img_data = image_data_map.get(p['id'])
+        if img_data:
+            designs.setdefault(design_key(img_data, p), (img_data, p))
+
+    image_dir = os.path.join(os.path.dirname(svg_path), SVG_IMAGE_DIR)
+    if linked:
+        shutil.rmtree(image_dir, ignore_errors=True)
+        os.makedirs(image_dir)
+
+    def encode(item):
+        index, (img_data, p) = item
+        try:
+            if linked:
+                linked_file = _link_image(img_data, render_cache, image_dir, f'design{index}')
+                if linked_file is None:
+                    return None
+                width_px, height_px, filename = linked_file
+                return width_px, height_px, f'{SVG_IMAGE_DIR}/{filename}'
+            image = render_cache.rgba(img_data, p['rotated'])
+            if image is None:
+                return None
+            return image.width, image.height, f'data:image/png;base64,{_encode_png_base64(image)}'
+        except Exception as e:
+            if on_error:
+                on_error(p, e)
+            return None
+
+    design_ids = {}
+    sizes = {}
+    with open(svg_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join([
+            f'<?xml version="1.0" encoding="UTF-8"?>',
+            f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"',
+            f'     width="{svg_width:.2f}" height="{svg_height:.2f}"',
+            f'     viewBox="0 0 {svg_width:.2f} {svg_height:.2f}">',
+            f'  <!-- DTF Layout: {canvas_width_mm}mm x {canvas_height_mm}mm -->',
+            f'  <!-- Generated by DTF Packer - {len(placements)} images placed -->',
+            '',
+            '  <defs>',
+            '',
+        ]))
+
+        # Unique designs, each defined once and written as soon as it is ready
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = executor.map(encode, enumerate(designs.values()))
+            for (key, (img_data, p)), result in zip(designs.items(), results):
+                if result is None:
+                    continue
+                width_px, height_px, href = result
+                design_id = f'design{len(design_ids)}'
+                design_ids[key] = design_id
+                sizes[key] = (width_px, height_px)
+                f.write('\n'.join([
+                    f'    <!-- {img_data["filename"]} {"(rotated)" if key[1] else ""} -->',
+                    f'    <image id="{design_id}" width="{width_px}" height="{height_px}"',
+                    f'           xlink:href="{href}"/>',
+                    '',
+                ]))
+        f.write('  </defs>\n\n')
+
+        # Placements reference their design
+        for p in placements:
+            img_data = image_data_map.get(p['id'])
+            if not img_data:
+                continue
+            key = design_key(img_data, p)
+            design_id = design_ids.get(key)
+            if design_id is None:
+                continue
+            width_px, height_px = sizes[key]
+
+            # Calculate SVG positions and dimensions
+            x_svg = p['x_mm'] * SVG_SCALE
+            y_svg = p['y_mm'] * SVG_SCALE
+            width_svg = p['width_mm'] * SVG_SCALE
+            height_svg = p['height_mm'] * SVG_SCALE
+
+            if linked and p['rotated']:
+                # Unrotated image turned 90 degrees counter-clockwise into the box
+                transform = (f'matrix(0 {-height_svg / width_px:.6f} {width_svg / height_px:.6f} 0 '
+                             f'{x_svg:.2f} {y_svg + height_svg:.2f})')
+            else:
+                transform = (f'translate({x_svg:.2f} {y_svg:.2f}) '
+                             f'scale({width_svg / width_px:.6f} {height_svg / height_px:.6f})')
+
+            f.write('\n'.join([
+                f'  <!-- {p["id"]} - {p["width_mm"]}x{p["height_mm"]}mm {"(rotated)" if p["rotated"] else ""} -->',
+                f'  <use xlink:href="#{design_id}"',
+                f'       transform="{transform}"/>',
+                '',
+                '',
+            ]))
+
+        f.write('</svg>')
+    return svg_path
@@ -0,0 +1,125 @@
+"""
+Celery worker availability for DTF Design Packer
+
+Every Celery worker refreshes its entry in the Redis sorted set
+worker_heartbeats (member "<hostname> <queue>,<queue>", score = time of the
+last beat) from a background thread, and removes it on shutdown. A worker
+that dies without shutting down drops out once its last beat is older than
+the heartbeat TTL.
+
+The web app keeps a WorkerHealth monitor that re-reads the set in a
+background thread, so "can this job go to Celery?" is answered from memory
+instead of broadcasting a ping to the workers and waiting for replies on
+every submission.
+"""
+import logging
+import os
+import threading
+import time
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+HEARTBEATS_KEY = 'worker_heartbeats'
+
+
+def _member(hostname, queues):
+    return f"{hostname} {','.join(sorted(queues))}"
+
+
+class WorkerHeartbeat:
+    """Periodically records a worker (and the queues it consumes) as alive."""
+
+    def __init__(self, redis_url, hostname, queues, interval=10):
+        self.member = _member(hostname, queues)
+        self.interval = interval
+        self._client = redis.Redis.from_url(redis_url, socket_timeout=5)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def beat(self):
+        self._client.zadd(HEARTBEATS_KEY, {self.member: time.time()})
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='worker-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self._client.zrem(HEARTBEATS_KEY, self.member)
+        except redis.RedisError as e:
+            logger.warning(f"Could not remove worker heartbeat: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.beat()
+            except redis.RedisError as e:
+                logger.warning(f"Worker heartbeat failed: {e}")
+            self._stop.wait(self.interval)
+
+
+class WorkerHealth:
+    """In-memory view of the live Celery workers, refreshed in the background.
+
+    The refresh thread is started on first use in each process (so it also
+    runs in pre-forked web workers), with one synchronous read so the first
+    answer is already current.
+    """
+
+    def __init__(self, redis_url, ttl=30, interval=5):
+        self.ttl = ttl
+        self.interval = interval
+        self._redis_url = redis_url
+        self._queues = frozenset()
+        self._checked_at = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def available(self, queues):
+        """True if a live worker consumes each of the given queues."""
+        if self._pid != os.getpid():
+            self._start()
+        # A refresh thread that stopped updating must not keep reporting workers
+        if time.time() - self._checked_at > self.ttl:
+            return False
+        return self._queues.issuperset(queues)
+
+    def refresh(self, client):
+        """Reads the workers that have beaten within the TTL."""
+        now = time.time()
+        pipe = client.pipeline(transaction=False)
+        pipe.zremrangebyscore(HEARTBEATS_KEY, '-inf', now - self.ttl)
+        pipe.zrange(HEARTBEATS_KEY, 0, -1)
+        members = pipe.execute()[1]
+
+        queues = set()
+        for member in members:
+            _, _, worker_queues = member.decode('utf-8').partition(' ')
+            queues.update(q for q in worker_queues.split(',') if q)
+        self._queues = frozenset(queues)
+        self._checked_at = now
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            client = redis.Redis.from_url(self._redis_url, socket_timeout=1, socket_connect_timeout=1)
+            self._refresh_safely(client)
+            threading.Thread(target=self._run, args=(client,), name='worker-health', daemon=True).start()
+
+    def _refresh_safely(self, client):
+        try:
+            self.refresh(client)
+        except redis.RedisError as e:
+            self._queues = frozenset()
+            self._checked_at = time.time()
+            logger.debug(f"Worker health check failed: {e}")
+
+    def _run(self, client):
+        while True:
+            time.sleep(self.interval)
+            self._refresh_safely(client)
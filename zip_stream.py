@@ -0,0 +1,103 @@
+"""
+Streaming results ZIP for DTF Design Packer
+
+The results archive is produced as a generator of byte chunks, so the
+download starts with the first member instead of after the whole archive
+has been written to disk. Members that are already compressed (PNG, PDF,
+JPEG) are stored as they are; only text-like outputs (SVG, the placement
+report) are deflated.
+
+While streaming, the archive is also written to a cache file named after a
+hash of the output set (archive names, sizes and modification times), so a
+repeat download of unchanged outputs is served straight from that file. A
+download that is interrupted leaves no cache file behind.
+"""
+import hashlib
+import os
+import tempfile
+import zipfile
+
+# Extensions whose contents are already compressed
+STORED_EXTENSIONS = {'.png', '.pdf', '.jpg', '.jpeg', '.zip'}
+
+# Bytes read from a member per chunk
+CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object collecting what ZipFile writes."""
+
+    def __init__(self, tee=None):
+        self._chunks = []
+        self._tee = tee
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            if self._tee is not None:
+                self._tee.write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def compress_type_for(archive_name):
+    """ZIP_STORED for already-compressed formats, ZIP_DEFLATED otherwise."""
+    if os.path.splitext(archive_name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def output_set_key(members):
+    """Hash identifying an archive's contents by member names, sizes and mtimes."""
+    digest = hashlib.sha256()
+    for path, archive_name in members:
+        stat = os.stat(path)
+        digest.update(f'{archive_name}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stream_zip(members, cache_path=None, compresslevel=6):
+    """Yields the bytes of a ZIP of members, a list of (path, archive name).
+
+    If cache_path is given, the archive is also written there (atomically,
+    once it is complete).
+    """
+    part_path, tee = None, None
+    if cache_path:
+        # Unique per download, so concurrent downloads of one archive never share it
+        fd, part_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.part')
+        tee = os.fdopen(fd, 'wb')
+    completed = False
+    try:
+        sink = _ChunkSink(tee)
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zipf:
+            for path, archive_name in members:
+                zinfo = zipfile.ZipInfo.from_file(path, archive_name)
+                zinfo.compress_type = compress_type_for(archive_name)
+                with open(path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                        dest.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+        data = sink.drain()
+        if data:
+            yield data
+        completed = True
+    finally:
+        if tee is not None:
+            tee.close()
+            if completed:
+                os.replace(part_path, cache_path)
+            else:
+                os.remove(part_path)